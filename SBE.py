@@ -1,8 +1,9 @@
 import numpy as np
 import os
+import time
+import shutil
+import multiprocessing as mp
 from numba import njit
-import matplotlib.pyplot as pl
-from matplotlib import patches
 from scipy.integrate import ode
 from scipy.special import erf
 from sys import exit
@@ -10,13 +11,38 @@ from sys import exit
 from hfsbe.utility import evaluate_njit_matrix as ev_mat
 
 import params
+import compile_cache
+import result_cache
+import profiling
+from analysis import emission_analysis
 import systems as sys
 from efield import driving_field
+import integrators
 '''
 TO DO:
 UPDATE MATRIX METHOD. NOT COMPATIBLE WITH CODE AS OF NOW. MAGNETIC FIELD.
 '''
-def main():
+# Output steps per block of the memory-mapped density matrix (store_all_timesteps)
+solution_chunk = 1000
+
+# Integration steps and right-hand side evaluations of all paths solved in this process
+solver_statistics = {'steps': 0, 'rhs_evaluations': 0}
+
+
+def main(params=params, paths=None, signals=None):
+    '''
+    Runs the simulation for params (the params module or any object with its 
+    attributes) and returns the time signals and emission spectra.
+    With paths[i_path, i_k, :], only these k-paths are solved instead of the 
+    mesh of params (whose E_dir and dk are used), e.g. the new k-points of a 
+    refined mesh in velocity gauge.
+    With signals = [t, A_field, P_E_dir, P_ortho, ..., I_exact_offd_ortho] 
+    summed over the mesh (e.g. merged from the work units of work_queue.py), 
+    the time evolution is skipped and only the analysis is done.
+    '''
+    start_time = time.perf_counter()
+    profiling.reset()
+
     # RETRIEVE PARAMETERS
     ###############################################################################################
     # Unit converstion factors
@@ -90,6 +116,7 @@ def main():
 
     user_out            = params.user_out
     print_J_P_I_files   = params.print_J_P_I_files
+    output_format       = params.output_format              # 'text': separate files, 'npz': one compressed file
     energy_plots        = params.energy_plots
     dipole_plots        = params.dipole_plots
     test                = params.test                       # Testing flag for Travis
@@ -99,6 +126,27 @@ def main():
     KK_emission         = params.KK_emission
     normalize_emission  = params.normalize_emission
     normalize_f_valence = params.normalize_f_valence
+    n_proc              = params.n_proc                     # Number of processes the paths are distributed on
+    batch_paths         = params.batch_paths                # Integrate all paths (of a process) as one ODE system
+    solver_method       = params.solver_method              # Time integrator: 'zvode', 'rk4' or 'dopri5'
+    rtol                = params.rtol                       # Relative tolerance of the adaptive integrators
+    atol                = params.atol                       # Absolute tolerance of the adaptive integrators
+    analytic_jacobian   = params.analytic_jacobian          # Banded analytic Jacobian for zvode
+    stream_observables  = params.stream_observables         # Evaluate observables during the time evolution
+    velocity_tables     = params.velocity_tables            # Interpolation tables for the velocity gauge
+    velocity_tables_tol = params.velocity_tables_tol        # Relative accuracy of the interpolation tables
+    use_result_cache    = params.result_cache               # Reuse the time signals of identical earlier runs
+    checkpoint          = params.checkpoint                 # Periodic checkpoints of the time evolution
+    checkpoint_interval = params.checkpoint_interval        # Wall-clock seconds between two checkpoints of a path
+    restart             = params.restart                    # Resume from the checkpoints of an interrupted run
+    adaptive_steps      = params.adaptive_steps             # Solver-chosen time steps, dense output at the output steps
+    max_step            = params.max_step*fs_conv           # Largest time step of adaptive_steps
+    symmetry_reduction  = params.symmetry_reduction         # Solve only the k-paths not related by a mirror along E_dir
+    profile             = params.profile                    # Write a profile report of the run
+    model               = np.array([params.C0, params.C2, params.A, params.R, params.k_cut], dtype=float)
+                                                            # Model parameters (runtime arguments of a parametric system)
+    if not sys.parametric and np.any(model != sys.model_values):
+        exit("Model parameters differing from params.py need parametric_system = True")
 
     # USER OUTPUT
     ###############################################################################################
@@ -123,31 +171,33 @@ def main():
     # Form the E-field direction
 
     # Form the Brillouin zone in consideration
-    if BZ_type == 'full':
-        kpnts, paths = hex_mesh(Nk1, Nk2, a, b1, b2, align)
-        dk = 1/Nk1
-        if align == 'K':
-            E_dir = np.array([1, 0])
-        elif align == 'M':
-            E_dir = np.array([np.cos(np.radians(-30)),
-                             np.sin(np.radians(-30))])
-    elif BZ_type == 'full_for_velocity':
-        E_dir = np.array([np.cos(np.radians(angle_inc_E_field)),
-                         np.sin(np.radians(angle_inc_E_field))])
-        kpnts, paths = hex_mesh(Nk1, Nk2, a, b1, b2, 'M')
-        # dummy
-        dk = 1
-    elif BZ_type == '2line':
-        E_dir = np.array([np.cos(np.radians(angle_inc_E_field)),
-                         np.sin(np.radians(angle_inc_E_field))])
-        dk, kpnts, paths = mesh(params, E_dir)
+    with profiling.phase('mesh'):
+        E_dir, dk, kpnts, mesh_paths = bz_mesh(params)
+    # Checkpoints and stored density matrices of a run are kept in directories keyed on 
+    # its parameters (and on its paths if they are not the mesh of params)
+    run_key = result_cache.run_key(params)
+    path_weights = None
+    if paths is None:
+        paths = mesh_paths
+        if symmetry_reduction:
+            # Only the paths that are not mirror images of each other are solved
+            lattice = None if BZ_type == '2line' else (b1, b2)
+            paths, path_weights = irreducible_paths(mesh_paths, E_dir, model, lattice)
+            if user_out:
+                print("Symmetry-reduced mesh: " + str(len(paths)) + " of " + str(len(mesh_paths)) + " k-paths")
+    else:
+        # The result cache is keyed on params, i.e. on the full mesh
+        paths = np.array(paths)
+        kpnts = np.reshape(paths, (-1, 2))
+        use_result_cache = False
+        run_key += '-' + compile_cache.key_hash(paths.tobytes())
 
     if energy_plots:
-        sys.system.evaluate_energy(kpnts[:, 0], kpnts[:, 1])
-        sys.system.plot_bands_3d(kpnts[:, 0], kpnts[:, 1])
-        sys.system.plot_bands_contour(kpnts[:, 0], kpnts[:, 1])
+        sys.system.evaluate_energy(kpnts[:, 0], kpnts[:, 1], **sys.model_kwargs(model))
+        sys.system.plot_bands_3d(kpnts[:, 0], kpnts[:, 1], **sys.model_kwargs(model))
+        sys.system.plot_bands_contour(kpnts[:, 0], kpnts[:, 1], **sys.model_kwargs(model))
     if dipole_plots:
-        Ax, Ay = sys.dipole.evaluate(kpnts[:, 0], kpnts[:, 1])
+        Ax, Ay = sys.dipole.evaluate(kpnts[:, 0], kpnts[:, 1], **sys.model_kwargs(model))
         sys.dipole.plot_dipoles(Ax, Ay)
 
     if store_all_timesteps:
@@ -165,367 +215,90 @@ def main():
             I_wavep_E_dir, I_wavep_ortho, I_wavep_check_E_dir, I_wavep_check_ortho = \
     [], [], [], [], [], [], [], [], [], [], [], [], [], []
 
-    # here,the time evolution of the density matrix is done
-    t, A_field, P_E_dir, P_ortho, J_E_dir, J_ortho, I_exact_E_dir, I_exact_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho = \
-                time_evolution(t0, tf, dt, paths, user_out, E_dir, e_fermi, temperature, dk, 
-                               gamma1, gamma2, E0, B0, w, chirp, alpha, phase, do_B_field, gauge, normalize_f_valence, dt_out, BZ_type, Nk1, Nk_in_path, 
-                               Bcurv_in_B_dynamics, 'density_matrix_dynamics', 
-                               P_E_dir, P_ortho, J_E_dir, J_ortho, I_exact_E_dir, I_exact_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho, KK_emission)
-
-    # Approximate emission in time
-    I_E_dir, I_ortho = diff(t,P_E_dir)*Gaussian_envelope(t,alpha) + J_E_dir*Gaussian_envelope(t,alpha), \
-                       diff(t,P_ortho)*Gaussian_envelope(t,alpha) + J_ortho*Gaussian_envelope(t,alpha)
-
-    # Fourier transforms
-    dt_out   = t[1]-t[0]
-    freq     = np.fft.fftshift(np.fft.fftfreq(np.size(t), d=dt_out))
-    Iw_E_dir = np.fft.fftshift(np.fft.fft(I_E_dir, norm='ortho'))
-    Iw_ortho = np.fft.fftshift(np.fft.fft(I_ortho, norm='ortho'))
-    Pw_E_dir = np.fft.fftshift(np.fft.fft(diff(t,P_E_dir), norm='ortho'))
-    Pw_ortho = np.fft.fftshift(np.fft.fft(diff(t,P_ortho), norm='ortho'))
-    Jw_E_dir = np.fft.fftshift(np.fft.fft(J_E_dir*Gaussian_envelope(t,alpha), norm='ortho'))
-    Jw_ortho = np.fft.fftshift(np.fft.fft(J_ortho*Gaussian_envelope(t,alpha), norm='ortho'))
-    Iw_exact_E_dir      = np.fft.fftshift(np.fft.fft(I_exact_E_dir*Gaussian_envelope(t,alpha), norm='ortho'))
-    Iw_exact_ortho      = np.fft.fftshift(np.fft.fft(I_exact_ortho*Gaussian_envelope(t,alpha), norm='ortho'))
-    Iw_exact_diag_E_dir = np.fft.fftshift(np.fft.fft(I_exact_diag_E_dir*Gaussian_envelope(t,alpha), norm='ortho'))
-    Iw_exact_diag_ortho = np.fft.fftshift(np.fft.fft(I_exact_diag_ortho*Gaussian_envelope(t,alpha), norm='ortho'))
-    Iw_exact_offd_E_dir = np.fft.fftshift(np.fft.fft(I_exact_offd_E_dir*Gaussian_envelope(t,alpha), norm='ortho'))
-    Iw_exact_offd_ortho = np.fft.fftshift(np.fft.fft(I_exact_offd_ortho*Gaussian_envelope(t,alpha), norm='ortho'))
-
-    Iw_r = []
-    angles = np.linspace(0,2.0*np.pi,361)
-    for angle in angles:
-       Iw_r.append(np.fft.fftshift(np.fft.fft( Gaussian_envelope(t,alpha) * (I_exact_E_dir*np.cos(angle) + I_exact_ortho*np.sin(-angle)))) )
-    Iw_r = np.array(Iw_r)
-
-    if do_emission_wavep:
-       Iw_wavep_E_dir = np.fft.fftshift(np.fft.fft(I_wavep_E_dir*Gaussian_envelope(t,alpha), norm='ortho'))
-       Iw_wavep_ortho = np.fft.fftshift(np.fft.fft(I_wavep_ortho*Gaussian_envelope(t,alpha), norm='ortho'))
-       Iw_wavep_check_E_dir = np.fft.fftshift(np.fft.fft(I_wavep_check_E_dir*Gaussian_envelope(t,alpha), norm='ortho'))
-       Iw_wavep_check_ortho = np.fft.fftshift(np.fft.fft(I_wavep_check_ortho*Gaussian_envelope(t,alpha), norm='ortho'))
-
-    if BZ_type == '2line':
-        # include k-point weights
-        kpoint_weight = 2*rel_dist_to_Gamma*length_path_in_BZ/(Nk_in_path-1)
-        Pw_E_dir            = Pw_E_dir*kpoint_weight
-        Pw_ortho            = Pw_ortho*kpoint_weight
-        Jw_E_dir            = Jw_E_dir*kpoint_weight
-        Jw_ortho            = Jw_ortho*kpoint_weight
-        Iw_E_dir            = Iw_E_dir*kpoint_weight
-        Iw_ortho            = Iw_ortho*kpoint_weight
-        Iw_exact_E_dir      = Iw_exact_E_dir*kpoint_weight
-        Iw_exact_ortho      = Iw_exact_ortho*kpoint_weight
-        Iw_exact_diag_E_dir = Iw_exact_diag_E_dir*kpoint_weight
-        Iw_exact_diag_ortho = Iw_exact_diag_ortho*kpoint_weight
-        Iw_exact_offd_E_dir = Iw_exact_offd_E_dir*kpoint_weight
-        Iw_exact_offd_ortho = Iw_exact_offd_ortho*kpoint_weight
-
-    # Emission intensity (exact formula)
-    prefac_emission      = 1/(3*(137.036**3)) # 1/(3c^3) in atomic units
-    Int_exact_E_dir      = prefac_emission*np.abs((freq**2)*Iw_exact_E_dir**2.0)
-    Int_exact_ortho      = prefac_emission*np.abs((freq**2)*Iw_exact_ortho**2.0)
-    Int_exact_diag_E_dir = prefac_emission*np.abs((freq**2)*Iw_exact_diag_E_dir**2.0)
-    Int_exact_diag_ortho = prefac_emission*np.abs((freq**2)*Iw_exact_diag_ortho**2.0)
-    Int_exact_offd_E_dir = prefac_emission*np.abs((freq**2)*Iw_exact_offd_E_dir**2.0)
-    Int_exact_offd_ortho = prefac_emission*np.abs((freq**2)*Iw_exact_offd_ortho**2.0)
-    Int_E_dir            = prefac_emission*np.abs((freq**2)*Iw_E_dir**2.0)
-    Int_ortho            = prefac_emission*np.abs((freq**2)*Iw_ortho**2.0)
-
-    freq_indices_near_base_freq = np.argwhere(np.logical_and(freq/w > 0.9, freq/w < 1.1))
-    freq_index_base_freq = int((freq_indices_near_base_freq[0] + freq_indices_near_base_freq[-1])/2)
-    if normalize_emission:
-        Int_tot_base_freq = Int_exact_E_dir[freq_index_base_freq] + Int_exact_ortho[freq_index_base_freq]
-        log_limits = (1e-7,1e1)
+    checkpoint_dir = None
+    if checkpoint:
+        checkpoint_dir = os.path.join(params.checkpoint_dir, run_key)
+
+    # Memory-mapped density matrices of all time steps
+    solution_dir = None
+    if store_all_timesteps:
+        solution_dir = os.path.join(params.solution_dir, run_key)
+        if user_out:
+            print("Density matrices are stored in " + solution_dir)
+
+    # Time signals of an identical earlier run
+    if signals is None and use_result_cache:
+        with profiling.phase('result cache'):
+            signals = result_cache.load(params)
+        if signals is not None and user_out:
+            print("Time signals loaded from the result cache")
+
+    if signals is not None:
+        t, A_field, P_E_dir, P_ortho, J_E_dir, J_ortho, I_exact_E_dir, I_exact_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho = \
+                    signals
     else:
-        # no normalization at all, no k-point weights
-        Int_tot_base_freq = 1
-
-        I_max = (Int_exact_E_dir[freq_index_base_freq] + Int_exact_ortho[freq_index_base_freq]) / Int_tot_base_freq
-
-        freq_indices_near_base_freq = np.argwhere(np.logical_and(freq/w > 19.9, freq/w < 20.1))
-        freq_index_base_freq = int((freq_indices_near_base_freq[0] + freq_indices_near_base_freq[-1])/2)
-        I_min = (Int_exact_E_dir[freq_index_base_freq] + Int_exact_ortho[freq_index_base_freq] ) / Int_tot_base_freq
-
-        log_limits = ( 10**(np.ceil(np.log10(I_min))-2) , 10**(np.ceil(np.log10(I_max)) + 1) )
-
-    # Save observables to file
-    if (BZ_type == '2line'):
-        Nk1 = Nk_in_path
-        Nk2 = 2
-
-    if print_J_P_I_files:  
-        J_filename = str('J_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
-        np.save(J_filename, [t/fs_conv, J_E_dir, J_ortho, freq/w, Jw_E_dir, Jw_ortho])
-        P_filename = str('P_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
-        np.save(P_filename, [t/fs_conv, P_E_dir, P_ortho, freq/w, Pw_E_dir, Pw_ortho])
-        I_filename = str('I_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
-        np.save(I_filename, [t/fs_conv, I_E_dir, I_ortho, freq/w, np.abs(Int_E_dir), np.abs(Int_ortho), Int_E_dir, Int_ortho])
-
-        J_filename = str('J_KK_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
-        np.savetxt(J_filename, np.c_[freq/w, np.abs(freq**2*Jw_E_dir**2)/Int_tot_base_freq, np.abs(freq**2*Jw_ortho**2)/Int_tot_base_freq])
-        P_filename = str('P_KK_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
-        np.savetxt(P_filename, np.c_[freq/w, np.abs(freq**2*Pw_E_dir**2)/Int_tot_base_freq, np.abs(freq**2*Pw_ortho**2)/Int_tot_base_freq])
-        I_filename = str('I_KK_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
-        np.savetxt(I_filename, np.c_[freq/w, np.abs(Int_E_dir)/Int_tot_base_freq, np.abs(Int_ortho)/Int_tot_base_freq, (np.abs(Int_E_dir)+np.abs(Int_ortho))/Int_tot_base_freq])
-        Iex_filename = str('I_ex_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
-        np.savetxt(Iex_filename, np.c_[freq/w, np.abs(Int_exact_E_dir)/Int_tot_base_freq, np.abs(Int_exact_ortho)/Int_tot_base_freq, 
-                                      (np.abs(Int_exact_E_dir)+np.abs(Int_exact_ortho))/Int_tot_base_freq ])
-        Iex_diag_filename = str('I_ex_diag_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
-        np.savetxt(Iex_diag_filename, np.c_[freq/w, np.abs(Int_exact_diag_E_dir)/Int_tot_base_freq, np.abs(Int_exact_diag_ortho)/Int_tot_base_freq, 
-                                      (np.abs(Int_exact_diag_E_dir)+np.abs(Int_exact_diag_ortho))/Int_tot_base_freq ])
-        Iex_offd_filename = str('I_ex_offd_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
-        np.savetxt(Iex_offd_filename, np.c_[freq/w, np.abs(Int_exact_offd_E_dir)/Int_tot_base_freq, np.abs(Int_exact_offd_ortho)/Int_tot_base_freq, 
-                                      (np.abs(Int_exact_offd_E_dir)+np.abs(Int_exact_offd_ortho))/Int_tot_base_freq ])
-
-    if (not test and user_out):
-        real_fig, (axE,axA,axP,axPdot,axJ) = pl.subplots(5,1,figsize=(10,10))
-        t_lims = (-10*alpha/fs_conv, 10*alpha/fs_conv)
-        freq_lims = (0,25)
-        axE.set_xlim(t_lims)
-        axE.plot(t/fs_conv, driving_field(E0, t)/E_conv)
-        axE.set_xlabel(r'$t$ in fs')
-        axE.set_ylabel(r'$E$-field in MV/cm')
-        axA.set_xlim(t_lims)
-        axA.plot(t/fs_conv,A_field/E_conv/fs_conv)
-        axA.set_xlabel(r'$t$ in fs')
-        axA.set_ylabel(r'$A$-field in MV/cm$\cdot$fs')
-        axP.set_xlim(t_lims)
-        axP.plot(t/fs_conv,P_E_dir)
-        axP.plot(t/fs_conv,P_ortho)
-        axP.set_xlabel(r'$t$ in fs')
-        axP.set_ylabel(r'$P$ in atomic units $\parallel \mathbf{E}_{in}$ (blue), $\bot \mathbf{E}_{in}$ (orange)')
-        axPdot.set_xlim(t_lims)
-        axPdot.plot(t/fs_conv,diff(t,P_E_dir))
-        axPdot.plot(t/fs_conv,diff(t,P_ortho))
-        axPdot.set_xlabel(r'$t$ in fs')
-        axPdot.set_ylabel(r'$\dot P$ in atomic units $\parallel \mathbf{E}_{in}$ (blue), $\bot \mathbf{E}_{in}$ (orange)')
-        axJ.set_xlim(t_lims)
-        axJ.plot(t/fs_conv,J_E_dir)
-        axJ.plot(t/fs_conv,J_ortho)
-        axJ.set_xlabel(r'$t$ in fs')
-        axJ.set_ylabel(r'$J$ in atomic units $\parallel \mathbf{E}_{in}$ (blue), $\bot \mathbf{E}_{in}$ (orange)')
-
-##########################
-
-        if do_B_field:
-           label_emission_E_dir = '$I_{\parallel E}(t) = q\sum_{nn\'}\int d\mathbf{k}\;\langle n\overline{\mathbf{k}}_n(t)|\hat{e}_E\cdot \partial h/\partial \mathbf{k}|n\'\overline{\mathbf{k}}_{n\'}(t) \\rangle\\varrho_{nn\'}(\mathbf{k};t)$'
-           label_emission_ortho = '$I_{\\bot E}(t) = q\sum_{nn\'}\int d\mathbf{k}\;\langle n\overline{\mathbf{k}}_n(t)|\hat{e}_{\\bot E}\cdot \partial h/\partial \mathbf{k}|n\'\overline{\mathbf{k}}_{n\'}(t) \\rangle\\varrho_{nn\'}(\mathbf{k};t)$'
-        else:
-           label_emission_E_dir = '$I_{\parallel E}(t) = q\sum_{nn\'}\int d\mathbf{k}\;\langle u_{n\mathbf{k}}|\hat{e}_E\cdot \partial h/\partial \mathbf{k}|u_{n\'\mathbf{k}} \\rangle\\rho_{nn\'}(\mathbf{k},t)$'
-           label_emission_ortho = '$I_{\\bot E}(t) = q\sum_{nn\'}\int d\mathbf{k}\;\langle u_{n\mathbf{k}}|\hat{e}_{\\bot E}\cdot \partial h/\partial \mathbf{k}|u_{n\'\mathbf{k}} \\rangle\\rho_{nn\'}(\mathbf{k},t)$'
-
-        if KK_emission:
-           five_fig, ((ax_I_E_dir,ax_I_ortho,ax_I_total)) = pl.subplots(3,1,figsize=(10,10))
-           ax_I_E_dir.grid(True,axis='x')
-           ax_I_E_dir.set_xlim(freq_lims)
-           ax_I_E_dir.set_ylim(log_limits)
-           ax_I_E_dir.semilogy(freq/w,Int_exact_E_dir / Int_tot_base_freq, label=label_emission_E_dir)
-           ax_I_E_dir.semilogy(freq/w, Int_exact_diag_E_dir / Int_tot_base_freq,
-               label='$I_{\mathrm{intra}\parallel E}(t) = q\sum_{n= n\'}\int d\mathbf{k}\;\langle u_{n\mathbf{k}}|\hat{e}_E\cdot \partial h/\partial \mathbf{k}|u_{n\'\mathbf{k}} \\rangle\\rho_{nn\'}(\mathbf{k},t)$')
-           ax_I_E_dir.semilogy(freq/w, Int_exact_offd_E_dir / Int_tot_base_freq, linestyle='dashed',
-               label='$I_{\mathrm{inter}\parallel E}(t) = q\sum_{n\\neq n\'}\int d\mathbf{k}\;\langle u_{n\mathbf{k}}|\hat{e}_E\cdot \partial h/\partial \mathbf{k}|u_{n\'\mathbf{k}} \\rangle\\rho_{nn\'}(\mathbf{k},t)$')
-
-           if not do_B_field:
-              ax_I_E_dir.semilogy(freq/w, Int_E_dir / Int_tot_base_freq, 
-                 label='$I_{\mathrm{i+i} \parallel E}(t) = I_{\mathrm{intra} \parallel E}(t) + I_{\mathrm{inter} \parallel E}(t)$')
-              ax_I_E_dir.semilogy(freq/w, prefac_emission*np.abs(freq**2*Jw_E_dir**2) / Int_tot_base_freq,  linestyle='dashed',
-                 label='$I_{\mathrm{intra} \parallel E}(t) = q\sum_{n}\int d\mathbf{k}\; \hat{e}_E\cdot\partial \\epsilon_n/\partial\mathbf{k}\;\\rho_{nn(\mathbf{k},t)}$')
-              ax_I_E_dir.semilogy(freq/w, prefac_emission*np.abs(freq**2*Pw_E_dir**2) / Int_tot_base_freq, linestyle='dashed', 
-                 label='$I_{\mathrm{inter} \parallel E}(t) = \sum_{n\\neq n\'}\int d\mathbf{k}\;\hat{e}_E\cdot \mathbf{d}_{nn\'}(\mathbf{k})\dot\\rho_{n\'n(\mathbf{k},t)}$')
-           ax_I_E_dir.set_xlabel(r'Frequency $\omega/\omega_0$')
-           ax_I_E_dir.set_ylabel(r'Emission $I_{\parallel E}(\omega)$ in E-field direction')
-           ax_I_E_dir.legend(loc='upper right')
-           ax_I_ortho.grid(True,axis='x')
-           ax_I_ortho.set_xlim(freq_lims)
-           ax_I_ortho.set_ylim(log_limits)
-           ax_I_ortho.semilogy(freq/w,Int_exact_ortho / Int_tot_base_freq, label=label_emission_ortho)
-           ax_I_ortho.semilogy(freq/w, Int_exact_diag_ortho / Int_tot_base_freq,
-               label='$I_{\mathrm{intra}\\bot E}(t) = q\sum_{n= n\'}\int d\mathbf{k}\;\langle u_{n\mathbf{k}}|\hat{e}_{\\bot E}\cdot \partial h/\partial \mathbf{k}|u_{n\'\mathbf{k}} \\rangle\\rho_{nn\'}(\mathbf{k},t)$')
-           ax_I_ortho.semilogy(freq/w, Int_exact_offd_ortho / Int_tot_base_freq, linestyle='dashed',
-               label='$I_{\mathrm{inter}\\bot E}(t) = q\sum_{n\\neq n\'}\int d\mathbf{k}\;\langle u_{n\mathbf{k}}|\hat{e}_{\\bot E}\cdot \partial h/\partial \mathbf{k}|u_{n\'\mathbf{k}} \\rangle\\rho_{nn\'}(\mathbf{k},t)$')
-           if not do_B_field:
-              ax_I_ortho.semilogy(freq/w,Int_ortho / Int_tot_base_freq, 
-                 label='$I_{\mathrm{i+i} \\bot E}(t) = I_{\mathrm{intra} \\bot E}(t) + I_{\mathrm{inter} \\bot E}(t)$')
-              ax_I_ortho.semilogy(freq/w, prefac_emission*np.abs(freq**2*Jw_ortho**2) / Int_tot_base_freq,  linestyle='dashed',
-                 label='$I_{\mathrm{intra} \\bot E}(t) = q\sum_{n}\int d\mathbf{k}\; \hat{e}_{\\bot E}\cdot\partial \\epsilon_n/\partial\mathbf{k}\;\\rho_{nn(\mathbf{k},t)}$')
-              ax_I_ortho.semilogy(freq/w, prefac_emission*np.abs(freq**2*Pw_ortho**2) / Int_tot_base_freq, linestyle='dashed',
-                 label='$I_{\mathrm{inter} \\bot E}(t) = \sum_{n\\neq n\'}\int d\mathbf{k}\;\hat{e}_{\\bot E}\cdot \mathbf{d}_{nn\'}(\mathbf{k})\dot\\rho_{n\'n(\mathbf{k},t)}$')
-           ax_I_ortho.set_xlabel(r'Frequency $\omega/\omega_0$')
-           ax_I_ortho.set_ylabel(r'Emission $I_{\bot E}(\omega)$ $\bot$ to E-field direction')
-           ax_I_ortho.legend(loc='upper right')
-           ax_I_total.grid(True,axis='x')
-           ax_I_total.set_xlim(freq_lims)
-           ax_I_total.set_ylim(log_limits)
-           ax_I_total.semilogy(freq/w,(Int_exact_E_dir + Int_exact_ortho) / Int_tot_base_freq, 
-              label='$I(\omega) = I_{\parallel E}(\omega) + I_{\\bot E}(\omega)$')
-           if not do_B_field:
-              ax_I_total.semilogy(freq/w,(Int_E_dir+Int_ortho) / Int_tot_base_freq, 
-                 label='$I_{\mathrm{i+i}}(t) = I_{\mathrm{i+i} \parallel E}(t) + I_{\mathrm{i+i} \\bot E}(t)$')
-           ax_I_total.set_xlabel(r'Frequency $\omega/\omega_0$')
-           ax_I_total.set_ylabel(r'Total emission $I(\omega)$')
-           ax_I_total.legend(loc='upper right')
-   
-           pl.savefig("emission_KKR.pdf", dpi=300)
-
-
-        B_fig_all_in_one, ((B_1)) = pl.subplots(1,1,figsize=(10,4))
-        B_1.semilogy(freq/w,Int_exact_E_dir / Int_tot_base_freq, label=label_emission_E_dir)
-        B_1.semilogy(freq/w,Int_exact_ortho / Int_tot_base_freq, label=label_emission_ortho)
-        B_1.semilogy(freq/w,(Int_exact_E_dir + Int_exact_ortho) / Int_tot_base_freq, 
-            label='$I(\omega) = I_{\parallel E}(\omega) + I_{\\bot E}(\omega)$')
-        B_1.set_xlabel(r'Frequency $\omega/\omega_0$')
-        B_1.set_ylabel(r'Relative emission intensity $I(\omega)$')
-        B_1.legend(loc='upper right')
-        B_1.grid(True,axis='x')
-        B_1.set_xlim(freq_lims)
-        B_1.set_ylim(log_limits)
-
-        pl.savefig("emission_exact.pdf", dpi=300)
-
-        if do_emission_wavep:
-
-           six_fig, ((sc_I_E_dir,sc_I_ortho,sc_I_total)) = pl.subplots(3,1,figsize=(10,10))
-           sc_I_E_dir.grid(True,axis='x')
-           sc_I_E_dir.set_xlim(freq_lims)
-           sc_I_E_dir.set_ylim(log_limits)
-           sc_I_E_dir.semilogy(freq/w,np.abs(freq**2*Iw_exact_E_dir**2) / Int_tot_base_freq, 
-            label='$I_{\parallel E}^\mathrm{full}(t) = q\sum_{nn\'}\int d\mathbf{k}\;\langle u_{n\mathbf{k}}|\hat{e}_E\cdot \partial h/\partial \mathbf{k}|_{\mathbf{k}-\mathbf{A}(t)}|u_{n\'\mathbf{k}} \\rangle\\rho_{nn\'}(\mathbf{k},t)$')
-           sc_I_E_dir.semilogy(freq/w, np.abs(freq**2*Iw_wavep_check_E_dir**2) / Int_tot_base_freq, linestyle='dotted', 
-             label='$I_{\parallel E}^\mathrm{wavep}(t) = q\sum_{nn\'}\int d\mathbf{k}\;\langle u_{n\mathbf{k}}|\hat{e}_E\cdot \partial h/\partial \mathbf{k}|_{\mathbf{k}-\mathbf{A}(t)}|u_{n\'\mathbf{k}} \\rangle\\tilde{\\rho}_{nn\'}(\mathbf{k},t)$ with $\\tilde{\\rho}_{nn\'}(\mathbf{k}(t),t)$ from wf.~dyn.')
-           sc_I_E_dir.semilogy(freq/w, np.abs(freq**2*Iw_wavep_E_dir**2) / Int_tot_base_freq, linestyle='dotted',
-              label='$I_{\parallel E}^\mathrm{wavep check}(t) = q\sum_{nn\'}\int d\mathbf{k}\;\langle n\mathbf{k}(t),t|\hat{e}_E\cdot \partial h/\partial \mathbf{k}|_{\mathbf{k}-\mathbf{A}(t)}|n\mathbf{k}(t),t \\rangle f_{n}(\mathbf{k}(t)) $')
-           sc_I_E_dir.set_xlabel(r'Frequency $\omega/\omega_0$')
-           sc_I_E_dir.set_ylabel(r'Emission $I_{\parallel E}(\omega)$ in E-field direction')
-           sc_I_E_dir.legend(loc='lower right')
-   
-           sc_I_ortho.grid(True,axis='x')
-           sc_I_ortho.set_xlim(freq_lims)
-           sc_I_ortho.set_ylim(log_limits)
-           sc_I_ortho.semilogy(freq/w,np.abs(freq**2*Iw_exact_ortho**2) / Int_tot_base_freq, 
-            label='$I_{\\bot E}^\mathrm{full}(t) = q\sum_{nn\'}\int d\mathbf{k}\;\langle u_{n\mathbf{k}}|\hat{e}_{\\bot E}\cdot \partial h/\partial \mathbf{k}|_{\mathbf{k}-\mathbf{A}(t)}|u_{n\'\mathbf{k}} \\rangle\\rho_{nn\'(\mathbf{k},t)}$')
-           sc_I_ortho.semilogy(freq/w, np.abs(freq**2*Iw_wavep_check_ortho**2) / Int_tot_base_freq, linestyle='dotted',
-              label='$I_{\\bot E}^\mathrm{wavep}(t)$')
-           sc_I_ortho.semilogy(freq/w, np.abs(freq**2*Iw_wavep_ortho**2) / Int_tot_base_freq, linestyle='dotted',
-              label='$I_{\\bot E}^\mathrm{wavep check}(t)$')
-           sc_I_ortho.set_xlabel(r'Frequency $\omega/\omega_0$')
-           sc_I_ortho.set_ylabel(r'Emission $I_{\parallel E}(\omega)$ in E-field direction')
-           sc_I_ortho.legend(loc='lower right')
-   
-           sc_I_total.grid(True,axis='x')
-           sc_I_total.set_xlim(freq_lims)
-           sc_I_total.set_ylim(log_limits)
-           sc_I_total.semilogy(freq/w,np.abs(freq**2*(Iw_exact_E_dir**2 + Iw_exact_ortho**2)) / Int_tot_base_freq, 
-            label='$I^\mathrm{full}(\omega) = I_{\parallel E}^\mathrm{full}(\omega) + I_{\\bot E}^\mathrm{full}(\omega)$')
-           sc_I_total.semilogy(freq/w,np.abs(freq**2*(Iw_wavep_check_E_dir**2 + Iw_wavep_check_ortho**2)) / Int_tot_base_freq, linestyle='dotted',
-            label='$I^\mathrm{wavep}(\omega) = I^\mathrm{wavep}_{\parallel E}(\omega) + I^\mathrm{wavep}_{\\bot E}(\omega)$')
-           sc_I_total.semilogy(freq/w,np.abs(freq**2*(Iw_wavep_E_dir**2 + Iw_wavep_ortho**2)) / Int_tot_base_freq, linestyle='dotted',
-            label='$I^\mathrm{wavep check}(\omega) = I^\mathrm{wavep check}_{\parallel E}(\omega) + I^\mathrm{wavep}_{\\bot E}(\omega)$')
-           sc_I_total.set_xlabel(r'Frequency $\omega/\omega_0$')
-           sc_I_total.set_ylabel(r'Total emission $I(\omega)$')
-           sc_I_total.legend(loc='lower right')
-
-######################äää
-
-#        kp_array = length_path_in_BZ*np.linspace(-0.5 + (1/(2*Nk_in_path)), 0.5 - (1/(2*Nk_in_path)), num = Nk_in_path)
-#        # Countour plots of occupations and gradients of occupations
-#        fig5 = pl.figure()
-#        X, Y = np.meshgrid(t/fs_conv,kp_array)
-#        pl.contourf(X, Y, np.real(solution[:,0,:,3]), 100)
-#        pl.colorbar().set_label(r'$f_e(k)$ in path 0')
-#        pl.xlim([-5*alpha/fs_conv,10*alpha/fs_conv])
-#        pl.xlabel(r'$t\;(fs)$')
-#        pl.ylabel(r'$k$')
-#        pl.tight_layout()
-
-
-
-    if (not test and user_out):
-       # High-harmonic emission polar plots
-       polar_fig = pl.figure(figsize=(10, 10))
-
-    i_loop = 1
-    i_max = 30
-    while i_loop <= i_max:
-        freq_indices = np.argwhere(np.logical_and(freq/w > float(i_loop)-0.1, freq/w < float(i_loop)+0.1))
-        freq_index   = freq_indices[int(np.size(freq_indices)/2)]
-
-        if (not test and user_out):
-           pax          = polar_fig.add_subplot(1,i_max,i_loop,projection='polar')
-           pax.plot(angles,np.abs(Iw_r[:,freq_index]))
-           rmax = pax.get_rmax()
-           pax.set_rmax(1.1*rmax)
-           pax.set_yticklabels([""])
-           if i_loop == 1:
-               pax.set_rgrids([0.25*rmax,0.5*rmax,0.75*rmax,1.0*rmax],labels=None, angle=None, fmt=None)
-               pax.set_title('HH'+str(i_loop), va='top', pad=30)
-               pax.set_xticks(np.arange(0,2.0*np.pi,np.pi/6.0))
-           else:
-               pax.set_rgrids([0.0],labels=None, angle=None, fmt=None)
-               pax.set_xticks(np.arange(0,2.0*np.pi,np.pi/2.0))
-               pax.set_xticklabels([""])
-               pax.set_title('HH'+str(i_loop), va='top', pad=15)
-
-        if print_J_P_I_files:
-
-           if i_loop < 10:
-              polar_filename = 'polar_0'+str(i_loop)
-           else:
-              polar_filename = 'polar_'+str(i_loop)
-           np.savetxt (polar_filename, np.c_[ angles/np.pi*180, np.abs(Iw_r[:,freq_index])/np.amax(np.abs(Iw_r[:,freq_index])) ]  )
-
-        i_loop += 1
-
-    if print_J_P_I_files:
-
-       Int_exact_total = Int_exact_E_dir + Int_exact_ortho
-
-       local_maxima = []
-
-       for i_freq in range(np.size(Int_exact_total)-1):
-
-           if Int_exact_total[i_freq] > Int_exact_total[i_freq-1] and Int_exact_total[i_freq] > Int_exact_total[i_freq+1]:
-             local_maxima.append(i_freq)
-
-       for local_maximum in local_maxima:
-
-           if freq[local_maximum]/w < 0:
-              continue
-
-           if freq[local_maximum]/w < 10:
-              polar_filename = 'polar_0'+str('{:1.2f}').format(freq[local_maximum]/w)
-           else:
-              polar_filename = 'polar_'+str('{:2.2f}').format(freq[local_maximum]/w)
-
-           np.savetxt (polar_filename, np.c_[ angles/np.pi*180, np.abs(Iw_r[:,local_maximum])/np.amax(np.abs(Iw_r[:,local_maximum])) ]  )
-
-
-    if (not test and user_out):
-
-        # Plot Brilluoin zone with paths
-        BZ_plot(kpnts,a,b1,b2,E_dir,paths)
-
-        pl.show()
-
-    # OUTPUT STANDARD TEST VALUES
-    ##############################################################################################
-    if test:
-        t_zero = np.argwhere(t == 0)
-        f5 = np.argwhere(np.logical_and(freq/w > 4.9, freq/w < 5.1))
-        f125 = np.argwhere(np.logical_and(freq/w > 12.4, freq/w < 12.6))
-        f15= np.argwhere(np.logical_and(freq/w > 14.9, freq/w < 15.1))
-        f_5 = f5[int(np.size(f5)/2)]
-        f_125 = f125[int(np.size(f125)/2)]
-        f_15 = f15[int(np.size(f15)/2)]
-        test_out = np.zeros(6, dtype=[('names','U16'),('values',float)])
-        test_out['names'] = np.array(['P(t=0)','J(t=0)','N_gamma(t=tf)','Emis(w/w0=5)','Emis(w/w0=12.5)','Emis(w/w0=15)'])
-        test_out['values'] = np.array([pol[t_zero],curr[t_zero],N_gamma[Nt-1],emis[f_5],emis[f_125],emis[f_15]])
-        np.savetxt('test.dat',test_out, fmt='%16s %.16e')
+        # here,the time evolution of the density matrix is done
+        with profiling.phase('time evolution'):
+            t, A_field, P_E_dir, P_ortho, J_E_dir, J_ortho, I_exact_E_dir, I_exact_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho = \
+                        time_evolution(t0, tf, dt, paths, user_out, E_dir, e_fermi, temperature, dk, 
+                                       gamma1, gamma2, E0, B0, w, chirp, alpha, phase, do_B_field, gauge, normalize_f_valence, dt_out, BZ_type, Nk1, params.Nk_in_path, 
+                                       Bcurv_in_B_dynamics, 'density_matrix_dynamics', 
+                                       P_E_dir, P_ortho, J_E_dir, J_ortho, I_exact_E_dir, I_exact_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho, KK_emission,
+                                       n_proc, batch_paths, solver_method, rtol, atol, analytic_jacobian, 
+                                       stream_observables, velocity_tables, velocity_tables_tol, model, 
+                                       checkpoint_dir, checkpoint_interval, restart, solution_dir, 
+                                       adaptive_steps, max_step, path_weights)
+
+        if use_result_cache:
+            with profiling.phase('result cache'):
+                result_cache.store(params, [t, A_field, P_E_dir, P_ortho, J_E_dir, J_ortho, I_exact_E_dir, I_exact_ortho, 
+                                            I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho])
+
+    # Spectra, output files and plots
+    with profiling.phase('analysis'):
+        results = emission_analysis(params, t, A_field, P_E_dir, P_ortho, J_E_dir, J_ortho, I_exact_E_dir, I_exact_ortho, 
+                                    I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho, 
+                                    do_B_field, E_dir, kpnts, paths)
+
+    if profile:
+        profile_filename = str('profile_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}.json').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
+        profiling.write_report(profile_filename, result_cache.run_key(params), time.perf_counter() - start_time, 
+                               sys.build_time)
+        if user_out:
+            print("Profile written to " + profile_filename)
+
+    return results
 
 
 def time_evolution(t0, tf, dt, paths, user_out, E_dir, e_fermi, temperature, dk, gamma1, gamma2, 
                    E0, B0, w, chirp, alpha, phase, do_B_field, gauge, normalize_f_valence, dt_out, BZ_type, Nk1, Nk_in_path, Bcurv_in_B_dynamics, 
                    dynamics_type, 
-                   P_E_dir, P_ortho, J_E_dir, J_ortho, I_exact_E_dir, I_exact_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho, KK_emission):
+                   P_E_dir, P_ortho, J_E_dir, J_ortho, I_exact_E_dir, I_exact_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho, KK_emission,
+                   n_proc=1, batch_paths=False, solver_method='zvode', rtol=1e-6, atol=1e-12, analytic_jacobian=False,
+                   stream_observables=False, velocity_tables=False, velocity_tables_tol=1e-8, model=None, 
+                   checkpoint_dir=None, checkpoint_interval=600, restart=False, solution_dir=None, 
+                   adaptive_steps=False, max_step=None, path_weights=None):
+
+    if model is None:
+        model = sys.model_values
+
+    paths = np.array(paths)
+    # Weights of the E_dir and ortho components of the observables of each path (see irreducible_paths)
+    if path_weights is None:
+        path_weights = np.ones((len(paths), 2))
+
+    # Checkpoints: each path is stored when finished and periodically during its
+    # time evolution, a restart skips the finished paths and resumes the others
+    if checkpoint_dir is not None:
+        if restart and os.path.isdir(checkpoint_dir):
+            if user_out:
+                print("Restarting from the checkpoints in " + checkpoint_dir)
+        else:
+            shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    if solution_dir is not None:
+        os.makedirs(solution_dir, exist_ok=True)
 
     if dynamics_type == 'density_matrix_dynamics' and user_out:
        print("Enter density matrix dynamics.")
@@ -535,179 +308,655 @@ def time_evolution(t0, tf, dt, paths, user_out, E_dir, e_fermi, temperature, dk,
            print("Wavefunction dynamics only implemented for velocity gauge. Script abords.")
            exit("")
 
-    # Solution containers
-    t = []
-    solution = []
-    fermi_function = []
-
-    # Number of integration steps, time array construction flag
-    Nt = int((tf-t0)/dt)
-    t_constructed = False
-
-    # Initialize the ode solver
-    solver = ode(f, jac=None).set_integrator('zvode', method='bdf', max_step=dt)
+    # Arguments shared by all paths, the path itself, its number and its 
+    # number of k-points per path are prepended
+    path_args = (t0, tf, dt, user_out, E_dir, e_fermi, temperature, dk, gamma1, gamma2, 
+                 E0, B0, w, chirp, alpha, phase, do_B_field, gauge, normalize_f_valence, dt_out, Bcurv_in_B_dynamics, 
+                 dynamics_type, KK_emission, solver_method, rtol, atol, analytic_jacobian, stream_observables, 
+                 velocity_tables, velocity_tables_tol, model, checkpoint_dir, checkpoint_interval, solution_dir, 
+                 adaptive_steps, max_step)
+    Nk_path = np.size(paths[0][:, 0])
+    if batch_paths:
+        # Concatenate the paths (one batch per process) and integrate each batch
+        # as a single ODE system. Neighbours in fnumba stay within each path.
+        # Paths with different weights are in different batches.
+        batches, task_weights = [], []
+        for weights in np.unique(path_weights, axis=0):
+            group = paths[np.all(path_weights == weights, axis=1)]
+            for batch in np.array_split(group, min(n_proc, len(group))):
+                batches.append(batch)
+                task_weights.append(weights)
+        tasks = [(batch.reshape(-1, 2), batch_num, Nk_path) + path_args 
+                 for batch_num, batch in enumerate(batches, start=1)]
+    else:
+        task_weights = path_weights
+        tasks = [(path, path_num, Nk_path) + path_args for path_num, path in enumerate(paths, start=1)]
 
     # SOLVING
     ###########################################################################
-    # Iterate through each path in the Brillouin zone
-    path_num = 1
-    for path in paths:
+    # Paths are independent of each other: in length gauge only the k-points 
+    # within a path are coupled, in velocity gauge no k-points are coupled at all
+    if n_proc > 1 and len(tasks) > 1:
         if user_out:
-            print('path: ' + str(path_num))
-
-        # Solution container for the current path
-        path_solution = []
-        path_fermi_function = []
-
-        # Retrieve the set of k-points for the current path
-        kx_in_path = path[:, 0]
-        ky_in_path = path[:, 1]
-
-        # Calculate the dipole components along the path
-        di_x, di_y = sys.dipole.evaluate(kx_in_path, ky_in_path)
-
-        # Calculate the dot products E_dir.d_nm(k).
-        # To be multiplied by E-field magnitude later.
-        # A[0,1,:] means 0-1 offdiagonal element
-        dipole_in_path = (E_dir[0]*di_x[0, 1, :] + E_dir[1]*di_y[0, 1, :])
-        A_in_path = E_dir[0]*di_x[0, 0, :] + E_dir[1]*di_y[0, 0, :] \
-            - (E_dir[0]*di_x[1, 1, :] + E_dir[1]*di_y[1, 1, :])
-        Avv_in_path = E_dir[0]*di_x[0, 0, :] + E_dir[1]*di_y[0, 0, :]
-        Acc_in_path = E_dir[0]*di_x[1, 1, :] + E_dir[1]*di_y[1, 1, :]
-
-        # in bite.evaluate, there is also an interpolation done if b1, b2
-        # are provided and a cutoff radius
-        bandstruct = sys.system.evaluate_energy(kx_in_path, ky_in_path)
-        ecv_in_path = bandstruct[1] - bandstruct[0]
-        ev_in_path = -ecv_in_path/2
-        ec_in_path = ecv_in_path/2
-
-        ec = bandstruct[1]
-
-        # Initialize the values of of each k point vector
-        # (rho_nn(k), rho_nm(k), rho_mn(k), rho_mm(k))
-        y0 = []
-        for i_k, k in enumerate(path):
-            initial_condition(y0,e_fermi,temperature,bandstruct[1],i_k, dynamics_type)
-
-        # append the A-field
-        y0.append(0.0)
-
-        y0_np = np.array(y0)
-
-        # Set the initual values and function parameters for the current kpath
-        solver.set_initial_value(y0, t0).set_f_params(path, dk, gamma1, gamma2, E0, B0, w, chirp, alpha, phase, do_B_field, 
-                                                      ecv_in_path, ev_in_path, ec_in_path, 
-                                                      dipole_in_path, A_in_path, Avv_in_path, Acc_in_path, 
-                                                      gauge, kx_in_path, ky_in_path, E_dir, y0_np, Bcurv_in_B_dynamics, 
-                                                      dynamics_type)
+            print("Solving " + str(len(tasks)) + " tasks on " + str(n_proc) + " processes.")
+        with mp.get_context('fork').Pool(min(n_proc, len(tasks))) as pool:
+            # imap returns the results in path order, independent of which worker finishes first
+            path_results = pool.imap(_path_evolution_task, tasks)
+            t, A_field, observables = reduce_path_observables(path_results, task_weights)
+    else:
+        path_results = (_path_evolution_task(task) for task in tasks)
+        t, A_field, observables = reduce_path_observables(path_results, task_weights)
 
-        # Propagate through time
-        ti = 0
-        while solver.successful() and ti < Nt:
+    P_E_dir, P_ortho, J_E_dir, J_ortho, I_exact_E_dir, I_exact_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho = observables
 
-            # User output of integration progress
-            if (ti % 1000 == 0 and user_out):
-                print('{:5.2f}%'.format(ti/Nt*100))
+    # The run is complete, its checkpoints are not needed anymore
+    if checkpoint_dir is not None:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
 
-            # Integrate one integration time step
-            solver.integrate(solver.t + dt)
+    return t, A_field, P_E_dir, P_ortho, J_E_dir, J_ortho, I_exact_E_dir, I_exact_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho
 
-            # Save solution each output step
-            if ti % dt_out == 0:
-                path_solution.append(solver.y)
-                if dynamics_type == 'wavefunction_dynamics':
-                    path_fermi_function.append( 1/(np.exp((ec[:]-e_fermi)/temperature)+1) )
 
-                # Construct time array only once
-                if not t_constructed:
-                    t.append(solver.t)
+def reduce_path_observables(path_results, weights):
+    '''
+    Sums the observables of all paths in path order, the E_dir and ortho 
+    components of path i weighted with weights[i]. Serial and parallel runs
+    share this reduction, so both give bit-identical time signals. The 
+    statistics of the paths are collected in profiling.path_statistics.
+    '''
+    observables = None
+    for (t, A_field, path_observables, statistics), path_weights in zip(path_results, weights):
+        profiling.path_statistics.append(statistics)
+        if observables is None:
+            observables = [np.zeros(np.size(obs)) for obs in path_observables]
+        # The observables alternate between E_dir and ortho components
+        for i_obs, (obs, path_obs) in enumerate(zip(observables, path_observables)):
+            obs += path_weights[i_obs % 2]*path_obs
 
-            # Increment time counter
-            ti += 1
+    return t, A_field, observables
 
-        # Append path solutions to the total solution arrays
-        solution.append(np.array(path_solution)[:, 0:-1])
-        if dynamics_type == 'wavefunction_dynamics':
-           fermi_function.append(np.array(path_fermi_function)[:, :])
 
-        solution = np.array(solution)
+def _path_evolution_task(task):
+    '''
+    Solves the path of task and returns its result together with its statistics
+    (wall time of its phases, numba compilation, solver steps, memory)
+    '''
+    path_times = {}
+    statistics_start = dict(solver_statistics)
+    with profiling.compilation() as compilations, profiling.phase('total', path_times):
+        t, A_field, observables = path_evolution(*task, path_times=path_times)
+
+    statistics = {'path': task[1], 'k_points': len(task[0]), 'pid': os.getpid(), 
+                  'compile_time': profiling.compile_time(compilations), 'times': path_times, 
+                  'steps': solver_statistics['steps'] - statistics_start['steps'], 
+                  'rhs_evaluations': solver_statistics['rhs_evaluations'] - statistics_start['rhs_evaluations'], 
+                  'peak_memory': profiling.peak_memory()}
+    return t, A_field, observables, statistics
+
+
+def path_evolution(path, path_num, Nk_path, t0, tf, dt, user_out, E_dir, e_fermi, temperature, dk, gamma1, gamma2, 
+                   E0, B0, w, chirp, alpha, phase, do_B_field, gauge, normalize_f_valence, dt_out, Bcurv_in_B_dynamics, 
+                   dynamics_type, KK_emission, solver_method, rtol, atol, analytic_jacobian, stream_observables, 
+                   velocity_tables, velocity_tables_tol, model, checkpoint_dir=None, checkpoint_interval=600, 
+                   solution_dir=None, adaptive_steps=False, max_step=None, path_times=None):
+    '''
+    Solves the dynamics of a single path and returns its contribution to the
+    observables (P_E_dir, P_ortho, J_E_dir, J_ortho, I_exact_E_dir, I_exact_ortho, 
+    I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho).
+    path can also be a batch of several concatenated paths with Nk_path 
+    k-points each, which are then integrated as one ODE system.
+    With a checkpoint_dir, the state of the path is saved every checkpoint_interval 
+    seconds and its result when it is finished, both are picked up by a later call.
+    With a solution_dir, the density matrix of all output steps is written to the 
+    memory-mapped file solution_dir/rho_path-<path_num>.npy as solution[i_k, 0, i_time, :] 
+    and the observables are computed from it in time chunks (out-of-core).
+    The wall times of the setup, integration and emission are added to path_times.
+    '''
+    if path_times is None:
+        path_times = {}
+
+    # Checkpoints are named by the k-points, independent of path number and batching
+    checkpoint_name = None
+    if checkpoint_dir is not None:
+        checkpoint_name = os.path.join(checkpoint_dir, 'path-' + compile_cache.key_hash(path.tolist()))
+        finished = load_checkpoint(checkpoint_name + '-done.npz')
+        if finished is not None:
+            if user_out:
+                print('path: ' + str(path_num) + ' loaded from checkpoint')
+            return finished['t'], finished['A_field'], list(finished['observables'])
 
-        # Slice solution along each path for easier observable calculation
-        if BZ_type == 'full' or BZ_type == 'full_for_velocity':
-            solution = np.array_split(solution, Nk1, axis=2)
-            if dynamics_type == 'wavefunction_dynamics':
-               fermi_function = np.array_split(fermi_function, Nk1, axis=2)
-        elif BZ_type == '2line':
-            solution = np.array_split(solution, Nk_in_path, axis=2)
-            if dynamics_type == 'wavefunction_dynamics':
-               fermi_function = np.array_split(fermi_function, Nk_in_path, axis=2)
-
-        solution = np.array(solution)
-
-        A_field  = np.array(path_solution)[:, -1]
-
-        # COMPUTE OBSERVABLES
-        ###########################################################################
-
-        if path_num == 1:                                                                                                      
-            n_time_steps = np.size(solution[0,0,:,0]) 
-            I_E_dir = np.zeros(n_time_steps)                                                                                   
-            I_ortho = np.zeros(n_time_steps)                                                                                   
-            I_exact_E_dir = np.zeros(n_time_steps)                                                                                   
-            I_exact_ortho = np.zeros(n_time_steps)    
-            I_exact_diag_E_dir = np.zeros(n_time_steps)                                                                                   
-            I_exact_diag_ortho = np.zeros(n_time_steps)     
-            I_exact_offd_E_dir = np.zeros(n_time_steps)                                                                                   
-            I_exact_offd_ortho = np.zeros(n_time_steps)     
-            J_E_dir = np.zeros(n_time_steps)                                                                                   
-            J_ortho = np.zeros(n_time_steps)                                                                                   
-            P_E_dir = np.zeros(n_time_steps)                                                                                   
-            P_ortho = np.zeros(n_time_steps)  
-
-        # emission with exact formula
-        if do_B_field:
-           I_exact_E_dir, I_exact_ortho = emission_semicl_B_field(path, solution, E_dir, I_exact_E_dir, I_exact_ortho, path_num, normalize_f_valence) 
+    # Solution containers
+    t = []
+    solution = []
+    fermi_function = []
+
+    # Number of integration steps
+    Nt = int((tf-t0)/dt)
+
+    # SOLVING
+    ###########################################################################
+    if user_out:
+        print('path: ' + str(path_num))
+
+    # Solution container for the current path
+    path_solution = []
+    path_fermi_function = []
+
+    # Number of k-points of the current path (or batch)
+    Nk = np.size(path[:, 0])
+
+    # Initial condition and arguments of the equations of motion
+    with profiling.phase('setup', path_times):
+        y0, f_params, emission_tables, ec = path_setup(path, Nk_path, t0, tf, dt, user_out, E_dir, e_fermi, temperature, dk, 
+                                                       gamma1, gamma2, E0, B0, w, chirp, alpha, phase, do_B_field, gauge, 
+                                                       Bcurv_in_B_dynamics, dynamics_type, velocity_tables, velocity_tables_tol, model)
+
+    # Full density matrix on disk (opened below), filled in blocks of solution_chunk output steps
+    solution_file = None
+    if solution_dir is not None and not stream_observables:
+        solution_file = os.path.join(solution_dir, 'rho_path-' + str(path_num) + '.npy')
+        solution_shape = (Nk, 1, np.count_nonzero(np.arange(Nt) % dt_out == 0), np.size(y0[0:-1])//Nk)
+        solution_mode = 'w+'
+        solution_buffer = []
+        n_stored = 0
+
+    # Resume from the last checkpoint of this path
+    A_field = []
+    step_observables = []
+    ti_start, y_start = 0, y0
+    if stream_observables:
+        stored_key = 'step_observables'
+    elif solution_file is not None:
+        stored_key = 'n_stored'
+    else:
+        stored_key = 'path_solution'
+    if checkpoint_name is not None:
+        partial = load_checkpoint(checkpoint_name + '.npz')
+        if solution_file is not None and (not os.path.isfile(solution_file) or 
+                                          np.load(solution_file, mmap_mode='r').shape != solution_shape):
+            partial = None
+        if partial is not None and stored_key in partial:
+            if user_out:
+                print('path: ' + str(path_num) + ' resumed from checkpoint at t = ' + '{:.2f}'.format(partial['t'][-1]))
+            ti_start, y_start = int(partial['ti']), partial['y']
+            t, A_field = list(partial['t']), list(partial['A_field'])
+            if stream_observables:
+                step_observables = list(partial['step_observables'])
+            elif solution_file is not None:
+                # The output steps before n_stored are already in the file
+                n_stored = int(partial['n_stored'])
+                solution_mode = 'r+'
+            else:
+                path_solution = list(partial['path_solution'])
+                if dynamics_type == 'wavefunction_dynamics':
+                    path_fermi_function = [1/(np.exp((ec[:]-e_fermi)/temperature)+1)]*len(path_solution)
+        last_checkpoint = time.time()
+
+    if solution_file is not None:
+        rho = np.lib.format.open_memmap(solution_file, mode=solution_mode, dtype=np.complex128, shape=solution_shape)
+
+    # Propagate through time, each output step is either stored or directly
+    # evaluated for the observables of this path
+    loop_start = time.perf_counter()
+    for t_step, y_step in output_steps(solver_method, f_params, y_start, t0, dt, Nt, dt_out, rtol, atol, 
+                                       analytic_jacobian, do_B_field, gauge, dynamics_type, user_out, ti_start, 
+                                       adaptive_steps, max_step):
+        t.append(t_step)
+        A_field.append(y_step[-1])
+        if stream_observables:
+            # solution of the current time step, structured as below
+            step_solution = y_step[0:-1].reshape(Nk, 1, 1, -1)
+            with profiling.phase('emission', path_times):
+                step_observables.append(path_observables(path, step_solution, E_dir, np.array([y_step[-1]]), gauge, 
+                                                         normalize_f_valence, path_num, do_B_field, KK_emission, model, 
+                                                         emission_tables))
+        elif solution_file is not None:
+            solution_buffer.append(y_step[0:-1])
+            if len(solution_buffer) == solution_chunk:
+                n_stored = write_solution_block(rho, n_stored, solution_buffer)
+                solution_buffer = []
         else:
-           I_exact_E_dir, I_exact_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho, P_E_dir, P_ortho, J_E_dir, J_ortho = \
-                                          emission_exact(path, solution, E_dir, A_field, gauge, normalize_f_valence, path_num, 
-                                                         I_exact_E_dir, I_exact_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho, 
-                                                         P_E_dir, P_ortho, J_E_dir, J_ortho, KK_emission) 
-        # emission with exact formula with semiclassical formula
-#        if do_emission_wavep:
-#           I_wavep_E_dir, I_wavep_ortho             = emission_wavep(paths, solution, wf_solution, E_dir, A_field, fermi_function) 
-#           I_wavep_check_E_dir, I_wavep_check_ortho = check_emission_wavep(paths, solution, wf_solution, E_dir, A_field, fermi_function) 
-    
-        solution = []
+            path_solution.append(y_step)
+            if dynamics_type == 'wavefunction_dynamics':
+                path_fermi_function.append( 1/(np.exp((ec[:]-e_fermi)/temperature)+1) )
+
+        if checkpoint_name is not None and time.time() - last_checkpoint > checkpoint_interval:
+            # The output step t_step ends the integration step ti, the next one to do
+            ti_next = int(round((t_step - t0)/dt))
+            if stream_observables:
+                save_checkpoint(checkpoint_name + '.npz', ti=ti_next, y=y_step, t=t, A_field=A_field, 
+                                step_observables=step_observables)
+            elif solution_file is not None:
+                n_stored = write_solution_block(rho, n_stored, solution_buffer)
+                solution_buffer = []
+                rho.flush()
+                save_checkpoint(checkpoint_name + '.npz', ti=ti_next, y=y_step, t=t, A_field=A_field, 
+                                n_stored=n_stored)
+            else:
+                save_checkpoint(checkpoint_name + '.npz', ti=ti_next, y=y_step, t=t, A_field=A_field, 
+                                path_solution=path_solution)
+            last_checkpoint = time.time()
 
-        # Flag that time array has been built up
-        t_constructed = True
-        path_num += 1
+    # Integration including the checkpoints, without the streamed emission
+    path_times['integration'] = time.perf_counter() - loop_start - path_times.get('emission', 0.0)
 
-    # Convert solution and time array to numpy arrays
     t = np.array(t)
-    fermi_function = np.array(fermi_function)
+    A_field = np.array(A_field)
+
+    if stream_observables:
+        # (time step, observable, 1) -> (observable, time step)
+        return finish_path(checkpoint_name, t, A_field, list(np.array(step_observables)[:, :, 0].T))
+
+    if solution_file is not None:
+        n_stored = write_solution_block(rho, n_stored, solution_buffer)
+        rho.flush()
+        # Observables from the file in blocks of time steps, the solution is never fully in memory
+        with profiling.phase('emission', path_times):
+            observables = [path_observables(path, rho[:, :, i_chunk:i_chunk + solution_chunk], E_dir, 
+                                            A_field[i_chunk:i_chunk + solution_chunk], gauge, normalize_f_valence, path_num, 
+                                            do_B_field, KK_emission, model, emission_tables)
+                           for i_chunk in range(0, n_stored, solution_chunk)]
+        return finish_path(checkpoint_name, t, A_field, list(np.concatenate(observables, axis=1)))
+
+    # Append path solutions to the total solution arrays
+    solution.append(np.array(path_solution)[:, 0:-1])
+    if dynamics_type == 'wavefunction_dynamics':
+       fermi_function.append(np.array(path_fermi_function)[:, :])
 
-    # Convert lists into numpy arrays
     solution = np.array(solution)
+
+    # Slice solution along each k-point for easier observable calculation
+    solution = np.array_split(solution, Nk, axis=2)
+    if dynamics_type == 'wavefunction_dynamics':
+       fermi_function = np.array_split(fermi_function, Nk, axis=2)
+
     # Now the solution array is structred as:
     # first index is kx-index, second is ky-index,
     # third is timestep, fourth is f_h, p_he, p_eh, f_e
+    solution = np.array(solution)
 
-    if dynamics_type == 'wavefunction_dynamics':
-        fermi_function = np.array(fermi_function)
+    # emission with exact formula with semiclassical formula
+#    if do_emission_wavep:
+#       I_wavep_E_dir, I_wavep_ortho             = emission_wavep(paths, solution, wf_solution, E_dir, A_field, fermi_function) 
+#       I_wavep_check_E_dir, I_wavep_check_ortho = check_emission_wavep(paths, solution, wf_solution, E_dir, A_field, fermi_function) 
 
-    # In case of the velocity gauge, we need to shift the time-dependent
-    # k(t)=k_0+e/hbar A(t) to k_0 = k(t) - e/hbar A(t)
-    if gauge == 'velocity' and do_B_field == False and dynamics_type == 'wavefunction_dynamics':
-        solution = shift_solution(solution, A_field, dk, dynamics_type)
-        fermi_function = shift_solution(fermi_function, A_field, dk, dynamics_type)
+    with profiling.phase('emission', path_times):
+        observables = path_observables(path, solution, E_dir, A_field, gauge, normalize_f_valence, path_num, do_B_field, KK_emission, model, 
+                                       emission_tables)
+    return finish_path(checkpoint_name, t, A_field, observables)
 
-    return t, A_field, P_E_dir, P_ortho, J_E_dir, J_ortho, I_exact_E_dir, I_exact_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho
+
+def write_solution_block(rho, n_stored, solution_buffer):
+    '''
+    Writes the solution vectors of the output steps in solution_buffer to 
+    rho[i_k, 0, i_time, :] after the first n_stored steps, returns the new number of stored steps
+    '''
+    n_block = len(solution_buffer)
+    if n_block > 0:
+        Nk = rho.shape[0]
+        block = np.array(solution_buffer).reshape(n_block, Nk, -1)
+        rho[:, 0, n_stored:n_stored + n_block, :] = np.swapaxes(block, 0, 1)
+    return n_stored + n_block
+
+
+def finish_path(checkpoint_name, t, A_field, observables):
+    '''
+    Stores the result of a finished path in place of its last checkpoint
+    '''
+    if checkpoint_name is not None:
+        save_checkpoint(checkpoint_name + '-done.npz', t=t, A_field=A_field, observables=np.array(observables))
+        if os.path.isfile(checkpoint_name + '.npz'):
+            os.remove(checkpoint_name + '.npz')
+    return t, A_field, observables
+
+
+def save_checkpoint(filename, **arrays):
+    '''
+    Writes arrays to filename, a checkpoint interrupted while writing leaves the previous one intact
+    '''
+    filename_tmp = filename + '.' + str(os.getpid())
+    with open(filename_tmp, 'wb') as f:
+        np.savez(f, **{name: np.array(value) for name, value in arrays.items()})
+    os.replace(filename_tmp, filename)
+
+
+def load_checkpoint(filename):
+    '''
+    Returns the arrays of a checkpoint file, None if there is none
+    '''
+    if not os.path.isfile(filename):
+        return None
+    try:
+        with np.load(filename) as checkpoint:
+            return dict(checkpoint)
+    except Exception as error:
+        print("Checkpoint " + filename + " could not be loaded (" + str(error) + "), it is ignored.")
+        return None
+
+
+def path_setup(path, Nk_path, t0, tf, dt, user_out, E_dir, e_fermi, temperature, dk, gamma1, gamma2, 
+               E0, B0, w, chirp, alpha, phase, do_B_field, gauge, Bcurv_in_B_dynamics, dynamics_type, 
+               velocity_tables, velocity_tables_tol, model):
+    '''
+    Initial condition y0 and arguments f_params of the equations of motion 
+    (f, fnumba, jac, jacnumba) of a path, together with its emission 
+    interpolation tables and conduction band energies
+    '''
+    kx_in_path = path[:, 0]
+    ky_in_path = path[:, 1]
+
+    # Calculate the dipole components along the path
+    di_x, di_y = sys.dipole.evaluate(kx_in_path, ky_in_path, **sys.model_kwargs(model))
+
+    # Calculate the dot products E_dir.d_nm(k).
+    # To be multiplied by E-field magnitude later.
+    # A[0,1,:] means 0-1 offdiagonal element
+    dipole_in_path = (E_dir[0]*di_x[0, 1, :] + E_dir[1]*di_y[0, 1, :])
+    A_in_path = E_dir[0]*di_x[0, 0, :] + E_dir[1]*di_y[0, 0, :] \
+        - (E_dir[0]*di_x[1, 1, :] + E_dir[1]*di_y[1, 1, :])
+    Avv_in_path = E_dir[0]*di_x[0, 0, :] + E_dir[1]*di_y[0, 0, :]
+    Acc_in_path = E_dir[0]*di_x[1, 1, :] + E_dir[1]*di_y[1, 1, :]
+
+    # in bite.evaluate, there is also an interpolation done if b1, b2
+    # are provided and a cutoff radius
+    bandstruct = sys.system.evaluate_energy(kx_in_path, ky_in_path, **sys.model_kwargs(model))
+    ecv_in_path = bandstruct[1] - bandstruct[0]
+    ev_in_path = -ecv_in_path/2
+    ec_in_path = ecv_in_path/2
+
+    ec = bandstruct[1]
+
+    # Initialize the values of of each k point vector
+    # (rho_nn(k), rho_nm(k), rho_mn(k), rho_mm(k))
+    y0 = []
+    for i_k, k in enumerate(path):
+        initial_condition(y0,e_fermi,temperature,bandstruct[1],i_k, dynamics_type)
+
+    # append the A-field
+    y0.append(0.0)
+
+    y0_np = np.array(y0)
+
+    # Interpolation tables along E_dir for the velocity gauge (empty: direct evaluation)
+    if velocity_tables and gauge == 'velocity':
+        A_min, A_max = A_field_range(E0, w, chirp, alpha, phase, t0, tf, dt)
+        vg_tables, emission_tables = velocity_gauge_tables(kx_in_path, ky_in_path, E_dir, A_min, A_max, 
+                                                           velocity_tables_tol, user_out, model)
+    else:
+        vg_tables, emission_tables = velocity_gauge_tables(kx_in_path, ky_in_path, E_dir, 0, 0, 0, user_out, model)
+
+    # Function parameters for the current kpath
+    neighbours = path_neighbours(np.size(kx_in_path), Nk_path)
+    f_params = (path, neighbours, dk, gamma1, gamma2, E0, B0, w, chirp, alpha, phase, do_B_field, 
+                ecv_in_path, ev_in_path, ec_in_path, 
+                dipole_in_path, A_in_path, Avv_in_path, Acc_in_path, 
+                gauge, kx_in_path, ky_in_path, E_dir, y0_np, Bcurv_in_B_dynamics, 
+                dynamics_type, vg_tables, model)
+
+    return y0, f_params, emission_tables, ec
+
+
+def output_steps(solver_method, f_params, y0, t0, dt, Nt, dt_out, rtol, atol, 
+                 analytic_jacobian, do_B_field, gauge, dynamics_type, user_out, ti_start=0, 
+                 adaptive_steps=False, max_step=None):
+    '''
+    Integrates the equations of motion of a path from t0 in Nt steps of dt 
+    and yields time and solution vector of every dt_out'th step.
+    With ti_start > 0, y0 is the solution at t0 + ti_start*dt and the 
+    integration continues from there.
+    With adaptive_steps (zvode, dopri5), the solver is not bound to dt: it 
+    takes the steps (at most max_step) its error control allows and the 
+    solution at the output steps is interpolated (dense output).
+    '''
+    if adaptive_steps and solver_method not in ['zvode', 'dopri5']:
+        exit("adaptive_steps needs solver_method 'zvode' or 'dopri5'")
+    if not adaptive_steps:
+        max_step = dt
+
+    if solver_method == 'zvode':
+
+        # Initialize the ode solver and set the initial values
+        if analytic_jacobian and dynamics_type == 'density_matrix_dynamics':
+            # Banded Jacobian: analytic, or for the B-field dynamics by finite
+            # differences within the 8 entries of each k-point
+            if do_B_field:
+                solver = ode(f, jac=None)
+                band = 7
+            else:
+                solver = ode(f, jac=jac).set_jac_params(*f_params)
+                band = jacobian_bandwidth(gauge)
+            solver.set_integrator('zvode', method='bdf', max_step=max_step, rtol=rtol, atol=atol, 
+                                  lband=band, uband=band)
+        else:
+            solver = ode(f, jac=None).set_integrator('zvode', method='bdf', max_step=max_step, rtol=rtol, atol=atol)
+
+        # zvode counts its steps and right-hand side calls in the private work 
+        # array of scipy's wrapper, without it the calls of f are counted here
+        count_rhs_calls = getattr(solver._integrator, 'iwork', None) is None
+        rhs_calls = [0]
+        if count_rhs_calls:
+            def f_counted(t, y):
+                rhs_calls[0] += 1
+                return f(t, y, *f_params)
+            solver.f = f_counted
+            solver.set_initial_value(y0, t0 + ti_start*dt)
+        else:
+            solver.set_initial_value(y0, t0 + ti_start*dt).set_f_params(*f_params)
+
+        # Propagate through time
+        ti = ti_start
+        start_time = time.time()
+        if adaptive_steps:
+            # zvode steps past each requested output time and interpolates the solution there
+            output_ti = [ti for ti in range(ti_start, Nt) if ti % dt_out == 0]
+            for i_out, ti in enumerate(output_ti):
+                if not solver.successful():
+                    break
+                if (i_out % max(1, int(1000/dt_out)) == 0 and user_out):
+                    print(profiling.progress(ti, Nt, ti_start, start_time))
+                solver.integrate(t0 + (ti + 1)*dt)
+                yield solver.t, solver.y
+        else:
+            while solver.successful() and ti < Nt:
+
+                # User output of integration progress
+                if (ti % 1000 == 0 and user_out):
+                    print(profiling.progress(ti, Nt, ti_start, start_time))
+
+                # Integrate one integration time step
+                solver.integrate(solver.t + dt)
+
+                # Save solution each output step
+                if ti % dt_out == 0:
+                    yield solver.t, solver.y
+
+                # Increment time counter
+                ti += 1
+
+        if count_rhs_calls:
+            solver_statistics['rhs_evaluations'] += rhs_calls[0]
+        else:
+            # zvode counters NST and NFE (the latter includes the finite difference Jacobians)
+            solver_statistics['steps'] += int(solver._integrator.iwork[10])
+            solver_statistics['rhs_evaluations'] += int(solver._integrator.iwork[11])
+
+    elif solver_method == 'rk4' or solver_method == 'dopri5':
+
+        # The time loop runs compiled in chunks of steps, the solution is 
+        # returned for all output steps of a chunk at once
+        chunk_size = 1000
+        y = np.array(y0, dtype=np.complex128)
+        h = dt
+        start_time = time.time()
+        for ti_chunk in range(ti_start, Nt, chunk_size):
+            if user_out:
+                print(profiling.progress(ti_chunk, Nt, ti_start, start_time))
+            steps = np.arange(ti_chunk, min(ti_chunk + chunk_size, Nt))
+            save = steps % dt_out == 0
+            # The last step of a chunk is always returned, it starts the next chunk
+            save_chunk = save.copy()
+            save_chunk[-1] = True
+            t_chunk = t0 + ti_chunk*dt
+            if solver_method == 'rk4':
+                t_out, y_out = integrators.rk4(fnumba, y, t_chunk, dt, save_chunk, f_params)
+                solver_statistics['steps'] += steps.size
+                solver_statistics['rhs_evaluations'] += 4*steps.size
+            elif adaptive_steps:
+                # Own step sizes across the chunk, carried over to the next chunk
+                t_out = t0 + (steps[save_chunk] + 1)*dt
+                y_out, h, n_fun = integrators.dopri5_dense(fnumba, y, t_chunk, t_out, f_params, rtol, atol, h, max_step)
+                solver_statistics['steps'] += (n_fun - 1)//6
+                solver_statistics['rhs_evaluations'] += n_fun
+            else:
+                # Step size carried over to the next chunk
+                t_out, y_out, h, n_fun = integrators.dopri5(fnumba, y, t_chunk, dt, save_chunk, f_params, rtol, atol, h)
+                # Six evaluations per (accepted or rejected) step and one initial
+                solver_statistics['steps'] += (n_fun - 1)//6
+                solver_statistics['rhs_evaluations'] += n_fun
+            y = y_out[-1]
+            for t_step, y_step in zip(t_out[save[save_chunk]], y_out[save[save_chunk]]):
+                yield t_step, y_step
+
+    else:
+        exit("Unknown solver_method " + str(solver_method))
+
+
+def path_observables(path, solution, E_dir, A_field, gauge, normalize_f_valence, path_num, do_B_field, KK_emission, model, 
+                     emission_tables=None):
+    '''
+    Observables of a path from its solution[i_k, 0, i_time, :]
+    '''
+    n_time_steps = np.size(solution[0,0,:,0]) 
+    I_exact_E_dir = np.zeros(n_time_steps)                                                                                   
+    I_exact_ortho = np.zeros(n_time_steps)    
+    I_exact_diag_E_dir = np.zeros(n_time_steps)                                                                                   
+    I_exact_diag_ortho = np.zeros(n_time_steps)     
+    I_exact_offd_E_dir = np.zeros(n_time_steps)                                                                                   
+    I_exact_offd_ortho = np.zeros(n_time_steps)     
+    J_E_dir = np.zeros(n_time_steps)                                                                                   
+    J_ortho = np.zeros(n_time_steps)                                                                                   
+    P_E_dir = np.zeros(n_time_steps)                                                                                   
+    P_ortho = np.zeros(n_time_steps)  
+
+    # emission with exact formula
+    if do_B_field:
+       I_exact_E_dir, I_exact_ortho = emission_semicl_B_field(path, solution, E_dir, I_exact_E_dir, I_exact_ortho, path_num, normalize_f_valence, model) 
+    else:
+       I_exact_E_dir, I_exact_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho, P_E_dir, P_ortho, J_E_dir, J_ortho = \
+                                      emission_exact(path, solution, E_dir, A_field, gauge, normalize_f_valence, path_num, 
+                                                     I_exact_E_dir, I_exact_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho, 
+                                                     P_E_dir, P_ortho, J_E_dir, J_ortho, KK_emission, model, emission_tables) 
+
+    return [P_E_dir, P_ortho, J_E_dir, J_ortho, I_exact_E_dir, I_exact_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho]
 
 #################################################################################################
 # FUNCTIONS
 ################################################################################################
+def bz_mesh(params):
+    '''
+    E-field direction, k-spacing, k-points and k-paths of the Brillouin zone of params.BZ_type
+    '''
+    BZ_type = params.BZ_type
+    if BZ_type == 'full':
+        kpnts, paths = hex_mesh(params.Nk1, params.Nk2, params.a, params.b1, params.b2, params.align)
+        dk = 1/params.Nk1
+        if params.align == 'K':
+            E_dir = np.array([1, 0])
+        elif params.align == 'M':
+            E_dir = np.array([np.cos(np.radians(-30)),
+                             np.sin(np.radians(-30))])
+    elif BZ_type == 'full_for_velocity':
+        E_dir = np.array([np.cos(np.radians(params.angle_inc_E_field)),
+                         np.sin(np.radians(params.angle_inc_E_field))])
+        kpnts, paths = hex_mesh(params.Nk1_vel, params.Nk2_vel, params.a, params.b1, params.b2, 'M')
+        # dummy
+        dk = 1
+    elif BZ_type == '2line':
+        E_dir = np.array([np.cos(np.radians(params.angle_inc_E_field)),
+                         np.sin(np.radians(params.angle_inc_E_field))])
+        dk, kpnts, paths = mesh(params, E_dir)
+
+    return E_dir, dk, kpnts, paths
+
+
+def irreducible_paths(paths, E_dir, model, lattice=None, tol=1e-8):
+    '''
+    Paths of the mesh that are not mirror images of each other at the line 
+    along E_dir, with the weights of the E_dir and ortho components of their 
+    observables in the sum over the mesh. A pair of mirror paths has the same 
+    E_dir and opposite ortho components (the sum over a path does not depend 
+    on its first k-point): one of them is solved with weights (2, 0). Paths 
+    that are their own mirror image keep (1, 1). The full mesh is returned if 
+    E_dir is not along a mirror line of the model or the mesh is not mirror 
+    symmetric. k-points of the mesh that differ by a vector of the reciprocal 
+    lattice = (b1, b2) are the same (as in hex_mesh), None for the 2line mesh.
+    '''
+    paths = np.array(paths)
+    weights = np.ones((len(paths), 2))
+    E_dir = E_dir/np.linalg.norm(E_dir)
+    # Reflection at the line through Gamma along E_dir
+    mirror = 2*np.outer(E_dir, E_dir) - np.eye(2)
+
+    if not is_mirror_symmetry(paths.reshape(-1, 2), mirror, E_dir, model, tol):
+        return paths, weights
+
+    # The mirror image of a path has to be a cyclic shift of a path of the mesh:
+    # the finite difference neighbours are periodic within each path.
+    # k-points agree to rounding errors (+ 0.0 turns -0.0 into 0.0)
+    if lattice is None:
+        to_key = lambda k: np.round(k/np.amax(np.abs(paths)), 8) + 0.0
+    else:
+        # Coordinates in units of b1 and b2 modulo 1
+        to_key = lambda k: np.round(k @ np.linalg.inv(np.transpose(lattice)).T, 8) % 1.0 + 0.0
+    keys = to_key(paths)
+    mirror_keys = to_key(paths @ mirror.T)
+    path_index = {key[np.lexsort(key.T)].tobytes(): i_path for i_path, key in enumerate(keys)}
+    partners = []
+    for mirror_key in mirror_keys:
+        partner = path_index.get(mirror_key[np.lexsort(mirror_key.T)].tobytes())
+        if partner is None:
+            return paths, weights
+        shift = np.flatnonzero(np.all(keys[partner] == mirror_key[0], axis=1))
+        if np.size(shift) != 1 or not np.array_equal(np.roll(keys[partner], -shift[0], axis=0), mirror_key):
+            return paths, weights
+        partners.append(partner)
+
+    irreducible = [i_path for i_path, partner in enumerate(partners) if i_path <= partner]
+    weights[[i_path for i_path in irreducible if partners[i_path] != i_path]] = [2, 0]
+    return paths[irreducible], weights[irreducible]
+
+
+def is_mirror_symmetry(kpnts, mirror, E_dir, model, tol):
+    '''
+    True if the band energies, the magnitudes of the interband dipoles along 
+    E_dir and orthogonal to it and the Berry curvature of the model (which 
+    changes sign) are invariant under the reflection mirror at (a sample of) kpnts.
+    The intraband Berry connections along E_dir (orthogonal to it: with opposite 
+    sign) have to be invariant as well: the discretised equations of motion 
+    depend on the gauge of the wavefunctions, the mirror has to map it onto itself.
+    '''
+    sample = kpnts[np.linspace(0, len(kpnts) - 1, min(len(kpnts), 100)).astype(int)]
+    E_ort = np.array([E_dir[1], -E_dir[0]])
+
+    def invariants(k):
+        kx, ky = k[:, 0], k[:, 1]
+        bandstruct = sys.system.evaluate_energy(kx, ky, **sys.model_kwargs(model))
+        di_x, di_y = sys.dipole.evaluate(kx, ky, **sys.model_kwargs(model))
+        curvature = [sys.cu_00jit(kx_i, ky_i, model) for kx_i, ky_i in zip(kx, ky)]
+        di_E = E_dir[0]*di_x + E_dir[1]*di_y
+        di_ort = E_ort[0]*di_x + E_ort[1]*di_y
+        return [bandstruct[0], bandstruct[1], 
+                np.abs(di_E[0, 1]), np.abs(di_ort[0, 1]), 
+                np.real(di_E[0, 0]), np.real(di_E[1, 1]), 
+                np.real(di_ort[0, 0]), np.real(di_ort[1, 1]), 
+                np.real(curvature)]
+
+    signs = [1, 1, 1, 1, 1, 1, -1, -1, -1]
+    for sign, value, mirror_value in zip(signs, invariants(sample), invariants(sample @ mirror.T)):
+        if not np.allclose(sign*mirror_value, value, rtol=tol, atol=tol*np.amax(np.abs(value))):
+            return False
+    return True
+
+
 def mesh(params, E_dir):
     Nk_in_path        = params.Nk_in_path                    # Number of kpoints in each of the two paths
     rel_dist_to_Gamma = params.rel_dist_to_Gamma      # relative distance (in units of 2pi/a) of both paths to Gamma
@@ -720,31 +969,15 @@ def mesh(params, E_dir):
 
     vec_k_ortho = 2.0*np.pi/a*rel_dist_to_Gamma*np.array([E_dir[1], -E_dir[0]])
 
-    # Containers for the mesh, and BZ directional paths
-    mesh = []
-    paths = []
-
-    # Create the kpoint mesh and the paths
-#    for path_index in [-1, 1]:
-    for path_index in np.linspace(-num_paths+1,num_paths-1, num = num_paths):
-
-        print("path_index",path_index)
+    path_indices = np.linspace(-num_paths+1,num_paths-1, num = num_paths)
 
-        # Container for a single path
-        path = []
-        for alpha in alpha_array:
-            # Create a k-point
-            kpoint = path_index*vec_k_ortho + alpha*vec_k_path
-
-            mesh.append(kpoint)
-            path.append(kpoint)
-
-        # Append the a1'th path to the paths array
-        paths.append(path)
+    # Create the paths[i_path, i_k, :] and the kpoint mesh (all paths one after another)
+    paths = path_indices[:, np.newaxis, np.newaxis]*vec_k_ortho + alpha_array[np.newaxis, :, np.newaxis]*vec_k_path
+    mesh = paths.reshape(-1, 2)
 
     dk = 1.0/Nk_in_path*length_path_in_BZ
 
-    return dk, np.array(mesh), np.array(paths)
+    return dk, mesh, paths
 
 
 def hex_mesh(Nk1, Nk2, a, b1, b2, align):
@@ -752,53 +985,36 @@ def hex_mesh(Nk1, Nk2, a, b1, b2, align):
     alpha2 = np.linspace(-0.5 + (1/(2*Nk2)), 0.5 - (1/(2*Nk2)), num=Nk2)
 
     def is_in_hex(p, a):
-        # Returns true if the point is in the hexagonal BZ.
+        # Returns true for the points p[..., :] in the hexagonal BZ.
         # Checks if the absolute values of x and y components of p are within the first quadrant of the hexagon.
-        x = np.abs(p[0])
-        y = np.abs(p[1])
-        return ((y <= 2.0*np.pi/(np.sqrt(3)*a)) and (np.sqrt(3.0)*x + y <= 4*np.pi/(np.sqrt(3)*a)))
-
-    def reflect_point(p, a, b1, b2):
-        x = p[0]
-        y = p[1]
-        if (y > 2*np.pi/(np.sqrt(3)*a)):                     # Crosses top
-            p -= b2
-        elif (y < -2*np.pi/(np.sqrt(3)*a)):                  # Crosses bottom
-            p += b2
-        elif (np.sqrt(3)*x + y > 4*np.pi/(np.sqrt(3)*a)):    # Crosses top-right
-            p -= b1 + b2
-        elif (-np.sqrt(3)*x + y < -4*np.pi/(np.sqrt(3)*a)):  # Crosses bot-right
-            p -= b1
-        elif (np.sqrt(3)*x + y < -4*np.pi/(np.sqrt(3)*a)):   # Crosses bot-left
-            p += b1 + b2
-        elif (-np.sqrt(3)*x + y > 4*np.pi/(np.sqrt(3)*a)):   # Crosses top-left
-            p += b1
-        return p
-
-    # Containers for the mesh, and BZ directional paths
-    mesh = []
-    paths = []
-
-    # Create the Monkhorst-Pack mesh
+        x = np.abs(p[..., 0])
+        y = np.abs(p[..., 1])
+        return ((y <= 2.0*np.pi/(np.sqrt(3)*a)) & (np.sqrt(3.0)*x + y <= 4*np.pi/(np.sqrt(3)*a)))
+
+    def reflect_points(p, a, b1, b2):
+        # Shifts each point of p[i, :] across the first BZ edge it crosses
+        x = p[:, 0]
+        y = p[:, 1]
+        crosses = [y > 2*np.pi/(np.sqrt(3)*a),                      # Crosses top
+                   y < -2*np.pi/(np.sqrt(3)*a),                     # Crosses bottom
+                   np.sqrt(3)*x + y > 4*np.pi/(np.sqrt(3)*a),       # Crosses top-right
+                   -np.sqrt(3)*x + y < -4*np.pi/(np.sqrt(3)*a),     # Crosses bot-right
+                   np.sqrt(3)*x + y < -4*np.pi/(np.sqrt(3)*a),      # Crosses bot-left
+                   -np.sqrt(3)*x + y > 4*np.pi/(np.sqrt(3)*a)]      # Crosses top-left
+        shifts = [-b2, b2, -(b1 + b2), -b1, b1 + b2, b1]
+        shift = np.select([c[:, np.newaxis] for c in crosses], shifts, default=np.zeros(2))
+        return p + shift
+
+    # Create the Monkhorst-Pack mesh as paths[i_path, i_k, :], the kpoint mesh holds all paths one after another
     if align == 'M':
-        for a2 in alpha2:
-            # Container for a single gamma-M path
-            path_M = []
-            for a1 in alpha1:
-                # Create a k-point
-                kpoint = a1*b1 + a2*b2
-                # If the current point is in the BZ, append it to the mesh and path_M
-                if (is_in_hex(kpoint,a)):
-                    mesh.append(kpoint)
-                    path_M.append(kpoint)
-                # If the current point is NOT in the BZ, reflect is along the appropriate axis to get it in the BZ, then append.
-                else:
-                    while (is_in_hex(kpoint,a) != True):
-                        kpoint = reflect_point(kpoint,a,b1,b2)
-                    mesh.append(kpoint)
-                    path_M.append(kpoint)
-            # Append the a1'th path to the paths array
-            paths.append(path_M)
+        # One gamma-M path for each a2
+        paths = alpha1[np.newaxis, :, np.newaxis]*b1 + alpha2[:, np.newaxis, np.newaxis]*b2
+        # Reflect the points that are NOT in the BZ along the appropriate axis until they are in the BZ
+        kpnts = paths.reshape(-1, 2)
+        outside = ~is_in_hex(kpnts, a)
+        while np.any(outside):
+            kpnts[outside] = reflect_points(kpnts[outside], a, b1, b2)
+            outside = ~is_in_hex(kpnts, a)
 
     elif align == 'K':
         b_a1 = 8*np.pi/(a*3)*np.array([1,0])
@@ -806,20 +1022,24 @@ def hex_mesh(Nk1, Nk2, a, b1, b2, align):
         # Extend over half of the b2 direction and 1.5x the b1 direction (extending into the 2nd BZ to get correct boundary conditions)
         alpha1 = np.linspace(-0.5 + (1/(2*Nk1)), 1.0 - (1/(2*Nk1)), num = Nk1)
         alpha2 = np.linspace(0, 0.5 - (1/(2*Nk2)), num = Nk2)
-        for a2 in alpha2:
-            path_K = []
-            for a1 in alpha1:
-                kpoint = a1*b_a1 + a2*b_a2
-                if is_in_hex(kpoint,a):
-                    mesh.append(kpoint)
-                    path_K.append(kpoint)
-                else:
-                    kpoint -= 2*np.pi/(a)*np.array([1,1/np.sqrt(3)])
-                    mesh.append(kpoint)
-                    path_K.append(kpoint)
-            paths.append(path_K)
-
-    return np.array(mesh), np.array(paths)
+        paths = alpha1[np.newaxis, :, np.newaxis]*b_a1 + alpha2[:, np.newaxis, np.newaxis]*b_a2
+        outside = ~is_in_hex(paths, a)
+        paths[outside] -= 2*np.pi/(a)*np.array([1,1/np.sqrt(3)])
+
+    return paths.reshape(-1, 2), paths
+
+
+def path_neighbours(Nk, Nk_path):
+    '''
+    Indices neighbours[k] = (k_next, k_previous) of the finite difference 
+    neighbours of the Nk k-points of consecutive paths of Nk_path k-points 
+    each, periodic within each path (the central difference weights 
+    +-1/(2*dk) are the same for all k-points)
+    '''
+    k = np.arange(Nk)
+    k_first = k - k % Nk_path
+    return np.stack((k_first + (k + 1 - k_first) % Nk_path, 
+                     k_first + (k - 1 - k_first) % Nk_path), axis=1)
 
 # @njit
 # def driving_field(E0, w, t, chirp, alpha, phase):
@@ -831,40 +1051,25 @@ def hex_mesh(Nk1, Nk2, a, b1, b2, align):
 #     # Chirped Gaussian pulse
 #     return E0*np.exp(-t**2.0/(2.0*alpha)**2)*np.sin(2.0*np.pi*w*t*(1 + chirp*t) + phase)
 
-@njit
-def rabi(E0, t, dipole):
+@njit(cache=compile_cache.enabled)
+def rabi(E0, w, t, chirp, alpha, phase, dipole):
     '''
     Rabi frequency of the transition.
     Calculated from dipole element and driving field
     '''
-    return dipole*driving_field(E0, t)
+    return dipole*driving_field(E0, w, t, chirp, alpha, phase)
 
 
-def diff(x, y):
-    '''
-    Takes the derivative of y w.r.t. x
-    '''
-    if (len(x) != len(y)):
-        raise ValueError('Vectors have different lengths')
-    elif len(y) == 1:
-        return 0
-    else:
-        dx = np.gradient(x)
-        dy = np.gradient(y)
-        return dy/dx
-
-
-def Gaussian_envelope(t, alpha):
+def emission_exact(path, solution, E_dir, A_field, gauge, normalize_f_valence, path_num, I_E_dir, I_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho, 
+                   P_E_dir, P_ortho, J_E_dir, J_ortho, KK_emission, model, emission_tables=None):
     '''
-    Function to multiply a Function f(t) before Fourier transform
-    to ensure no step in time between t_final and t_final + delta
+    Exact emission (and P, J for KK_emission) of a path for all time steps at once.
+    In length gauge the matrix elements do not depend on time and are evaluated 
+    once per k-point, in velocity gauge they are evaluated at the shifted k-points 
+    of all time steps in a single call, or interpolated from emission_tables 
+    (see velocity_gauge_tables). The contraction with the density matrix 
+    solution[i_k, 0, i_time, :] runs over (k, time) as one array operation.
     '''
-    return np.exp(-t**2.0/(2.0*1.0*alpha)**2)
-
-
-def emission_exact(path, solution, E_dir, A_field, gauge, normalize_f_valence, path_num, I_E_dir, I_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho, 
-                   P_E_dir, P_ortho, J_E_dir, J_ortho, KK_emission):
-                                                                                                                           
     E_ort = np.array([E_dir[1], -E_dir[0]])                                                                                
                                                                                                                            
     n_time_steps = np.size(solution[0,0,:,0])                                                                              
@@ -874,93 +1079,99 @@ def emission_exact(path, solution, E_dir, A_field, gauge, normalize_f_valence, p
     else:
         subtract_from_f_v = 0
 
-    for i_time in range(n_time_steps):                                                                                     
-                                                                                                                           
-        path = np.array(path)                                                                                              
-        kx_in_path = path[:, 0]                                                                                            
-        ky_in_path = path[:, 1]                                                                                            
-                                                                                                                           
-        if gauge == 'length':                                                                                              
-                                                                                                                           
-           kx_in_path_backshift = kx_in_path                                                                               
-           ky_in_path_backshift = ky_in_path                                                                               
-                                                                                                                           
-        elif gauge == 'velocity':                                                                                          
-                                                                                                                           
-           kx_in_path_backshift = kx_in_path + A_field[i_time]*E_dir[0]                                                    
-           ky_in_path_backshift = ky_in_path + A_field[i_time]*E_dir[1]                                                    
-                                                                                                                           
-        # EXACT EMISSION                                                                                                   
-                                                                                                                           
-        h_deriv_x = ev_mat(sys.h_deriv[0], kx=kx_in_path_backshift, ky=ky_in_path_backshift)                               
-        h_deriv_y = ev_mat(sys.h_deriv[1], kx=kx_in_path_backshift, ky=ky_in_path_backshift)                               
-                                                                                                                           
-        h_deriv_E_dir = h_deriv_x*E_dir[0] + h_deriv_y*E_dir[1]                                                            
-        h_deriv_ortho = h_deriv_x*E_ort[0] + h_deriv_y*E_ort[1]                                                            
-                                                                                                                           
-        U   = sys.wf  (kx=kx_in_path_backshift, ky=ky_in_path_backshift)                                                   
-        U_h = sys.wf_h(kx=kx_in_path_backshift, ky=ky_in_path_backshift)                                                  
-                                                                                                                           
-        for i_k in range(np.size(kx_in_path)):
-
-            U_h_H_U_E_dir = np.matmul(U_h[:,:,i_k], np.matmul(h_deriv_E_dir[:,:,i_k], U[:,:,i_k]))
-            U_h_H_U_ortho = np.matmul(U_h[:,:,i_k], np.matmul(h_deriv_ortho[:,:,i_k], U[:,:,i_k]))
-
-            I_E_dir[i_time] += np.real(U_h_H_U_E_dir[0,0])*(np.real(solution[i_k, 0, i_time, 0]) - subtract_from_f_v)
-            I_E_dir[i_time] += np.real(U_h_H_U_E_dir[1,1])*np.real(solution[i_k, 0, i_time, 3])
-            I_E_dir[i_time] += 2*np.real(U_h_H_U_E_dir[0,1]*solution[i_k, 0, i_time, 2])
-            I_exact_diag_E_dir[i_time] += np.real(U_h_H_U_E_dir[0,0])*(np.real(solution[i_k, 0, i_time, 0]) - subtract_from_f_v)
-            I_exact_diag_E_dir[i_time] += np.real(U_h_H_U_E_dir[1,1])*np.real(solution[i_k, 0, i_time, 3])
-            I_exact_offd_E_dir[i_time] += 2*np.real(U_h_H_U_E_dir[0,1]*solution[i_k, 0, i_time, 2])
-
-            I_ortho[i_time] += np.real(U_h_H_U_ortho[0,0])*(np.real(solution[i_k, 0, i_time, 0]) - subtract_from_f_v)
-            I_ortho[i_time] += np.real(U_h_H_U_ortho[1,1])*np.real(solution[i_k, 0, i_time, 3])
-            I_ortho[i_time] += 2*np.real(U_h_H_U_ortho[0,1]*solution[i_k, 0, i_time, 2])
-            I_exact_diag_ortho[i_time] += np.real(U_h_H_U_ortho[0,0])*(np.real(solution[i_k, 0, i_time, 0]) - subtract_from_f_v)
-            I_exact_diag_ortho[i_time] += np.real(U_h_H_U_ortho[1,1])*np.real(solution[i_k, 0, i_time, 3])
-            I_exact_offd_ortho[i_time] += 2*np.real(U_h_H_U_ortho[0,1]*solution[i_k, 0, i_time, 2])
-
-        if KK_emission:
-
-           # KK emission only with length gauge
-           if gauge == 'velocity': 
-              exit("KK emission only implemented with the length gauge")
-              
-           # INTERBAND POLARIZATION 
-
-           # Evaluate the dipole moments in path
-           di_x, di_y = sys.dipole.evaluate(kx_in_path, ky_in_path)
+    path = np.array(path)
+    kx_in_path = path[:, 0]
+    ky_in_path = path[:, 1]
+    Nk = np.size(kx_in_path)
+
+    # Density matrix entries as [i_k, i_time]
+    f_v  = solution[:, 0, :, 0]
+    p_vc = solution[:, 0, :, 1]
+    p_cv = solution[:, 0, :, 2]
+    f_c  = solution[:, 0, :, 3]
+
+    if gauge == 'length':
+
+       # Same k-points for all time steps, broadcast over time
+       kx_in_path_backshift = kx_in_path
+       ky_in_path_backshift = ky_in_path
+       k_shape = (Nk, 1)
+
+    elif gauge == 'velocity':
+
+       # k-points shifted by the A-field of each time step, flattened as [i_k, i_time]
+       kx_in_path_backshift = (kx_in_path[:, np.newaxis] + A_field[np.newaxis, :]*E_dir[0]).ravel()
+       ky_in_path_backshift = (ky_in_path[:, np.newaxis] + A_field[np.newaxis, :]*E_dir[1]).ravel()
+       k_shape = (Nk, n_time_steps)
+
+    # EXACT EMISSION
+
+    # U^dagger dh/dk U for every k-point, as [n, m, i_k, i_time]
+    if gauge == 'velocity' and emission_tables is not None:
+       shift_grid, U_h_H_U_E_dir_table, U_h_H_U_ortho_table = emission_tables
+       U_h_H_U_E_dir = np.moveaxis(cubic_interpolation(U_h_H_U_E_dir_table, shift_grid, np.real(A_field)), 0, -1)
+       U_h_H_U_ortho = np.moveaxis(cubic_interpolation(U_h_H_U_ortho_table, shift_grid, np.real(A_field)), 0, -1)
+    else:
+       U_h_H_U_E_dir, U_h_H_U_ortho = velocity_matrix_elements(kx_in_path_backshift, ky_in_path_backshift, E_dir, E_ort, model)
+       U_h_H_U_E_dir = U_h_H_U_E_dir.reshape((2, 2) + k_shape)
+       U_h_H_U_ortho = U_h_H_U_ortho.reshape((2, 2) + k_shape)
+
+    diag_E_dir = np.sum(np.real(U_h_H_U_E_dir[0,0])*(np.real(f_v) - subtract_from_f_v) 
+                        + np.real(U_h_H_U_E_dir[1,1])*np.real(f_c), axis=0)
+    offd_E_dir = np.sum(2*np.real(U_h_H_U_E_dir[0,1]*p_cv), axis=0)
+    diag_ortho = np.sum(np.real(U_h_H_U_ortho[0,0])*(np.real(f_v) - subtract_from_f_v) 
+                        + np.real(U_h_H_U_ortho[1,1])*np.real(f_c), axis=0)
+    offd_ortho = np.sum(2*np.real(U_h_H_U_ortho[0,1]*p_cv), axis=0)
+
+    I_E_dir            += diag_E_dir + offd_E_dir
+    I_exact_diag_E_dir += diag_E_dir
+    I_exact_offd_E_dir += offd_E_dir
+    I_ortho            += diag_ortho + offd_ortho
+    I_exact_diag_ortho += diag_ortho
+    I_exact_offd_ortho += offd_ortho
+
+    if KK_emission and n_time_steps > 0:
+
+       # KK emission only with length gauge
+       if gauge == 'velocity': 
+          exit("KK emission only implemented with the length gauge")
+          
+       # INTERBAND POLARIZATION 
+
+       # Evaluate the dipole moments in path
+       di_x, di_y = sys.dipole.evaluate(kx_in_path, ky_in_path, **sys.model_kwargs(model))
+   
+       # Append the dot product d.E
+       d_E_dir = di_x[0, 1, :]*E_dir[0] + di_y[0, 1, :]*E_dir[1]
+       d_ortho = di_x[0, 1, :]*E_ort[0] + di_y[0, 1, :]*E_ort[1]
+
+       P_E_dir += np.sum(2*np.real(d_E_dir[:, np.newaxis]*p_vc), axis=0)
+       P_ortho += np.sum(2*np.real(d_ortho[:, np.newaxis]*p_vc), axis=0)
+
+       # INTRABAND CURRENT 
+       evdx = sys.ev_dx(kx_in_path, ky_in_path, model)
+       evdy = sys.ev_dy(kx_in_path, ky_in_path, model)
+       ecdx = sys.ec_dx(kx_in_path, ky_in_path, model)
+       ecdy = sys.ec_dy(kx_in_path, ky_in_path, model)
        
-           # Append the dot product d.E
-           d_E_dir = di_x[0, 1, :]*E_dir[0] + di_y[0, 1, :]*E_dir[1]
-           d_ortho = di_x[0, 1, :]*E_ort[0] + di_y[0, 1, :]*E_ort[1]
-      
-           for i_k in range(np.size(kx_in_path)):
-
-              P_E_dir[i_time] += 2*np.real(d_E_dir[i_k]*solution[i_k, 0, i_time, 1])
-              P_ortho[i_time] += 2*np.real(d_ortho[i_k]*solution[i_k, 0, i_time, 1])
-
-           # INTRABAND CURRENT 
-           evdx = sys.system.ederivfjit[0](kx=kx_in_path, ky=ky_in_path)
-           evdy = sys.system.ederivfjit[1](kx=kx_in_path, ky=ky_in_path)
-           ecdx = sys.system.ederivfjit[2](kx=kx_in_path, ky=ky_in_path)
-           ecdy = sys.system.ederivfjit[3](kx=kx_in_path, ky=ky_in_path)
-           
-           # 0: v, x 1: v,y 2: c, x 3: c, y
-           jc_E_dir = ecdx*E_dir[0] + ecdy*E_dir[1]
-           jc_ortho = ecdx*E_ort[0] + ecdy*E_ort[1]
-           jv_E_dir = evdx*E_dir[0] + evdy*E_dir[1]
-           jv_ortho = evdx*E_ort[0] + evdy*E_ort[1]
-           
-           for i_k in range(np.size(kx_in_path)):
-              J_E_dir[i_time] += np.real(jc_E_dir[i_k]*solution[i_k, 0, i_time, 3] + jv_E_dir[i_k]*(solution[i_k, 0, i_time, 0] - subtract_from_f_v))
-              J_ortho[i_time] += np.real(jc_ortho[i_k]*solution[i_k, 0, i_time, 3] + jv_ortho[i_k]*(solution[i_k, 0, i_time, 0] - subtract_from_f_v))
+       # 0: v, x 1: v,y 2: c, x 3: c, y
+       jc_E_dir = ecdx*E_dir[0] + ecdy*E_dir[1]
+       jc_ortho = ecdx*E_ort[0] + ecdy*E_ort[1]
+       jv_E_dir = evdx*E_dir[0] + evdy*E_dir[1]
+       jv_ortho = evdx*E_ort[0] + evdy*E_ort[1]
 
-    return I_E_dir, I_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho, P_E_dir, P_ortho, J_E_dir, J_ortho
+       J_E_dir += np.sum(np.real(jc_E_dir[:, np.newaxis]*f_c + jv_E_dir[:, np.newaxis]*(f_v - subtract_from_f_v)), axis=0)
+       J_ortho += np.sum(np.real(jc_ortho[:, np.newaxis]*f_c + jv_ortho[:, np.newaxis]*(f_v - subtract_from_f_v)), axis=0)
 
+    return I_E_dir, I_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho, P_E_dir, P_ortho, J_E_dir, J_ortho
 
-def emission_semicl_B_field(path, solution, E_dir, I_exact_E_dir, I_exact_ortho, path_num, normalize_f_valence):
 
+def emission_semicl_B_field(path, solution, E_dir, I_exact_E_dir, I_exact_ortho, path_num, normalize_f_valence, model):
+    '''
+    Semiclassical emission with B-field for all time steps at once: the valence 
+    and conduction k-points shifted by solution[i_k, 0, i_time, 4:8] are 
+    evaluated in one batched call per band and contracted with the occupations
+    '''
     E_ort = np.array([E_dir[1], -E_dir[0]])
 
     if normalize_f_valence:
@@ -968,51 +1179,64 @@ def emission_semicl_B_field(path, solution, E_dir, I_exact_E_dir, I_exact_ortho,
     else:
         subtract_from_f_v = 0
 
-    n_time_steps = np.size(solution[0,0,:,0])
-                                                                                                                           
-    for i_time in range(n_time_steps):
+    path = np.array(path)
+    kx_in_path = path[:, 0]
+    ky_in_path = path[:, 1]
 
-        path = np.array(path)
-        kx_in_path = path[:, 0]
-        ky_in_path = path[:, 1]
+    # Shifted k-points of all k and time steps, flattened as [i_k, i_time]
+    kx_in_path_shifted_v = (kx_in_path[:, np.newaxis] + np.real(solution[:, 0, :, 4])).ravel()
+    ky_in_path_shifted_v = (ky_in_path[:, np.newaxis] + np.real(solution[:, 0, :, 5])).ravel()
+    kx_in_path_shifted_c = (kx_in_path[:, np.newaxis] + np.real(solution[:, 0, :, 6])).ravel()
+    ky_in_path_shifted_c = (ky_in_path[:, np.newaxis] + np.real(solution[:, 0, :, 7])).ravel()
 
-        for i_k in range(np.size(kx_in_path)):
+    # Only the band-diagonal element of U^dagger dh/dk U is needed, valence 
+    # band (0) at the valence shift and conduction band (1) at the conduction shift
+    U_h_H_U_v = band_velocity_matrix_element(kx_in_path_shifted_v, ky_in_path_shifted_v, E_dir, E_ort, 0, model)
+    U_h_H_U_c = band_velocity_matrix_element(kx_in_path_shifted_c, ky_in_path_shifted_c, E_dir, E_ort, 1, model)
 
-            kx_in_path_shifted_v = kx_in_path[i_k] + solution[i_k, 0, i_time, 4]
-            ky_in_path_shifted_v = ky_in_path[i_k] + solution[i_k, 0, i_time, 5]
-            kx_in_path_shifted_c = kx_in_path[i_k] + solution[i_k, 0, i_time, 6]
-            ky_in_path_shifted_c = ky_in_path[i_k] + solution[i_k, 0, i_time, 7]
+    f_v = (np.real(solution[:, 0, :, 0]) - subtract_from_f_v).ravel()
+    f_c = np.real(solution[:, 0, :, 3]).ravel()
 
-            U_shift_v   = sys.wf  (kx=kx_in_path_shifted_v, ky=ky_in_path_shifted_v)
-            U_shift_v_h = sys.wf_h(kx=kx_in_path_shifted_v, ky=ky_in_path_shifted_v)
-            U_shift_c   = sys.wf  (kx=kx_in_path_shifted_c, ky=ky_in_path_shifted_c)
-            U_shift_c_h = sys.wf_h(kx=kx_in_path_shifted_c, ky=ky_in_path_shifted_c)
+    # Sum over the k-points
+    k_time_shape = np.shape(solution[:, 0, :, 0])
+    I_exact_E_dir += np.sum((np.real(U_h_H_U_v[0])*f_v + np.real(U_h_H_U_c[0])*f_c).reshape(k_time_shape), axis=0)
+    I_exact_ortho += np.sum((np.real(U_h_H_U_v[1])*f_v + np.real(U_h_H_U_c[1])*f_c).reshape(k_time_shape), axis=0)
 
-            h_deriv_x_v = ev_mat(sys.h_deriv[0], kx=kx_in_path_shifted_v, ky=ky_in_path_shifted_v)
-            h_deriv_y_v = ev_mat(sys.h_deriv[1], kx=kx_in_path_shifted_v, ky=ky_in_path_shifted_v)
- 
-            h_deriv_E_dir_v = h_deriv_x_v*E_dir[0] + h_deriv_y_v*E_dir[1]
-            h_deriv_ortho_v = h_deriv_x_v*E_ort[0] + h_deriv_y_v*E_ort[1]
+    return I_exact_E_dir, I_exact_ortho
 
-            h_deriv_x_c = ev_mat(sys.h_deriv[0], kx=kx_in_path_shifted_c, ky=ky_in_path_shifted_c)
-            h_deriv_y_c = ev_mat(sys.h_deriv[1], kx=kx_in_path_shifted_c, ky=ky_in_path_shifted_c)
- 
-            h_deriv_E_dir_c = h_deriv_x_c*E_dir[0] + h_deriv_y_c*E_dir[1]
-            h_deriv_ortho_c = h_deriv_x_c*E_ort[0] + h_deriv_y_c*E_ort[1]
 
-            U_h_H_U_E_dir_v = np.matmul(U_shift_v_h[:,:], np.matmul(h_deriv_E_dir_v[:,:,0], U_shift_v[:,:]))
-            U_h_H_U_ortho_v = np.matmul(U_shift_v_h[:,:], np.matmul(h_deriv_ortho_v[:,:,0], U_shift_v[:,:]))
+def velocity_matrix_elements(kx, ky, E_dir, E_ort, model):
+    '''
+    U^dagger E_dir.dh/dk U and U^dagger E_ort.dh/dk U as [n, m, i] at all points (kx[i], ky[i])
+    '''
+    h_deriv_x = ev_mat(sys.h_deriv[0], kx=kx, ky=ky, **sys.model_kwargs(model))
+    h_deriv_y = ev_mat(sys.h_deriv[1], kx=kx, ky=ky, **sys.model_kwargs(model))
+
+    h_deriv_E_dir = h_deriv_x*E_dir[0] + h_deriv_y*E_dir[1]
+    h_deriv_ortho = h_deriv_x*E_ort[0] + h_deriv_y*E_ort[1]
 
-            U_h_H_U_E_dir_c = np.matmul(U_shift_c_h[:,:], np.matmul(h_deriv_E_dir_c[:,:,0], U_shift_c[:,:]))
-            U_h_H_U_ortho_c = np.matmul(U_shift_c_h[:,:], np.matmul(h_deriv_ortho_c[:,:,0], U_shift_c[:,:]))
+    U   = sys.wf  (kx=kx, ky=ky, **sys.model_kwargs(model))
+    U_h = sys.wf_h(kx=kx, ky=ky, **sys.model_kwargs(model))
 
-            I_exact_E_dir[i_time] += np.real(U_h_H_U_E_dir_v[0,0])*(np.real(solution[i_k, 0, i_time, 0]) - subtract_from_f_v)
-            I_exact_E_dir[i_time] += np.real(U_h_H_U_E_dir_c[1,1])*np.real(solution[i_k, 0, i_time, 3])
+    return np.einsum('ijn,jln,lmn->imn', U_h, h_deriv_E_dir, U), \
+           np.einsum('ijn,jln,lmn->imn', U_h, h_deriv_ortho, U)
 
-            I_exact_ortho[i_time] += np.real(U_h_H_U_ortho_v[0,0])*(np.real(solution[i_k, 0, i_time, 0]) - subtract_from_f_v)
-            I_exact_ortho[i_time] += np.real(U_h_H_U_ortho_c[1,1])*np.real(solution[i_k, 0, i_time, 3])
 
-    return I_exact_E_dir, I_exact_ortho
+def band_velocity_matrix_element(kx, ky, E_dir, E_ort, band, model):
+    '''
+    <u_band|E_dir.dh/dk|u_band> and <u_band|E_ort.dh/dk|u_band> at all points (kx, ky)
+    '''
+    h_deriv_x = ev_mat(sys.h_deriv[0], kx=kx, ky=ky, **sys.model_kwargs(model))
+    h_deriv_y = ev_mat(sys.h_deriv[1], kx=kx, ky=ky, **sys.model_kwargs(model))
+
+    h_deriv_E_dir = h_deriv_x*E_dir[0] + h_deriv_y*E_dir[1]
+    h_deriv_ortho = h_deriv_x*E_ort[0] + h_deriv_y*E_ort[1]
+
+    U   = sys.wf  (kx=kx, ky=ky, **sys.model_kwargs(model))
+    U_h = sys.wf_h(kx=kx, ky=ky, **sys.model_kwargs(model))
+
+    return np.einsum('jn,jln,ln->n', U_h[band], h_deriv_E_dir, U[:, band]), \
+           np.einsum('jn,jln,ln->n', U_h[band], h_deriv_ortho, U[:, band])
 
 
 def check_emission_wavep(paths, solution, wf_solution, E_dir, A_field, fermi_function):
@@ -1133,76 +1357,50 @@ def get_A_field(E0, w, t, alpha):
     return np.real(-alpha*E0*np.sqrt(np.pi)/2*np.exp(-w_eff**2/4)*(2+erf(t/2/alpha-1j*w_eff/2)-erf(-t/2/alpha-1j*w_eff/2)))
 
 
-def f(t, y, kpath, dk, gamma1, gamma2, E0, B0, w, chirp, alpha, phase, do_B_field, 
+def f(t, y, kpath, neighbours, dk, gamma1, gamma2, E0, B0, w, chirp, alpha, phase, do_B_field, 
       ecv_in_path, ev_in_path, ec_in_path, dipole_in_path, 
       A_in_path, Avv_in_path, Acc_in_path, gauge,
       kx_in_path, ky_in_path, E_dir, y0_np, Bcurv_in_B_dynamics,  
-      dynamics_type):
-    return fnumba(t, y, kpath, dk, gamma1, gamma2, E0, B0, w, chirp, alpha, phase, do_B_field, 
+      dynamics_type, vg_tables, model):
+    return fnumba(t, y, kpath, neighbours, dk, gamma1, gamma2, E0, B0, w, chirp, alpha, phase, do_B_field, 
                   ecv_in_path,  ev_in_path, ec_in_path, dipole_in_path, 
                   A_in_path, Avv_in_path, Acc_in_path, gauge,
                   kx_in_path, ky_in_path, E_dir, y0_np, Bcurv_in_B_dynamics,  
-                  dynamics_type)
+                  dynamics_type, vg_tables, model)
 
-@njit
-def fnumba(t, y, kpath, dk, gamma1, gamma2, E0, B0, w, chirp, alpha, phase, do_B_field, 
+@njit(cache=compile_cache.enabled)
+def fnumba(t, y, kpath, neighbours, dk, gamma1, gamma2, E0, B0, w, chirp, alpha, phase, do_B_field, 
            ecv_in_path, ev_in_path, ec_in_path, dipole_in_path, 
            A_in_path, Avv_in_path, Acc_in_path, gauge,
            kx_in_path, ky_in_path, E_dir, y0_np, Bcurv_in_B_dynamics, 
-           dynamics_type):
+           dynamics_type, vg_tables, model):
 
     # x != y(t+dt)
     x = np.empty(np.shape(y), dtype=np.dtype('complex'))
 
     # Gradient term coefficient
     if gauge == 'length':
-        D = driving_field(E0, t)/(2*dk)
+        D = driving_field(E0, w, t, chirp, alpha, phase)/(2*dk)
     elif gauge == 'velocity':
-        k_shift = (y[-1]).real
-        kx_shift_path = kx_in_path+E_dir[0]*k_shift
-        ky_shift_path = ky_in_path+E_dir[1]*k_shift
-
-#        # check whether we ran out of the path
-#        alpha_x_shifted = kx_shift_path/length_path_in_BZ
-#        kx_shift_path   = ((np.fmod(alpha_x_shifted+0.5, 1))-0.5)*length_path_in_BZ
-#        alpha_y_shifted = ky_shift_path/length_path_in_BZ
-#        ky_shift_path   = ((np.fmod(alpha_y_shifted+0.5, 1))-0.5)*length_path_in_BZ
-
-        ecv_in_path = sys.ecjit(kx=kx_shift_path, ky=ky_shift_path) \
-            - sys.evjit(kx=kx_shift_path, ky=ky_shift_path)
-        ev_in_path = sys.evjit(kx=kx_shift_path, ky=ky_shift_path)    
-        ec_in_path = sys.ecjit(kx=kx_shift_path, ky=ky_shift_path)    
-
-        di_00x = sys.di_00xjit(kx=kx_shift_path, ky=ky_shift_path)
-        di_01x = sys.di_01xjit(kx=kx_shift_path, ky=ky_shift_path)
-        di_11x = sys.di_11xjit(kx=kx_shift_path, ky=ky_shift_path)
-        di_00y = sys.di_00yjit(kx=kx_shift_path, ky=ky_shift_path)
-        di_01y = sys.di_01yjit(kx=kx_shift_path, ky=ky_shift_path)
-        di_11y = sys.di_11yjit(kx=kx_shift_path, ky=ky_shift_path)
-        # found that the dipole needs a complex conjugate
-        dipole_in_path = E_dir[0]*di_01x + E_dir[1]*di_01y
-        A_in_path = E_dir[0]*di_00x + E_dir[1]*di_00y \
-            - (E_dir[0]*di_11x + E_dir[1]*di_11y)
-        Avv_in_path = E_dir[0]*di_00x + E_dir[1]*di_00y
-        Acc_in_path = E_dir[0]*di_11x + E_dir[1]*di_11y
+        if vg_tables[1].shape[0] > 0:
+            ecv_in_path, ev_in_path, ec_in_path, dipole_in_path, A_in_path, Avv_in_path, Acc_in_path = \
+                interpolate_velocity_gauge_path(y[-1].real, vg_tables)
+        else:
+            ecv_in_path, ev_in_path, ec_in_path, dipole_in_path, A_in_path, Avv_in_path, Acc_in_path = \
+                velocity_gauge_path(y[-1].real, kx_in_path, ky_in_path, E_dir, model)
         D = 0
 
     # Update the solution vector
-    Nk_path = kpath.shape[0]
-    for k in range(Nk_path):
+    # kpath may hold several paths one after another, the finite difference 
+    # neighbours (see path_neighbours) are periodic within each path
+    Nk = kpath.shape[0]
+    for k in range(Nk):
 
         num_time_functions = 8
 
         i = num_time_functions*k
-        if k == 0:
-            m = num_time_functions*(k+1)
-            n = num_time_functions*(Nk_path-1)
-        elif k == Nk_path-1:
-            m = 0
-            n = num_time_functions*(k-1)
-        else:
-            m = num_time_functions*(k+1)
-            n = num_time_functions*(k-1)
+        m = num_time_functions*neighbours[k, 0]
+        n = num_time_functions*neighbours[k, 1]
 
         # Energy term eband(i,k) the energy of band i at point k
         ecv = ecv_in_path[k]
@@ -1211,16 +1409,16 @@ def fnumba(t, y, kpath, dk, gamma1, gamma2, E0, B0, w, chirp, alpha, phase, do_B
 
         # Rabi frequency: w_R = d_12(k).E(t)
         dipole = dipole_in_path[k]
-        wr = rabi(E0, t, dipole)
+        wr = rabi(E0, w, t, chirp, alpha, phase, dipole)
         wr_c = wr.conjugate()
 
         # Rabi frequency: w_R = (d_11(k) - d_22(k))*E(t)
         Berry_con_diff = A_in_path[k]
-        wr_d_diag      = rabi(E0, t, Berry_con_diff)
+        wr_d_diag      = rabi(E0, w, t, chirp, alpha, phase, Berry_con_diff)
         Berry_con_v    = Avv_in_path[k]
-        wr_d_vv        = rabi(E0, t, Berry_con_v)
+        wr_d_vv        = rabi(E0, w, t, chirp, alpha, phase, Berry_con_v)
         Berry_con_c    = Acc_in_path[k]
-        wr_d_cc        = rabi(E0, t, Berry_con_c)
+        wr_d_cc        = rabi(E0, w, t, chirp, alpha, phase, Berry_con_c)
 
         if dynamics_type == 'density_matrix_dynamics':
 
@@ -1243,48 +1441,48 @@ def fnumba(t, y, kpath, dk, gamma1, gamma2, E0, B0, w, chirp, alpha, phase, do_B
                kx_shifted_path_c = kx_in_path[k] + np.real(y[i+6])
                ky_shifted_path_c = ky_in_path[k] + np.real(y[i+7])
         
-               ev_dx = sys.ev_dx(kx=kx_shifted_path_v, ky=ky_shifted_path_v)
-               ev_dy = sys.ev_dy(kx=kx_shifted_path_v, ky=ky_shifted_path_v)
-               ec_dx = sys.ec_dx(kx=kx_shifted_path_c, ky=ky_shifted_path_c)
-               ec_dy = sys.ec_dy(kx=kx_shifted_path_c, ky=ky_shifted_path_c)
-
-               di_00x_B_field = sys.di_00xjit     (kx=kx_shifted_path_v, ky=ky_shifted_path_v)
-               di_01x_B_field = sys.di_01xjit_offk(kx=kx_shifted_path_v, ky=ky_shifted_path_v, kxp=kx_shifted_path_c, kyp=ky_shifted_path_c)
-               di_11x_B_field = sys.di_11xjit     (kx=kx_shifted_path_c, ky=ky_shifted_path_c)
-               di_00y_B_field = sys.di_00yjit     (kx=kx_shifted_path_v, ky=ky_shifted_path_v)
-               di_01y_B_field = sys.di_01yjit_offk(kx=kx_shifted_path_v, ky=ky_shifted_path_v, kxp=kx_shifted_path_c, kyp=ky_shifted_path_c)
-               di_11y_B_field = sys.di_11yjit     (kx=kx_shifted_path_c, ky=ky_shifted_path_c)
+               ev_dx = sys.ev_dx(kx_shifted_path_v, ky_shifted_path_v, model)
+               ev_dy = sys.ev_dy(kx_shifted_path_v, ky_shifted_path_v, model)
+               ec_dx = sys.ec_dx(kx_shifted_path_c, ky_shifted_path_c, model)
+               ec_dy = sys.ec_dy(kx_shifted_path_c, ky_shifted_path_c, model)
+
+               di_00x_B_field = sys.di_00xjit     (kx_shifted_path_v, ky_shifted_path_v, model)
+               di_01x_B_field = sys.di_01xjit_offk(kx_shifted_path_v, ky_shifted_path_v, kx_shifted_path_c, ky_shifted_path_c, model)
+               di_11x_B_field = sys.di_11xjit     (kx_shifted_path_c, ky_shifted_path_c, model)
+               di_00y_B_field = sys.di_00yjit     (kx_shifted_path_v, ky_shifted_path_v, model)
+               di_01y_B_field = sys.di_01yjit_offk(kx_shifted_path_v, ky_shifted_path_v, kx_shifted_path_c, ky_shifted_path_c, model)
+               di_11y_B_field = sys.di_11yjit     (kx_shifted_path_c, ky_shifted_path_c, model)
 
                dipole_in_path_B = E_dir[0]*di_01x_B_field + E_dir[1]*di_01y_B_field
                A_in_path_B      = E_dir[0]*di_00x_B_field + E_dir[1]*di_00y_B_field - (E_dir[0]*di_11x_B_field + E_dir[1]*di_11y_B_field)
-               wr_B             = rabi(E0, t, dipole_in_path_B)
+               wr_B             = rabi(E0, w, t, chirp, alpha, phase, dipole_in_path_B)
                wr_B_c           = wr_B.conjugate()
-               wr_d_diag_B      = rabi(E0, t, A_in_path_B)
-               ecv_in_path_B    = sys.ecjit   (kx=kx_shifted_path_c, ky=ky_shifted_path_c) \
-                                - sys.evjit   (kx=kx_shifted_path_v, ky=ky_shifted_path_v)
+               wr_d_diag_B      = rabi(E0, w, t, chirp, alpha, phase, A_in_path_B)
+               ecv_in_path_B    = sys.ecjit   (kx_shifted_path_c, ky_shifted_path_c, model) \
+                                - sys.evjit   (kx_shifted_path_v, ky_shifted_path_v, model)
 #               if Bcurv_in_B_dynamics: 
-#                  Bcurv_v = sys.cu_00jit(kx=kx_shifted_path_v, ky=ky_shifted_path_v)
-#                  Bcurv_c = sys.cu_11jit(kx=kx_shifted_path_c, ky=ky_shifted_path_c)
+#                  Bcurv_v = sys.cu_00jit(kx_shifted_path_v, ky_shifted_path_v, model)
+#                  Bcurv_c = sys.cu_11jit(kx_shifted_path_c, ky_shifted_path_c, model)
 #               else:
                Bcurv_v = 0
                Bcurv_c = 0
 
                # use the unnecessary entry i+2 to compute the k-point shift 
-               B_z = driving_field(B0, t)
-               E_x = driving_field(E0, t) * E_dir[0]
-               E_y = driving_field(E0, t) * E_dir[1]
+               B_z = driving_field(B0, w, t, chirp, alpha, phase)
+               E_x = driving_field(E0, w, t, chirp, alpha, phase) * E_dir[0]
+               E_y = driving_field(E0, w, t, chirp, alpha, phase) * E_dir[1]
                x[i]   = 2*(wr_B*y[i+1]).imag - gamma1*(y[i]-y0_np[i])
                x[i+1] = (1j*ecv_in_path_B - gamma2 + 1j*wr_d_diag_B)*y[i+1] - 1j*wr_B_c*(y[i]-y[i+3]) 
                x[i+2] = x[i+1].conjugate()
                x[i+3] = -2*(wr_B*y[i+1]).imag - gamma1*(y[i+3]-y0_np[i+3])
                # k_v_x
-               x[i+4] = - driving_field(E0, t)*E_dir[0] - B_z*(ev_dy + Bcurv_v*E_x) / (1 - Bcurv_v*B_z)
+               x[i+4] = - driving_field(E0, w, t, chirp, alpha, phase)*E_dir[0] - B_z*(ev_dy + Bcurv_v*E_x) / (1 - Bcurv_v*B_z)
                # k_v_y
-               x[i+5] = - driving_field(E0, t)*E_dir[1] + B_z*(ev_dx - Bcurv_v*E_y) / (1 - Bcurv_v*B_z)
+               x[i+5] = - driving_field(E0, w, t, chirp, alpha, phase)*E_dir[1] + B_z*(ev_dx - Bcurv_v*E_y) / (1 - Bcurv_v*B_z)
                # k_c_x
-               x[i+6] = - driving_field(E0, t)*E_dir[0] - B_z*(ec_dy + Bcurv_c*E_x) / (1 - Bcurv_c*B_z)
+               x[i+6] = - driving_field(E0, w, t, chirp, alpha, phase)*E_dir[0] - B_z*(ec_dy + Bcurv_c*E_x) / (1 - Bcurv_c*B_z)
                # k_v_y
-               x[i+7] = - driving_field(E0, t)*E_dir[1] + B_z*(ec_dx - Bcurv_c*E_y) / (1 - Bcurv_c*B_z)
+               x[i+7] = - driving_field(E0, w, t, chirp, alpha, phase)*E_dir[1] + B_z*(ec_dx - Bcurv_c*E_y) / (1 - Bcurv_c*B_z)
 
         elif dynamics_type == 'wavefunction_dynamics':
 
@@ -1300,10 +1498,248 @@ def fnumba(t, y, kpath, dk, gamma1, gamma2, E0, B0, w, chirp, alpha, phase, do_B
            x[i+7] = 0
 
     # last component of x is the E-field to obtain the vector potential A(t)
-    x[-1] = -driving_field(E0, t)
+    x[-1] = -driving_field(E0, w, t, chirp, alpha, phase)
 
     return x
 
+@njit(cache=compile_cache.enabled)
+def velocity_gauge_path(k_shift, kx_in_path, ky_in_path, E_dir, model):
+    '''
+    Band energies and dipoles along the path shifted by k_shift*E_dir,
+    i.e. by the vector potential in the velocity gauge
+    '''
+    kx_shift_path = kx_in_path+E_dir[0]*k_shift
+    ky_shift_path = ky_in_path+E_dir[1]*k_shift
+
+#        # check whether we ran out of the path
+#        alpha_x_shifted = kx_shift_path/length_path_in_BZ
+#        kx_shift_path   = ((np.fmod(alpha_x_shifted+0.5, 1))-0.5)*length_path_in_BZ
+#        alpha_y_shifted = ky_shift_path/length_path_in_BZ
+#        ky_shift_path   = ((np.fmod(alpha_y_shifted+0.5, 1))-0.5)*length_path_in_BZ
+
+    ecv_in_path = sys.ecjit(kx_shift_path, ky_shift_path, model) \
+        - sys.evjit(kx_shift_path, ky_shift_path, model)
+    ev_in_path = sys.evjit(kx_shift_path, ky_shift_path, model)    
+    ec_in_path = sys.ecjit(kx_shift_path, ky_shift_path, model)    
+
+    di_00x = sys.di_00xjit(kx_shift_path, ky_shift_path, model)
+    di_01x = sys.di_01xjit(kx_shift_path, ky_shift_path, model)
+    di_11x = sys.di_11xjit(kx_shift_path, ky_shift_path, model)
+    di_00y = sys.di_00yjit(kx_shift_path, ky_shift_path, model)
+    di_01y = sys.di_01yjit(kx_shift_path, ky_shift_path, model)
+    di_11y = sys.di_11yjit(kx_shift_path, ky_shift_path, model)
+    # found that the dipole needs a complex conjugate
+    dipole_in_path = E_dir[0]*di_01x + E_dir[1]*di_01y
+    A_in_path = E_dir[0]*di_00x + E_dir[1]*di_00y \
+        - (E_dir[0]*di_11x + E_dir[1]*di_11y)
+    Avv_in_path = E_dir[0]*di_00x + E_dir[1]*di_00y
+    Acc_in_path = E_dir[0]*di_11x + E_dir[1]*di_11y
+
+    return ecv_in_path, ev_in_path, ec_in_path, dipole_in_path, A_in_path, Avv_in_path, Acc_in_path
+
+@njit(cache=compile_cache.enabled)
+def interpolate_velocity_gauge_path(k_shift, vg_tables):
+    '''
+    velocity_gauge_path interpolated from the tables of velocity_gauge_tables
+    '''
+    shift_grid = vg_tables[0]
+    return cubic_interpolation_numba(vg_tables[1], shift_grid, k_shift), \
+           cubic_interpolation_numba(vg_tables[2], shift_grid, k_shift), \
+           cubic_interpolation_numba(vg_tables[3], shift_grid, k_shift), \
+           cubic_interpolation_numba(vg_tables[4], shift_grid, k_shift), \
+           cubic_interpolation_numba(vg_tables[5], shift_grid, k_shift), \
+           cubic_interpolation_numba(vg_tables[6], shift_grid, k_shift), \
+           cubic_interpolation_numba(vg_tables[7], shift_grid, k_shift)
+
+
+@njit(cache=compile_cache.enabled)
+def cubic_interpolation_numba(table, shift_grid, k_shift):
+    '''
+    Local cubic (4-point Lagrange) interpolation of table[i_shift, :], tabulated at 
+    the shifts shift_grid[0] + i_shift*shift_grid[1], at the shift k_shift
+    '''
+    x = (k_shift - shift_grid[0])/shift_grid[1]
+    i = min(max(int(np.floor(x)), 1), table.shape[0] - 3)
+    u = x - i
+    return - u*(u - 1)*(u - 2)/6*table[i-1] + (u + 1)*(u - 1)*(u - 2)/2*table[i] \
+           - (u + 1)*u*(u - 2)/2*table[i+1] + (u + 1)*u*(u - 1)/6*table[i+2]
+
+
+def cubic_interpolation(table, shift_grid, k_shifts):
+    '''
+    cubic_interpolation_numba for an array of shifts, returns [i, ...] at k_shifts[i]
+    '''
+    x = (k_shifts - shift_grid[0])/shift_grid[1]
+    i = np.clip(np.floor(x).astype(int), 1, np.shape(table)[0] - 3)
+    u = (x - i).reshape((-1,) + (1,)*(np.ndim(table) - 1))
+    return - u*(u - 1)*(u - 2)/6*table[i-1] + (u + 1)*(u - 1)*(u - 2)/2*table[i] \
+           - (u + 1)*u*(u - 2)/2*table[i+1] + (u + 1)*u*(u - 1)/6*table[i+2]
+
+
+def velocity_gauge_tables(kx_in_path, ky_in_path, E_dir, A_min, A_max, tol, user_out, model):
+    '''
+    Tables of the output of velocity_gauge_path (for fnumba) and of U^dagger dh/dk U
+    (for emission_exact) on the lines k + s*E_dir, A_min <= s <= A_max, which contain
+    all k-points shifted by the vector potential. The equidistant spacing in s is
+    halved until the cubic interpolation reproduces the direct evaluation at the
+    midpoints of the intervals within the relative accuracy tol. 
+    tol = 0 returns empty tables (direct evaluation in fnumba) and no emission tables.
+    Both tables are indexed as [i_shift, ..., i_k], their first entry is shift_grid.
+    '''
+    E_ort = np.array([E_dir[1], -E_dir[0]])
+    Nk = np.size(kx_in_path)
+
+    def evaluate(shifts):
+        kx_shifted = (kx_in_path[np.newaxis, :] + shifts[:, np.newaxis]*E_dir[0]).ravel()
+        ky_shifted = (ky_in_path[np.newaxis, :] + shifts[:, np.newaxis]*E_dir[1]).ravel()
+        tables = [np.reshape(q, (-1, Nk)) for q in velocity_gauge_path(0.0, kx_shifted, ky_shifted, E_dir, model)]
+        if tol > 0:
+            tables += [np.moveaxis(np.reshape(q, (2, 2, -1, Nk)), 2, 0) 
+                       for q in velocity_matrix_elements(kx_shifted, ky_shifted, E_dir, E_ort, model)]
+        return tables
+
+    if tol <= 0:
+        # Empty tables of the same types as the direct evaluation
+        empty_tables = [q[:0] for q in evaluate(np.zeros(1))]
+        return (np.zeros(2),) + tuple(empty_tables), None
+
+    # Margin for the step size control of the adaptive solvers
+    margin = 0.05*(A_max - A_min) + 1e-6
+    n_shifts = 17
+    n_shifts_max = 2**13 + 1
+    shifts = np.linspace(A_min - margin, A_max + margin, n_shifts)
+    tables = evaluate(shifts)
+    while True:
+        shift_grid = np.array([shifts[0], shifts[1] - shifts[0]])
+        mid_shifts = shifts[:-1] + shift_grid[1]/2
+        mid_tables = evaluate(mid_shifts)
+        error = max(np.max(np.abs(cubic_interpolation(table, shift_grid, mid_shifts) - mid_table)) 
+                    / max(np.max(np.abs(mid_table)), 1e-300) 
+                    for table, mid_table in zip(tables, mid_tables))
+
+        # Refine the tables by the midpoints
+        n_shifts = 2*n_shifts - 1
+        shifts = np.linspace(shifts[0], shifts[-1], n_shifts)
+        for i_table, (table, mid_table) in enumerate(zip(tables, mid_tables)):
+            tables[i_table] = np.empty((n_shifts,) + np.shape(table)[1:], dtype=np.result_type(table, mid_table))
+            tables[i_table][0::2] = table
+            tables[i_table][1::2] = mid_table
+
+        if error < tol:
+            break
+        if n_shifts >= n_shifts_max:
+            if user_out:
+                print("Interpolation tables not converged, relative error: " + str(error))
+            break
+
+    shift_grid = np.array([shifts[0], shifts[1] - shifts[0]])
+    return (shift_grid,) + tuple(tables[:7]), (shift_grid,) + tuple(tables[7:])
+
+
+def A_field_range(E0, w, chirp, alpha, phase, t0, tf, dt):
+    '''
+    Minimum and maximum of the vector potential A(t) = -int_t0^t E(t') dt' for t0 <= t <= tf
+    '''
+    t = np.linspace(t0, tf, 4*int((tf-t0)/dt) + 1)
+    E_field = driving_field(E0, w, t, chirp, alpha, phase)
+    A_field = -np.concatenate(([0], np.cumsum((E_field[1:] + E_field[:-1])/2*(t[1] - t[0]))))
+    return np.min(A_field), np.max(A_field)
+
+
+def jac(t, y, kpath, neighbours, dk, gamma1, gamma2, E0, B0, w, chirp, alpha, phase, do_B_field, 
+        ecv_in_path, ev_in_path, ec_in_path, dipole_in_path, 
+        A_in_path, Avv_in_path, Acc_in_path, gauge,
+        kx_in_path, ky_in_path, E_dir, y0_np, Bcurv_in_B_dynamics,  
+        dynamics_type, vg_tables, model):
+    return jacnumba(t, y, kpath, neighbours, dk, gamma1, gamma2, E0, B0, w, chirp, alpha, phase, do_B_field, 
+                    ecv_in_path,  ev_in_path, ec_in_path, dipole_in_path, 
+                    A_in_path, Avv_in_path, Acc_in_path, gauge,
+                    kx_in_path, ky_in_path, E_dir, y0_np, Bcurv_in_B_dynamics,  
+                    dynamics_type, vg_tables, model)
+
+
+def jacobian_bandwidth(gauge):
+    '''
+    Half bandwidth of the Jacobian of fnumba: the 4x4 density-matrix block 
+    of a k-point couples entries up to 2 apart, the length-gauge gradient 
+    term couples to the neighbouring k-points 8 entries apart
+    '''
+    if gauge == 'length':
+        return 8
+    return 2
+
+
+@njit(cache=compile_cache.enabled)
+def jacnumba(t, y, kpath, neighbours, dk, gamma1, gamma2, E0, B0, w, chirp, alpha, phase, do_B_field, 
+             ecv_in_path, ev_in_path, ec_in_path, dipole_in_path, 
+             A_in_path, Avv_in_path, Acc_in_path, gauge,
+             kx_in_path, ky_in_path, E_dir, y0_np, Bcurv_in_B_dynamics, 
+             dynamics_type, vg_tables, model):
+    '''
+    Analytic Jacobian of fnumba (density matrix dynamics without B-field)
+    in zvode's packed banded format jac_packed[i-j+band, j] = d x[i]/d y[j].
+    fnumba is not holomorphic (it uses .imag and .conjugate() of p_vc), 
+    the Jacobian is the one of its holomorphic form on rho = rho^dagger, 
+    i.e. 2*Im(wr*p_vc) = -1j*(wr*p_vc - wr^*p_cv). Left out are the periodic 
+    wrap-around of the gradient term at the ends of each path and, in the 
+    velocity gauge, the dependence on the vector potential y[-1]. The 
+    Jacobian only enters the Newton iteration of the BDF method, so this 
+    changes the convergence rate but not the solution.
+    '''
+    band = 2
+    if gauge == 'length':
+        band = 8
+        D = driving_field(E0, w, t, chirp, alpha, phase)/(2*dk)
+    elif gauge == 'velocity':
+        if vg_tables[1].shape[0] > 0:
+            ecv_in_path, ev_in_path, ec_in_path, dipole_in_path, A_in_path, Avv_in_path, Acc_in_path = \
+                interpolate_velocity_gauge_path(y[-1].real, vg_tables)
+        else:
+            ecv_in_path, ev_in_path, ec_in_path, dipole_in_path, A_in_path, Avv_in_path, Acc_in_path = \
+                velocity_gauge_path(y[-1].real, kx_in_path, ky_in_path, E_dir, model)
+        D = 0
+
+    jac_packed = np.zeros((2*band+1, y.size), dtype=np.dtype('complex'))
+
+    Nk = kpath.shape[0]
+    for k in range(Nk):
+
+        num_time_functions = 8
+
+        i = num_time_functions*k
+
+        ecv = ecv_in_path[k]
+        wr = rabi(E0, w, t, chirp, alpha, phase, dipole_in_path[k])
+        wr_c = wr.conjugate()
+        wr_d_diag = rabi(E0, w, t, chirp, alpha, phase, A_in_path[k])
+
+        # f_v
+        jac_packed[band, i]                 = -gamma1
+        jac_packed[i-(i+1)+band, i+1]       = -1j*wr
+        jac_packed[i-(i+2)+band, i+2]       = 1j*wr_c
+        # p_vc
+        jac_packed[(i+1)-i+band, i]         = -1j*wr_c
+        jac_packed[band, i+1]               = 1j*ecv - gamma2 + 1j*wr_d_diag
+        jac_packed[(i+1)-(i+3)+band, i+3]   = 1j*wr_c
+        # p_cv
+        jac_packed[(i+2)-i+band, i]         = 1j*wr
+        jac_packed[band, i+2]               = -1j*ecv - gamma2 - 1j*wr_d_diag.conjugate()
+        jac_packed[(i+2)-(i+3)+band, i+3]   = -1j*wr
+        # f_c
+        jac_packed[(i+3)-(i+1)+band, i+1]   = 1j*wr
+        jac_packed[(i+3)-(i+2)+band, i+2]   = -1j*wr_c
+        jac_packed[band, i+3]               = -gamma1
+
+        # Gradient term D*(y[m] - y[n]) to the neighbours within the path
+        if gauge == 'length':
+            for i_f in range(4):
+                if neighbours[k, 0] == k+1:
+                    jac_packed[band-num_time_functions, i+i_f+num_time_functions] = D
+                if neighbours[k, 1] == k-1:
+                    jac_packed[band+num_time_functions, i+i_f-num_time_functions] = -D
+
+    return jac_packed
+
 '''
 OUT OF DATE/NOT FUNCTIONAL! FOR FUTURE WORK ON MAGNETIC FIELD IMPLEMENTATION.
 '''
@@ -1455,41 +1891,5 @@ def initial_condition(y0,e_fermi,temperature,e_c,i_k,dynamics_type):
         y0.extend([1.0,0.0,0.0,1.0,0.0,0.0,0.0,0.0])
 
 
-def BZ_plot(kpnts,a,b1,b2,E_dir,paths):
-
-    R = 4.0*np.pi/(3*a)
-    r = 2.0*np.pi/(np.sqrt(3)*a)
-
-    BZ_fig = pl.figure(figsize=(10,10))
-    ax = BZ_fig.add_subplot(111,aspect='equal')
-
-    ax.add_patch(patches.RegularPolygon((0,0),6,radius=R,orientation=np.pi/6,fill=False))
-    ax.add_patch(patches.RegularPolygon(b1,6,radius=R,orientation=np.pi/6,fill=False))
-    ax.add_patch(patches.RegularPolygon(-b1,6,radius=R,orientation=np.pi/6,fill=False))
-    ax.add_patch(patches.RegularPolygon(b2,6,radius=R,orientation=np.pi/6,fill=False))
-    ax.add_patch(patches.RegularPolygon(-b2,6,radius=R,orientation=np.pi/6,fill=False))
-    ax.add_patch(patches.RegularPolygon(b1+b2,6,radius=R,orientation=np.pi/6,fill=False))
-    ax.add_patch(patches.RegularPolygon(-b1-b2,6,radius=R,orientation=np.pi/6,fill=False))
-
-    ax.arrow(-0.5*E_dir[0],-0.5*E_dir[1],E_dir[0],E_dir[1],width=0.005,alpha=0.5,label='E-field')
-
-    pl.scatter(0,0,s=15,c='black')
-    pl.text(0.01,0.01,r'$\Gamma$')
-    pl.scatter(r*np.cos(-np.pi/6),r*np.sin(-np.pi/6),s=15,c='black')
-    pl.text(r*np.cos(-np.pi/6)+0.01,r*np.sin(-np.pi/6)-0.05,r'$M$')
-    pl.scatter(R,0,s=15,c='black')
-    pl.text(R,0.02,r'$K$')
-    pl.scatter(kpnts[:,0],kpnts[:,1], s=15)
-    pl.xlim(-25.0/a,25.0/a)
-    pl.ylim(-5.0/a,5.0/a)
-    pl.xlabel(r'$k_x$ ($1/a_0$)')
-    pl.ylabel(r'$k_y$ ($1/a_0$)')
-
-    for path in paths:
-        path = np.array(path)
-        pl.plot(path[:,0],path[:,1])
-
-    return
-
 if __name__ == "__main__":
     main()
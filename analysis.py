@@ -0,0 +1,574 @@
+import os
+import ast
+import json
+import argparse
+import numpy as np
+import matplotlib.pyplot as pl
+from matplotlib import patches
+from types import SimpleNamespace
+
+import spectra
+import output
+import profiling
+
+'''
+Spectra, output files and plots of an SBE run from its time signals.
+SBE.main calls emission_analysis after the time evolution. Run as a script,
+the analysis is repeated for runs stored with output_format = 'npz', e.g.
+with another window width, normalization or output format:
+
+    python3 analysis.py --set normalize_emission=True --out reanalysis SBE_*.npz
+
+Neither the symbolic system nor any numba kernel is needed for this. The
+J/P/I files of the default output_format = 'text' lack the vector potential,
+the exact emission signals and the parameters, those runs cannot be
+reanalysed and have to be rerun with output_format = 'npz'.
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute spectra, output files and plots of stored SBE runs')
+    parser.add_argument('files', nargs='+', help='npz files written by SBE.py with output_format = \'npz\'')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE', 
+                        help='change a parameter of params.py for the analysis (repeatable)')
+    parser.add_argument('--out', default='reanalysis', help='directory of the output files')
+    parser.add_argument('--plot', action='store_true', help='show the plots of each run')
+    args = parser.parse_args()
+
+    overrides = {}
+    for setting in args.set:
+        name, value = setting.split('=', 1)
+        try:
+            overrides[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[name] = value
+    overrides['user_out'] = args.plot
+
+    os.makedirs(args.out, exist_ok=True)
+    for filename in args.files:
+        if not filename.endswith('.npz'):
+            print("Skipping " + filename + ": not an npz file, rerun SBE.py with output_format = 'npz'")
+            continue
+        print("Analysing " + filename)
+        reanalyze(filename, overrides, args.out)
+
+
+def reanalyze(filename, overrides={}, output_dir='.'):
+    '''
+    Repeats emission_analysis for the run stored in filename with the
+    parameters of the run changed by overrides
+    '''
+    with np.load(filename) as run:
+        params = SimpleNamespace(**json.loads(str(run['params'])))
+        for name in ['b1', 'b2']:
+            setattr(params, name, np.array(getattr(params, name)))
+        for name, value in overrides.items():
+            setattr(params, name, value)
+        signals = [run[name] for name in ['A_field', 'P_E_dir', 'P_ortho', 'J_E_dir', 'J_ortho', 
+                                          'I_exact_E_dir', 'I_exact_ortho', 'I_exact_diag_E_dir', 'I_exact_diag_ortho', 
+                                          'I_exact_offd_E_dir', 'I_exact_offd_ortho']]
+        # Stored in fs
+        t = run['t']*params.fs_conv
+
+    do_B_field = params.B0*params.B_conv > 1e-15
+    return emission_analysis(params, t, *signals, do_B_field, output_dir=output_dir)
+
+
+def emission_analysis(params, t, A_field, P_E_dir, P_ortho, J_E_dir, J_ortho, I_exact_E_dir, I_exact_ortho, 
+                      I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho, 
+                      do_B_field, E_dir=None, kpnts=None, paths=None, output_dir='.'):
+    '''
+    Computes the spectra of the time signals (atomic units) of a run with params, 
+    writes the output files to output_dir and plots them. Returns the time 
+    signals and emission spectra. The Brillouin zone is plotted if kpnts is given.
+    '''
+    # RETRIEVE PARAMETERS
+    ###############################################################################################
+    fs_conv  = params.fs_conv
+    E_conv   = params.E_conv
+    THz_conv = params.THz_conv
+
+    a      = params.a                                 # Lattice spacing
+    b1     = params.b1                                # Reciprocal lattice vectors
+    b2     = params.b2
+    E0     = params.E0*E_conv                         # Driving pulse field amplitude
+    w      = params.w*THz_conv                        # Driving pulse frequency
+    alpha  = params.alpha*fs_conv                     # Gaussian pulse width (also width of the window)
+    phase  = params.phase                             # Carrier-envelope phase
+    T2     = params.T2*fs_conv                        # Polarization damping time
+
+    BZ_type = params.BZ_type
+    if BZ_type == 'full':
+        Nk1 = params.Nk1
+        Nk2 = params.Nk2
+    elif BZ_type == 'full_for_velocity':
+        Nk1 = params.Nk1_vel
+        Nk2 = params.Nk2_vel
+    elif BZ_type == '2line':
+        Nk_in_path        = params.Nk_in_path
+        rel_dist_to_Gamma = params.rel_dist_to_Gamma
+        length_path_in_BZ = params.length_path_in_BZ
+
+    user_out            = params.user_out
+    print_J_P_I_files   = params.print_J_P_I_files
+    output_format       = params.output_format
+    test                = params.test
+    do_emission_wavep   = params.emission_wavep
+    KK_emission         = params.KK_emission
+    normalize_emission  = params.normalize_emission
+
+    # Wavepacket emission is not computed (see SBE.path_evolution)
+    I_wavep_E_dir, I_wavep_ortho, I_wavep_check_E_dir, I_wavep_check_ortho = [], [], [], []
+
+    # Approximate emission in time
+    window = Gaussian_envelope(t,alpha)
+    Pdot_E_dir, Pdot_ortho = diff(t,P_E_dir), diff(t,P_ortho)
+    I_E_dir, I_ortho = Pdot_E_dir*window + J_E_dir*window, \
+                       Pdot_ortho*window + J_ortho*window
+
+    # Fourier transforms, one batched real FFT without and one with the Gaussian window
+    dt_out   = t[1]-t[0]
+    freq     = np.fft.fftshift(np.fft.fftfreq(np.size(t), d=dt_out))
+    Iw_E_dir, Iw_ortho, Pw_E_dir, Pw_ortho = spectra.spectra([I_E_dir, I_ortho, Pdot_E_dir, Pdot_ortho])
+    Jw_E_dir, Jw_ortho, Iw_exact_E_dir, Iw_exact_ortho, Iw_exact_diag_E_dir, Iw_exact_diag_ortho, Iw_exact_offd_E_dir, Iw_exact_offd_ortho = \
+        spectra.spectra([J_E_dir, J_ortho, I_exact_E_dir, I_exact_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, 
+                         I_exact_offd_E_dir, I_exact_offd_ortho], window)
+
+    # Emission projected on all directions (without the 'ortho' normalization), 
+    # linear in the two base spectra
+    angles = np.linspace(0,2.0*np.pi,361)
+    Iw_r = np.sqrt(np.size(t))*spectra.angle_resolved(Iw_exact_E_dir, Iw_exact_ortho, angles)
+
+    if do_emission_wavep:
+       Iw_wavep_E_dir, Iw_wavep_ortho, Iw_wavep_check_E_dir, Iw_wavep_check_ortho = \
+           spectra.spectra([I_wavep_E_dir, I_wavep_ortho, I_wavep_check_E_dir, I_wavep_check_ortho], window)
+
+    if BZ_type == '2line':
+        # include k-point weights
+        kpoint_weight = 2*rel_dist_to_Gamma*length_path_in_BZ/(Nk_in_path-1)
+        Pw_E_dir            = Pw_E_dir*kpoint_weight
+        Pw_ortho            = Pw_ortho*kpoint_weight
+        Jw_E_dir            = Jw_E_dir*kpoint_weight
+        Jw_ortho            = Jw_ortho*kpoint_weight
+        Iw_E_dir            = Iw_E_dir*kpoint_weight
+        Iw_ortho            = Iw_ortho*kpoint_weight
+        Iw_exact_E_dir      = Iw_exact_E_dir*kpoint_weight
+        Iw_exact_ortho      = Iw_exact_ortho*kpoint_weight
+        Iw_exact_diag_E_dir = Iw_exact_diag_E_dir*kpoint_weight
+        Iw_exact_diag_ortho = Iw_exact_diag_ortho*kpoint_weight
+        Iw_exact_offd_E_dir = Iw_exact_offd_E_dir*kpoint_weight
+        Iw_exact_offd_ortho = Iw_exact_offd_ortho*kpoint_weight
+
+    # Emission intensity (exact formula)
+    prefac_emission      = 1/(3*(137.036**3)) # 1/(3c^3) in atomic units
+    Int_exact_E_dir      = prefac_emission*np.abs((freq**2)*Iw_exact_E_dir**2.0)
+    Int_exact_ortho      = prefac_emission*np.abs((freq**2)*Iw_exact_ortho**2.0)
+    Int_exact_diag_E_dir = prefac_emission*np.abs((freq**2)*Iw_exact_diag_E_dir**2.0)
+    Int_exact_diag_ortho = prefac_emission*np.abs((freq**2)*Iw_exact_diag_ortho**2.0)
+    Int_exact_offd_E_dir = prefac_emission*np.abs((freq**2)*Iw_exact_offd_E_dir**2.0)
+    Int_exact_offd_ortho = prefac_emission*np.abs((freq**2)*Iw_exact_offd_ortho**2.0)
+    Int_E_dir            = prefac_emission*np.abs((freq**2)*Iw_E_dir**2.0)
+    Int_ortho            = prefac_emission*np.abs((freq**2)*Iw_ortho**2.0)
+
+    freq_indices_near_base_freq = np.argwhere(np.logical_and(freq/w > 0.9, freq/w < 1.1))
+    freq_index_base_freq = int((freq_indices_near_base_freq[0] + freq_indices_near_base_freq[-1])/2)
+    if normalize_emission:
+        Int_tot_base_freq = Int_exact_E_dir[freq_index_base_freq] + Int_exact_ortho[freq_index_base_freq]
+        log_limits = (1e-7,1e1)
+    else:
+        # no normalization at all, no k-point weights
+        Int_tot_base_freq = 1
+
+        I_max = (Int_exact_E_dir[freq_index_base_freq] + Int_exact_ortho[freq_index_base_freq]) / Int_tot_base_freq
+
+        freq_indices_near_base_freq = np.argwhere(np.logical_and(freq/w > 19.9, freq/w < 20.1))
+        freq_index_base_freq = int((freq_indices_near_base_freq[0] + freq_indices_near_base_freq[-1])/2)
+        I_min = (Int_exact_E_dir[freq_index_base_freq] + Int_exact_ortho[freq_index_base_freq] ) / Int_tot_base_freq
+
+        log_limits = ( 10**(np.ceil(np.log10(I_min))-2) , 10**(np.ceil(np.log10(I_max)) + 1) )
+
+    # Save observables to file
+    if (BZ_type == '2line'):
+        Nk1 = Nk_in_path
+        Nk2 = 2
+
+    # Output files (the npz file is completed in the background)
+    with profiling.phase('analysis/output files'):
+        writer = None
+        if print_J_P_I_files and output_format == 'npz':
+            # All observables and the parameters in one file, written in the background
+            out_filename = str('SBE_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}.npz').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
+            writer = output.OutputWriter(os.path.join(output_dir, out_filename), params)
+            datasets = {'t': t/fs_conv, 'A_field': A_field, 'freq': freq/w, 
+                        'P_E_dir': P_E_dir, 'P_ortho': P_ortho, 'J_E_dir': J_E_dir, 'J_ortho': J_ortho, 
+                        'I_E_dir': I_E_dir, 'I_ortho': I_ortho, 
+                        'I_exact_E_dir': I_exact_E_dir, 'I_exact_ortho': I_exact_ortho, 
+                        'I_exact_diag_E_dir': I_exact_diag_E_dir, 'I_exact_diag_ortho': I_exact_diag_ortho, 
+                        'I_exact_offd_E_dir': I_exact_offd_E_dir, 'I_exact_offd_ortho': I_exact_offd_ortho, 
+                        'Pw_E_dir': Pw_E_dir, 'Pw_ortho': Pw_ortho, 'Jw_E_dir': Jw_E_dir, 'Jw_ortho': Jw_ortho, 
+                        'Iw_E_dir': Iw_E_dir, 'Iw_ortho': Iw_ortho, 
+                        'Iw_exact_E_dir': Iw_exact_E_dir, 'Iw_exact_ortho': Iw_exact_ortho, 
+                        'Int_E_dir': Int_E_dir, 'Int_ortho': Int_ortho, 
+                        'Int_exact_E_dir': Int_exact_E_dir, 'Int_exact_ortho': Int_exact_ortho, 
+                        'Int_exact_diag_E_dir': Int_exact_diag_E_dir, 'Int_exact_diag_ortho': Int_exact_diag_ortho, 
+                        'Int_exact_offd_E_dir': Int_exact_offd_E_dir, 'Int_exact_offd_ortho': Int_exact_offd_ortho, 
+                        'Int_tot_base_freq': Int_tot_base_freq}
+            for name, data in datasets.items():
+                writer.add(name, data)
+
+        elif print_J_P_I_files:  
+            J_filename = str('J_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
+            np.save(os.path.join(output_dir, J_filename), [t/fs_conv, J_E_dir, J_ortho, freq/w, Jw_E_dir, Jw_ortho])
+            P_filename = str('P_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
+            np.save(os.path.join(output_dir, P_filename), [t/fs_conv, P_E_dir, P_ortho, freq/w, Pw_E_dir, Pw_ortho])
+            I_filename = str('I_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
+            np.save(os.path.join(output_dir, I_filename), [t/fs_conv, I_E_dir, I_ortho, freq/w, np.abs(Int_E_dir), np.abs(Int_ortho), Int_E_dir, Int_ortho])
+
+            J_filename = str('J_KK_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
+            np.savetxt(os.path.join(output_dir, J_filename), np.c_[freq/w, np.abs(freq**2*Jw_E_dir**2)/Int_tot_base_freq, np.abs(freq**2*Jw_ortho**2)/Int_tot_base_freq])
+            P_filename = str('P_KK_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
+            np.savetxt(os.path.join(output_dir, P_filename), np.c_[freq/w, np.abs(freq**2*Pw_E_dir**2)/Int_tot_base_freq, np.abs(freq**2*Pw_ortho**2)/Int_tot_base_freq])
+            I_filename = str('I_KK_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
+            np.savetxt(os.path.join(output_dir, I_filename), np.c_[freq/w, np.abs(Int_E_dir)/Int_tot_base_freq, np.abs(Int_ortho)/Int_tot_base_freq, (np.abs(Int_E_dir)+np.abs(Int_ortho))/Int_tot_base_freq])
+            Iex_filename = str('I_ex_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
+            np.savetxt(os.path.join(output_dir, Iex_filename), np.c_[freq/w, np.abs(Int_exact_E_dir)/Int_tot_base_freq, np.abs(Int_exact_ortho)/Int_tot_base_freq, 
+                                          (np.abs(Int_exact_E_dir)+np.abs(Int_exact_ortho))/Int_tot_base_freq ])
+            Iex_diag_filename = str('I_ex_diag_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
+            np.savetxt(os.path.join(output_dir, Iex_diag_filename), np.c_[freq/w, np.abs(Int_exact_diag_E_dir)/Int_tot_base_freq, np.abs(Int_exact_diag_ortho)/Int_tot_base_freq, 
+                                          (np.abs(Int_exact_diag_E_dir)+np.abs(Int_exact_diag_ortho))/Int_tot_base_freq ])
+            Iex_offd_filename = str('I_ex_offd_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}').format(Nk1,Nk2,w/THz_conv,E0/E_conv,alpha/fs_conv,phase,T2/fs_conv)
+            np.savetxt(os.path.join(output_dir, Iex_offd_filename), np.c_[freq/w, np.abs(Int_exact_offd_E_dir)/Int_tot_base_freq, np.abs(Int_exact_offd_ortho)/Int_tot_base_freq, 
+                                          (np.abs(Int_exact_offd_E_dir)+np.abs(Int_exact_offd_ortho))/Int_tot_base_freq ])
+
+    if (not test and user_out):
+        real_fig, (axE,axA,axP,axPdot,axJ) = pl.subplots(5,1,figsize=(10,10))
+        t_lims = (-10*alpha/fs_conv, 10*alpha/fs_conv)
+        freq_lims = (0,25)
+        axE.set_xlim(t_lims)
+        # E(t) = -dA/dt, the pulse itself is not evaluated here
+        axE.plot(t/fs_conv, -diff(t, np.real(A_field))/E_conv)
+        axE.set_xlabel(r'$t$ in fs')
+        axE.set_ylabel(r'$E$-field in MV/cm')
+        axA.set_xlim(t_lims)
+        axA.plot(t/fs_conv,A_field/E_conv/fs_conv)
+        axA.set_xlabel(r'$t$ in fs')
+        axA.set_ylabel(r'$A$-field in MV/cm$\cdot$fs')
+        axP.set_xlim(t_lims)
+        axP.plot(t/fs_conv,P_E_dir)
+        axP.plot(t/fs_conv,P_ortho)
+        axP.set_xlabel(r'$t$ in fs')
+        axP.set_ylabel(r'$P$ in atomic units $\parallel \mathbf{E}_{in}$ (blue), $\bot \mathbf{E}_{in}$ (orange)')
+        axPdot.set_xlim(t_lims)
+        axPdot.plot(t/fs_conv,diff(t,P_E_dir))
+        axPdot.plot(t/fs_conv,diff(t,P_ortho))
+        axPdot.set_xlabel(r'$t$ in fs')
+        axPdot.set_ylabel(r'$\dot P$ in atomic units $\parallel \mathbf{E}_{in}$ (blue), $\bot \mathbf{E}_{in}$ (orange)')
+        axJ.set_xlim(t_lims)
+        axJ.plot(t/fs_conv,J_E_dir)
+        axJ.plot(t/fs_conv,J_ortho)
+        axJ.set_xlabel(r'$t$ in fs')
+        axJ.set_ylabel(r'$J$ in atomic units $\parallel \mathbf{E}_{in}$ (blue), $\bot \mathbf{E}_{in}$ (orange)')
+
+##########################
+
+        if do_B_field:
+           label_emission_E_dir = '$I_{\parallel E}(t) = q\sum_{nn\'}\int d\mathbf{k}\;\langle n\overline{\mathbf{k}}_n(t)|\hat{e}_E\cdot \partial h/\partial \mathbf{k}|n\'\overline{\mathbf{k}}_{n\'}(t) \\rangle\\varrho_{nn\'}(\mathbf{k};t)$'
+           label_emission_ortho = '$I_{\\bot E}(t) = q\sum_{nn\'}\int d\mathbf{k}\;\langle n\overline{\mathbf{k}}_n(t)|\hat{e}_{\\bot E}\cdot \partial h/\partial \mathbf{k}|n\'\overline{\mathbf{k}}_{n\'}(t) \\rangle\\varrho_{nn\'}(\mathbf{k};t)$'
+        else:
+           label_emission_E_dir = '$I_{\parallel E}(t) = q\sum_{nn\'}\int d\mathbf{k}\;\langle u_{n\mathbf{k}}|\hat{e}_E\cdot \partial h/\partial \mathbf{k}|u_{n\'\mathbf{k}} \\rangle\\rho_{nn\'}(\mathbf{k},t)$'
+           label_emission_ortho = '$I_{\\bot E}(t) = q\sum_{nn\'}\int d\mathbf{k}\;\langle u_{n\mathbf{k}}|\hat{e}_{\\bot E}\cdot \partial h/\partial \mathbf{k}|u_{n\'\mathbf{k}} \\rangle\\rho_{nn\'}(\mathbf{k},t)$'
+
+        if KK_emission:
+           five_fig, ((ax_I_E_dir,ax_I_ortho,ax_I_total)) = pl.subplots(3,1,figsize=(10,10))
+           ax_I_E_dir.grid(True,axis='x')
+           ax_I_E_dir.set_xlim(freq_lims)
+           ax_I_E_dir.set_ylim(log_limits)
+           ax_I_E_dir.semilogy(freq/w,Int_exact_E_dir / Int_tot_base_freq, label=label_emission_E_dir)
+           ax_I_E_dir.semilogy(freq/w, Int_exact_diag_E_dir / Int_tot_base_freq,
+               label='$I_{\mathrm{intra}\parallel E}(t) = q\sum_{n= n\'}\int d\mathbf{k}\;\langle u_{n\mathbf{k}}|\hat{e}_E\cdot \partial h/\partial \mathbf{k}|u_{n\'\mathbf{k}} \\rangle\\rho_{nn\'}(\mathbf{k},t)$')
+           ax_I_E_dir.semilogy(freq/w, Int_exact_offd_E_dir / Int_tot_base_freq, linestyle='dashed',
+               label='$I_{\mathrm{inter}\parallel E}(t) = q\sum_{n\\neq n\'}\int d\mathbf{k}\;\langle u_{n\mathbf{k}}|\hat{e}_E\cdot \partial h/\partial \mathbf{k}|u_{n\'\mathbf{k}} \\rangle\\rho_{nn\'}(\mathbf{k},t)$')
+
+           if not do_B_field:
+              ax_I_E_dir.semilogy(freq/w, Int_E_dir / Int_tot_base_freq, 
+                 label='$I_{\mathrm{i+i} \parallel E}(t) = I_{\mathrm{intra} \parallel E}(t) + I_{\mathrm{inter} \parallel E}(t)$')
+              ax_I_E_dir.semilogy(freq/w, prefac_emission*np.abs(freq**2*Jw_E_dir**2) / Int_tot_base_freq,  linestyle='dashed',
+                 label='$I_{\mathrm{intra} \parallel E}(t) = q\sum_{n}\int d\mathbf{k}\; \hat{e}_E\cdot\partial \\epsilon_n/\partial\mathbf{k}\;\\rho_{nn(\mathbf{k},t)}$')
+              ax_I_E_dir.semilogy(freq/w, prefac_emission*np.abs(freq**2*Pw_E_dir**2) / Int_tot_base_freq, linestyle='dashed', 
+                 label='$I_{\mathrm{inter} \parallel E}(t) = \sum_{n\\neq n\'}\int d\mathbf{k}\;\hat{e}_E\cdot \mathbf{d}_{nn\'}(\mathbf{k})\dot\\rho_{n\'n(\mathbf{k},t)}$')
+           ax_I_E_dir.set_xlabel(r'Frequency $\omega/\omega_0$')
+           ax_I_E_dir.set_ylabel(r'Emission $I_{\parallel E}(\omega)$ in E-field direction')
+           ax_I_E_dir.legend(loc='upper right')
+           ax_I_ortho.grid(True,axis='x')
+           ax_I_ortho.set_xlim(freq_lims)
+           ax_I_ortho.set_ylim(log_limits)
+           ax_I_ortho.semilogy(freq/w,Int_exact_ortho / Int_tot_base_freq, label=label_emission_ortho)
+           ax_I_ortho.semilogy(freq/w, Int_exact_diag_ortho / Int_tot_base_freq,
+               label='$I_{\mathrm{intra}\\bot E}(t) = q\sum_{n= n\'}\int d\mathbf{k}\;\langle u_{n\mathbf{k}}|\hat{e}_{\\bot E}\cdot \partial h/\partial \mathbf{k}|u_{n\'\mathbf{k}} \\rangle\\rho_{nn\'}(\mathbf{k},t)$')
+           ax_I_ortho.semilogy(freq/w, Int_exact_offd_ortho / Int_tot_base_freq, linestyle='dashed',
+               label='$I_{\mathrm{inter}\\bot E}(t) = q\sum_{n\\neq n\'}\int d\mathbf{k}\;\langle u_{n\mathbf{k}}|\hat{e}_{\\bot E}\cdot \partial h/\partial \mathbf{k}|u_{n\'\mathbf{k}} \\rangle\\rho_{nn\'}(\mathbf{k},t)$')
+           if not do_B_field:
+              ax_I_ortho.semilogy(freq/w,Int_ortho / Int_tot_base_freq, 
+                 label='$I_{\mathrm{i+i} \\bot E}(t) = I_{\mathrm{intra} \\bot E}(t) + I_{\mathrm{inter} \\bot E}(t)$')
+              ax_I_ortho.semilogy(freq/w, prefac_emission*np.abs(freq**2*Jw_ortho**2) / Int_tot_base_freq,  linestyle='dashed',
+                 label='$I_{\mathrm{intra} \\bot E}(t) = q\sum_{n}\int d\mathbf{k}\; \hat{e}_{\\bot E}\cdot\partial \\epsilon_n/\partial\mathbf{k}\;\\rho_{nn(\mathbf{k},t)}$')
+              ax_I_ortho.semilogy(freq/w, prefac_emission*np.abs(freq**2*Pw_ortho**2) / Int_tot_base_freq, linestyle='dashed',
+                 label='$I_{\mathrm{inter} \\bot E}(t) = \sum_{n\\neq n\'}\int d\mathbf{k}\;\hat{e}_{\\bot E}\cdot \mathbf{d}_{nn\'}(\mathbf{k})\dot\\rho_{n\'n(\mathbf{k},t)}$')
+           ax_I_ortho.set_xlabel(r'Frequency $\omega/\omega_0$')
+           ax_I_ortho.set_ylabel(r'Emission $I_{\bot E}(\omega)$ $\bot$ to E-field direction')
+           ax_I_ortho.legend(loc='upper right')
+           ax_I_total.grid(True,axis='x')
+           ax_I_total.set_xlim(freq_lims)
+           ax_I_total.set_ylim(log_limits)
+           ax_I_total.semilogy(freq/w,(Int_exact_E_dir + Int_exact_ortho) / Int_tot_base_freq, 
+              label='$I(\omega) = I_{\parallel E}(\omega) + I_{\\bot E}(\omega)$')
+           if not do_B_field:
+              ax_I_total.semilogy(freq/w,(Int_E_dir+Int_ortho) / Int_tot_base_freq, 
+                 label='$I_{\mathrm{i+i}}(t) = I_{\mathrm{i+i} \parallel E}(t) + I_{\mathrm{i+i} \\bot E}(t)$')
+           ax_I_total.set_xlabel(r'Frequency $\omega/\omega_0$')
+           ax_I_total.set_ylabel(r'Total emission $I(\omega)$')
+           ax_I_total.legend(loc='upper right')
+   
+           pl.savefig(os.path.join(output_dir, "emission_KKR.pdf"), dpi=300)
+
+
+        B_fig_all_in_one, ((B_1)) = pl.subplots(1,1,figsize=(10,4))
+        B_1.semilogy(freq/w,Int_exact_E_dir / Int_tot_base_freq, label=label_emission_E_dir)
+        B_1.semilogy(freq/w,Int_exact_ortho / Int_tot_base_freq, label=label_emission_ortho)
+        B_1.semilogy(freq/w,(Int_exact_E_dir + Int_exact_ortho) / Int_tot_base_freq, 
+            label='$I(\omega) = I_{\parallel E}(\omega) + I_{\\bot E}(\omega)$')
+        B_1.set_xlabel(r'Frequency $\omega/\omega_0$')
+        B_1.set_ylabel(r'Relative emission intensity $I(\omega)$')
+        B_1.legend(loc='upper right')
+        B_1.grid(True,axis='x')
+        B_1.set_xlim(freq_lims)
+        B_1.set_ylim(log_limits)
+
+        pl.savefig(os.path.join(output_dir, "emission_exact.pdf"), dpi=300)
+
+        if do_emission_wavep:
+
+           six_fig, ((sc_I_E_dir,sc_I_ortho,sc_I_total)) = pl.subplots(3,1,figsize=(10,10))
+           sc_I_E_dir.grid(True,axis='x')
+           sc_I_E_dir.set_xlim(freq_lims)
+           sc_I_E_dir.set_ylim(log_limits)
+           sc_I_E_dir.semilogy(freq/w,np.abs(freq**2*Iw_exact_E_dir**2) / Int_tot_base_freq, 
+            label='$I_{\parallel E}^\mathrm{full}(t) = q\sum_{nn\'}\int d\mathbf{k}\;\langle u_{n\mathbf{k}}|\hat{e}_E\cdot \partial h/\partial \mathbf{k}|_{\mathbf{k}-\mathbf{A}(t)}|u_{n\'\mathbf{k}} \\rangle\\rho_{nn\'}(\mathbf{k},t)$')
+           sc_I_E_dir.semilogy(freq/w, np.abs(freq**2*Iw_wavep_check_E_dir**2) / Int_tot_base_freq, linestyle='dotted', 
+             label='$I_{\parallel E}^\mathrm{wavep}(t) = q\sum_{nn\'}\int d\mathbf{k}\;\langle u_{n\mathbf{k}}|\hat{e}_E\cdot \partial h/\partial \mathbf{k}|_{\mathbf{k}-\mathbf{A}(t)}|u_{n\'\mathbf{k}} \\rangle\\tilde{\\rho}_{nn\'}(\mathbf{k},t)$ with $\\tilde{\\rho}_{nn\'}(\mathbf{k}(t),t)$ from wf.~dyn.')
+           sc_I_E_dir.semilogy(freq/w, np.abs(freq**2*Iw_wavep_E_dir**2) / Int_tot_base_freq, linestyle='dotted',
+              label='$I_{\parallel E}^\mathrm{wavep check}(t) = q\sum_{nn\'}\int d\mathbf{k}\;\langle n\mathbf{k}(t),t|\hat{e}_E\cdot \partial h/\partial \mathbf{k}|_{\mathbf{k}-\mathbf{A}(t)}|n\mathbf{k}(t),t \\rangle f_{n}(\mathbf{k}(t)) $')
+           sc_I_E_dir.set_xlabel(r'Frequency $\omega/\omega_0$')
+           sc_I_E_dir.set_ylabel(r'Emission $I_{\parallel E}(\omega)$ in E-field direction')
+           sc_I_E_dir.legend(loc='lower right')
+   
+           sc_I_ortho.grid(True,axis='x')
+           sc_I_ortho.set_xlim(freq_lims)
+           sc_I_ortho.set_ylim(log_limits)
+           sc_I_ortho.semilogy(freq/w,np.abs(freq**2*Iw_exact_ortho**2) / Int_tot_base_freq, 
+            label='$I_{\\bot E}^\mathrm{full}(t) = q\sum_{nn\'}\int d\mathbf{k}\;\langle u_{n\mathbf{k}}|\hat{e}_{\\bot E}\cdot \partial h/\partial \mathbf{k}|_{\mathbf{k}-\mathbf{A}(t)}|u_{n\'\mathbf{k}} \\rangle\\rho_{nn\'(\mathbf{k},t)}$')
+           sc_I_ortho.semilogy(freq/w, np.abs(freq**2*Iw_wavep_check_ortho**2) / Int_tot_base_freq, linestyle='dotted',
+              label='$I_{\\bot E}^\mathrm{wavep}(t)$')
+           sc_I_ortho.semilogy(freq/w, np.abs(freq**2*Iw_wavep_ortho**2) / Int_tot_base_freq, linestyle='dotted',
+              label='$I_{\\bot E}^\mathrm{wavep check}(t)$')
+           sc_I_ortho.set_xlabel(r'Frequency $\omega/\omega_0$')
+           sc_I_ortho.set_ylabel(r'Emission $I_{\parallel E}(\omega)$ in E-field direction')
+           sc_I_ortho.legend(loc='lower right')
+   
+           sc_I_total.grid(True,axis='x')
+           sc_I_total.set_xlim(freq_lims)
+           sc_I_total.set_ylim(log_limits)
+           sc_I_total.semilogy(freq/w,np.abs(freq**2*(Iw_exact_E_dir**2 + Iw_exact_ortho**2)) / Int_tot_base_freq, 
+            label='$I^\mathrm{full}(\omega) = I_{\parallel E}^\mathrm{full}(\omega) + I_{\\bot E}^\mathrm{full}(\omega)$')
+           sc_I_total.semilogy(freq/w,np.abs(freq**2*(Iw_wavep_check_E_dir**2 + Iw_wavep_check_ortho**2)) / Int_tot_base_freq, linestyle='dotted',
+            label='$I^\mathrm{wavep}(\omega) = I^\mathrm{wavep}_{\parallel E}(\omega) + I^\mathrm{wavep}_{\\bot E}(\omega)$')
+           sc_I_total.semilogy(freq/w,np.abs(freq**2*(Iw_wavep_E_dir**2 + Iw_wavep_ortho**2)) / Int_tot_base_freq, linestyle='dotted',
+            label='$I^\mathrm{wavep check}(\omega) = I^\mathrm{wavep check}_{\parallel E}(\omega) + I^\mathrm{wavep}_{\\bot E}(\omega)$')
+           sc_I_total.set_xlabel(r'Frequency $\omega/\omega_0$')
+           sc_I_total.set_ylabel(r'Total emission $I(\omega)$')
+           sc_I_total.legend(loc='lower right')
+
+######################äää
+
+#        kp_array = length_path_in_BZ*np.linspace(-0.5 + (1/(2*Nk_in_path)), 0.5 - (1/(2*Nk_in_path)), num = Nk_in_path)
+#        # Countour plots of occupations and gradients of occupations
+#        fig5 = pl.figure()
+#        X, Y = np.meshgrid(t/fs_conv,kp_array)
+#        pl.contourf(X, Y, np.real(solution[:,0,:,3]), 100)
+#        pl.colorbar().set_label(r'$f_e(k)$ in path 0')
+#        pl.xlim([-5*alpha/fs_conv,10*alpha/fs_conv])
+#        pl.xlabel(r'$t\;(fs)$')
+#        pl.ylabel(r'$k$')
+#        pl.tight_layout()
+
+
+
+    if (not test and user_out):
+       # High-harmonic emission polar plots
+       polar_fig = pl.figure(figsize=(10, 10))
+
+    i_loop = 1
+    i_max = 30
+    polar_harmonics = []
+    harmonic_indices = spectra.harmonic_indices(freq/w, np.arange(1, i_max+1))
+    while i_loop <= i_max:
+        freq_index   = harmonic_indices[i_loop-1]
+
+        if (not test and user_out):
+           pax          = polar_fig.add_subplot(1,i_max,i_loop,projection='polar')
+           pax.plot(angles,np.abs(Iw_r[:,freq_index]))
+           rmax = pax.get_rmax()
+           pax.set_rmax(1.1*rmax)
+           pax.set_yticklabels([""])
+           if i_loop == 1:
+               pax.set_rgrids([0.25*rmax,0.5*rmax,0.75*rmax,1.0*rmax],labels=None, angle=None, fmt=None)
+               pax.set_title('HH'+str(i_loop), va='top', pad=30)
+               pax.set_xticks(np.arange(0,2.0*np.pi,np.pi/6.0))
+           else:
+               pax.set_rgrids([0.0],labels=None, angle=None, fmt=None)
+               pax.set_xticks(np.arange(0,2.0*np.pi,np.pi/2.0))
+               pax.set_xticklabels([""])
+               pax.set_title('HH'+str(i_loop), va='top', pad=15)
+
+        if writer is not None:
+           polar_harmonics.append(np.abs(Iw_r[:,freq_index])/np.amax(np.abs(Iw_r[:,freq_index])))
+
+        elif print_J_P_I_files:
+
+           if i_loop < 10:
+              polar_filename = 'polar_0'+str(i_loop)
+           else:
+              polar_filename = 'polar_'+str(i_loop)
+           np.savetxt (os.path.join(output_dir, polar_filename), np.c_[ angles/np.pi*180, np.abs(Iw_r[:,freq_index])/np.amax(np.abs(Iw_r[:,freq_index])) ]  )
+
+        i_loop += 1
+
+    if print_J_P_I_files:
+
+       Int_exact_total = Int_exact_E_dir + Int_exact_ortho
+
+       local_maxima = spectra.local_maxima(Int_exact_total)
+
+       polar_maxima_freq = []
+       polar_maxima = []
+       for local_maximum in local_maxima:
+
+           if freq[local_maximum]/w < 0:
+              continue
+
+           if writer is not None:
+              polar_maxima_freq.append(freq[local_maximum]/w)
+              polar_maxima.append(np.abs(Iw_r[:,local_maximum])/np.amax(np.abs(Iw_r[:,local_maximum])))
+              continue
+
+           if freq[local_maximum]/w < 10:
+              polar_filename = 'polar_0'+str('{:1.2f}').format(freq[local_maximum]/w)
+           else:
+              polar_filename = 'polar_'+str('{:2.2f}').format(freq[local_maximum]/w)
+
+           np.savetxt (os.path.join(output_dir, polar_filename), np.c_[ angles/np.pi*180, np.abs(Iw_r[:,local_maximum])/np.amax(np.abs(Iw_r[:,local_maximum])) ]  )
+
+    if writer is not None:
+       # Normalized polar emission at the harmonics 1..i_max and at the local maxima of the spectrum
+       writer.add('polar_angles', angles/np.pi*180)
+       writer.add('polar_harmonics', polar_harmonics)
+       writer.add('polar_maxima_freq', polar_maxima_freq)
+       writer.add('polar_maxima', np.reshape(polar_maxima, (-1, np.size(angles))))
+       with profiling.phase('analysis/output files'):
+           writer.close()
+
+
+    if (not test and user_out):
+
+        # Plot Brilluoin zone with paths
+        if kpnts is not None:
+            BZ_plot(kpnts,a,b1,b2,E_dir,paths)
+
+        pl.show()
+
+    # OUTPUT STANDARD TEST VALUES
+    ##############################################################################################
+    if test:
+        t_zero = np.argwhere(t == 0)
+        f5 = np.argwhere(np.logical_and(freq/w > 4.9, freq/w < 5.1))
+        f125 = np.argwhere(np.logical_and(freq/w > 12.4, freq/w < 12.6))
+        f15= np.argwhere(np.logical_and(freq/w > 14.9, freq/w < 15.1))
+        f_5 = f5[int(np.size(f5)/2)]
+        f_125 = f125[int(np.size(f125)/2)]
+        f_15 = f15[int(np.size(f15)/2)]
+        test_out = np.zeros(6, dtype=[('names','U16'),('values',float)])
+        test_out['names'] = np.array(['P(t=0)','J(t=0)','N_gamma(t=tf)','Emis(w/w0=5)','Emis(w/w0=12.5)','Emis(w/w0=15)'])
+        test_out['values'] = np.array([pol[t_zero],curr[t_zero],N_gamma[Nt-1],emis[f_5],emis[f_125],emis[f_15]])
+        np.savetxt(os.path.join(output_dir, 'test.dat'),test_out, fmt='%16s %.16e')
+
+    return {'t': t/fs_conv, 'A_field': A_field, 
+            'P_E_dir': P_E_dir, 'P_ortho': P_ortho, 'J_E_dir': J_E_dir, 'J_ortho': J_ortho, 
+            'I_exact_E_dir': I_exact_E_dir, 'I_exact_ortho': I_exact_ortho, 
+            'I_exact_diag_E_dir': I_exact_diag_E_dir, 'I_exact_diag_ortho': I_exact_diag_ortho, 
+            'I_exact_offd_E_dir': I_exact_offd_E_dir, 'I_exact_offd_ortho': I_exact_offd_ortho, 
+            'freq': freq/w, 'Int_E_dir': Int_E_dir, 'Int_ortho': Int_ortho, 
+            'Int_exact_E_dir': Int_exact_E_dir, 'Int_exact_ortho': Int_exact_ortho}
+
+
+def diff(x, y):
+    '''
+    Takes the derivative of y w.r.t. x
+    '''
+    if (len(x) != len(y)):
+        raise ValueError('Vectors have different lengths')
+    elif len(y) == 1:
+        return 0
+    else:
+        dx = np.gradient(x)
+        dy = np.gradient(y)
+        return dy/dx
+
+
+def Gaussian_envelope(t, alpha):
+    '''
+    Function to multiply a Function f(t) before Fourier transform
+    to ensure no step in time between t_final and t_final + delta
+    '''
+    return np.exp(-t**2.0/(2.0*1.0*alpha)**2)
+
+
+
+def BZ_plot(kpnts,a,b1,b2,E_dir,paths):
+
+    R = 4.0*np.pi/(3*a)
+    r = 2.0*np.pi/(np.sqrt(3)*a)
+
+    BZ_fig = pl.figure(figsize=(10,10))
+    ax = BZ_fig.add_subplot(111,aspect='equal')
+
+    ax.add_patch(patches.RegularPolygon((0,0),6,radius=R,orientation=np.pi/6,fill=False))
+    ax.add_patch(patches.RegularPolygon(b1,6,radius=R,orientation=np.pi/6,fill=False))
+    ax.add_patch(patches.RegularPolygon(-b1,6,radius=R,orientation=np.pi/6,fill=False))
+    ax.add_patch(patches.RegularPolygon(b2,6,radius=R,orientation=np.pi/6,fill=False))
+    ax.add_patch(patches.RegularPolygon(-b2,6,radius=R,orientation=np.pi/6,fill=False))
+    ax.add_patch(patches.RegularPolygon(b1+b2,6,radius=R,orientation=np.pi/6,fill=False))
+    ax.add_patch(patches.RegularPolygon(-b1-b2,6,radius=R,orientation=np.pi/6,fill=False))
+
+    ax.arrow(-0.5*E_dir[0],-0.5*E_dir[1],E_dir[0],E_dir[1],width=0.005,alpha=0.5,label='E-field')
+
+    pl.scatter(0,0,s=15,c='black')
+    pl.text(0.01,0.01,r'$\Gamma$')
+    pl.scatter(r*np.cos(-np.pi/6),r*np.sin(-np.pi/6),s=15,c='black')
+    pl.text(r*np.cos(-np.pi/6)+0.01,r*np.sin(-np.pi/6)-0.05,r'$M$')
+    pl.scatter(R,0,s=15,c='black')
+    pl.text(R,0.02,r'$K$')
+    pl.scatter(kpnts[:,0],kpnts[:,1], s=15)
+    pl.xlim(-25.0/a,25.0/a)
+    pl.ylim(-5.0/a,5.0/a)
+    pl.xlabel(r'$k_x$ ($1/a_0$)')
+    pl.ylabel(r'$k_y$ ($1/a_0$)')
+
+    for path in paths:
+        path = np.array(path)
+        pl.plot(path[:,0],path[:,1])
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import argparse
+import platform
+import datetime
+import subprocess
+import numpy as np
+from types import SimpleNamespace
+
+import params
+import compile_cache
+import SBE
+import systems
+import spectra
+import analysis
+
+'''
+Micro-benchmarks of the solver hot paths.
+Each benchmark is called warmup times untimed (numba compilation, caches)
+and then timed repeat times. The median and the interquartile range of the
+timings are printed and written with the raw timings and the machine and
+library versions to a JSON file:
+
+    python3 benchmark.py --out benchmark.json [--only fnumba emission]
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the SBE solver')
+    parser.add_argument('--repeat', type=int, default=20, help='timed calls per benchmark')
+    parser.add_argument('--warmup', type=int, default=2, help='untimed calls before the timing')
+    parser.add_argument('--only', nargs='*', default=[], help='run the benchmarks whose names contain one of these')
+    parser.add_argument('--out', default='benchmark.json', help='JSON file of the results')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.repeat, args.warmup, args.only)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=1)
+
+
+def run_benchmarks(repeat=20, warmup=2, only=[]):
+    '''
+    Runs all benchmarks whose names contain one of the strings in only (all if empty)
+    and returns the results with the run metadata
+    '''
+    results = []
+    print('{:<60} {:>14} {:>14}'.format('Benchmark', 'Median (s)', 'IQR (s)'))
+    for name, bench_params, function, bench_repeat in benchmarks():
+        if only and not any(pattern in name for pattern in only):
+            continue
+        timing = measure(function(), min(repeat, bench_repeat), warmup)
+        results.append(dict(name=name, params=bench_params, **timing))
+        print('{:<60} {:>14.6e} {:>14.6e}'.format(name, timing['median'], timing['iqr']))
+
+    return {'metadata': metadata(), 'benchmarks': results}
+
+
+def measure(function, repeat, warmup):
+    '''
+    Median and interquartile range of the run time of function() in seconds
+    '''
+    for _ in range(warmup):
+        function()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    q1, median, q3 = np.percentile(samples, [25, 50, 75])
+    return {'median': median, 'iqr': q3 - q1, 'repeat': repeat, 'samples': samples}
+
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit,
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'machine': platform.node(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'libraries': {name: compile_cache.library_version(name)
+                          for name in ['numpy', 'scipy', 'numba', 'sympy', 'hfsbe']}}
+
+
+# SETUP
+#################################################################################################
+# Parameters in atomic units as in SBE.main, the benchmarks change single ones
+setup = SimpleNamespace(
+    E0=params.E0*params.E_conv, B0=0.0, w=params.w*params.THz_conv, chirp=params.chirp*params.THz_conv,
+    alpha=params.alpha*params.fs_conv, phase=params.phase,
+    gamma1=1/(params.T1*params.fs_conv), gamma2=1/(params.T2*params.fs_conv),
+    e_fermi=params.e_fermi*params.eV_conv, temperature=params.temperature*params.eV_conv,
+    dt=params.dt*params.fs_conv, E_dir=np.array([1.0, 0.0]), model=systems.model_values)
+
+
+def two_line_path(Nk_in_path):
+    '''
+    First path and dk of the 2line mesh with Nk_in_path k-points
+    '''
+    mesh_params = SimpleNamespace(Nk_in_path=Nk_in_path, rel_dist_to_Gamma=params.rel_dist_to_Gamma, a=params.a,
+                                  length_path_in_BZ=params.length_path_in_BZ, num_paths=params.num_paths)
+    dk, kpnts, paths = SBE.mesh(mesh_params, setup.E_dir)
+    return paths[0], dk
+
+
+def path_f_params(Nk_in_path, gauge, do_B_field, dynamics_type):
+    '''
+    Initial condition and fnumba arguments of a 2line path
+    '''
+    path, dk = two_line_path(Nk_in_path)
+    B0 = 1.0*params.B_conv if do_B_field else 0.0
+    y0, f_params, emission_tables, ec = SBE.path_setup(path, Nk_in_path, 0, 1, setup.dt, False, setup.E_dir,
+                                                       setup.e_fermi, setup.temperature, dk, setup.gamma1, setup.gamma2,
+                                                       setup.E0, B0, setup.w, setup.chirp, setup.alpha, setup.phase,
+                                                       do_B_field, gauge, False, dynamics_type, False, 1e-8, setup.model)
+    return np.array(y0, dtype=np.complex128), f_params
+
+
+def random_solution(Nk, Nt, do_B_field):
+    '''
+    Density matrix solution[i_k, 0, i_time, :] and A-field with realistic magnitudes
+    '''
+    rng = np.random.default_rng(0)
+    solution = (rng.random((Nk, 1, Nt, 8)) + 1j*rng.random((Nk, 1, Nt, 8)))*1e-2
+    if do_B_field:
+        solution[..., 4:8] = 1e-3*rng.standard_normal((Nk, 1, Nt, 4))
+    A_field = 1e-2*np.sin(np.linspace(0, 10, Nt)) + 0j
+    return solution, A_field
+
+
+# BENCHMARKS
+#################################################################################################
+# Each benchmark is (name, parameters, setup function returning the timed function, maximum repeat)
+
+def bench_fnumba(Nk_in_path, gauge, do_B_field, dynamics_type):
+    def make():
+        y0, f_params = path_f_params(Nk_in_path, gauge, do_B_field, dynamics_type)
+        return lambda: SBE.fnumba(0.0, y0, *f_params)
+    return make
+
+
+def bench_path_evolution(Nk_in_path, gauge, solver_method, n_steps):
+    def make():
+        path, dk = two_line_path(Nk_in_path)
+        t0 = -n_steps*setup.dt/2
+        tf = n_steps*setup.dt/2
+        return lambda: SBE.path_evolution(path, 1, Nk_in_path, t0, tf, setup.dt, False, setup.E_dir, setup.e_fermi,
+                                          setup.temperature, dk, setup.gamma1, setup.gamma2, setup.E0, 0.0, setup.w,
+                                          setup.chirp, setup.alpha, setup.phase, False, gauge, False, 1, False,
+                                          'density_matrix_dynamics', gauge == 'length', solver_method, 1e-6, 1e-12,
+                                          False, False, False, 1e-8, setup.model)
+    return make
+
+
+def bench_emission_exact(Nk_in_path, gauge, Nt):
+    def make():
+        path, dk = two_line_path(Nk_in_path)
+        solution, A_field = random_solution(Nk_in_path, Nt, False)
+        return lambda: SBE.emission_exact(path, solution, setup.E_dir, A_field, gauge, False, 1,
+                                          *[np.zeros(Nt) for _ in range(10)], gauge == 'length', setup.model)
+    return make
+
+
+def bench_emission_semicl_B_field(Nk_in_path, Nt):
+    def make():
+        path, dk = two_line_path(Nk_in_path)
+        solution, A_field = random_solution(Nk_in_path, Nt, True)
+        return lambda: SBE.emission_semicl_B_field(path, solution, setup.E_dir, np.zeros(Nt), np.zeros(Nt), 1,
+                                                   False, setup.model)
+    return make
+
+
+def bench_mesh(Nk_in_path):
+    return lambda: (lambda: two_line_path(Nk_in_path))
+
+
+def bench_hex_mesh(Nk1, Nk2, align):
+    return lambda: (lambda: SBE.hex_mesh(Nk1, Nk2, params.a, params.b1, params.b2, align))
+
+
+def bench_build_system():
+    return lambda: systems.build_system
+
+
+def bench_spectra(Nt, n_signals):
+    def make():
+        t = np.linspace(-1000, 1000, Nt)*params.fs_conv
+        signals = np.random.default_rng(0).random((n_signals, Nt))
+        window = analysis.Gaussian_envelope(t, setup.alpha)
+        angles = np.linspace(0, 2.0*np.pi, 361)
+        def function():
+            spectra_w = spectra.spectra(signals, window)
+            return spectra.angle_resolved(spectra_w[0], spectra_w[1], angles)
+        return function
+    return make
+
+
+def benchmarks():
+    cases = []
+    for gauge in ['length', 'velocity']:
+        for do_B_field in [False, True]:
+            for dynamics_type in ['density_matrix_dynamics', 'wavefunction_dynamics']:
+                if dynamics_type == 'wavefunction_dynamics' and (gauge == 'length' or do_B_field):
+                    continue
+                cases.append(('fnumba[{},B={},{}]'.format(gauge, int(do_B_field), dynamics_type),
+                              dict(Nk_in_path=400, gauge=gauge, do_B_field=do_B_field, dynamics_type=dynamics_type),
+                              bench_fnumba(400, gauge, do_B_field, dynamics_type), 1000))
+    for gauge in ['length', 'velocity']:
+        for solver_method in ['zvode', 'rk4']:
+            cases.append(('path_evolution[{},{}]'.format(gauge, solver_method),
+                          dict(Nk_in_path=100, gauge=gauge, solver_method=solver_method, n_steps=2000),
+                          bench_path_evolution(100, gauge, solver_method, 2000), 5))
+    for gauge in ['length', 'velocity']:
+        cases.append(('emission_exact[{}]'.format(gauge), dict(Nk_in_path=100, gauge=gauge, Nt=2000),
+                      bench_emission_exact(100, gauge, 2000), 20))
+    cases.append(('emission_semicl_B_field', dict(Nk_in_path=100, Nt=2000), bench_emission_semicl_B_field(100, 2000), 20))
+    cases.append(('mesh[2line]', dict(Nk_in_path=100000), bench_mesh(100000), 20))
+    for align in ['K', 'M']:
+        cases.append(('hex_mesh[{}]'.format(align), dict(Nk1=300, Nk2=300, align=align),
+                      bench_hex_mesh(300, 300, align), 5))
+    cases.append(('build_system', {}, bench_build_system(), 3))
+    cases.append(('spectra', dict(Nt=20000, n_signals=12), bench_spectra(20000, 12), 50))
+    return cases
+
+
+if __name__ == "__main__":
+    main()
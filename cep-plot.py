@@ -49,22 +49,14 @@ def cep_plot(x, y, z, xlims, zlabel):
     cbar.set_ticks(logticks)
     cbar.set_ticklabels(['$10^{{{}}}$'.format(int(round(tick-exp_of_ticks[-1]))) for tick in exp_of_ticks])
 
-# Load the files for all phases
-phases = np.linspace(phaselims[0],phaselims[1],N_phases+1,endpoint=True)
-I         = []
-I_Edir    = []
-I_ortho   = []
-Int_Edir  = []
-Int_ortho = []
-for i_phase, phase in enumerate(phases):
-    I_filename = str('I_Nk1-{}_Nk2-{}_w{:4.2f}_E{:4.2f}_a{:4.2f}_ph{:3.2f}_T2-{:05.2f}.npy').format(Nk1,Nk2,w,E0,alpha,phase,T2)
-    I = np.load(I_filename)
-    freq  = I[3]
-    I_Edir.append(I[4])
-    I_ortho.append(I[5])
-    Int_Edir.append(I[6])
-    Int_ortho.append(I[7])
-I_Edir,I_ortho,Int_Edir,Int_ortho = np.array(I_Edir),np.array(I_ortho),np.array(Int_Edir),np.array(Int_ortho)
+# Load the spectra of all phases written by cep-scan.py
+scan      = np.load('cep-scan.npz')
+phases    = scan['phase']
+freq      = scan['freq'][0]
+Int_Edir  = scan['Int_E_dir']
+Int_ortho = scan['Int_ortho']
+I_Edir    = np.abs(Int_Edir)
+I_ortho   = np.abs(Int_ortho)
 
 cep_plot(freq, phases, Int_Edir+Int_ortho, xlims, r'Relative intensity')
 #cep_plot(freq, phases, I_ortho, xlims, r'$I_{\bot}(\omega)$')
@@ -1,32 +1,12 @@
 import os
-import subprocess
-import fileinput
+import numpy as np
 
-N_phases = 5
-paramFile = 'params.py'
-
-for i in range(N_phases+1):
-
-    phase_div = '(' + str(i) + '/' + str(N_phases) + ')'
-    print(phase_div)
-    with fileinput.FileInput(paramFile, inplace=True) as file:
-        for line in file:
-            if 'phase               =' in line:
-                print('phase               = '+phase_div+'*np.pi')
-            else:
-                print(line, end='')
+from sweep import sweep
 
-    phase_div_prev = phase_div
-
-    subprocess.Popen(["python3","SBE.py"]).communicate()
-
-with fileinput.FileInput(paramFile, inplace=True) as file:
-    for line in file:
-         if 'phase               =' in line:
-             print('phase               = 0            # Carrier envelope phase (edited by cep-scan.py)')
-         else:
-             print(line, end='')
+N_phases = 5
 
+# All phases in one process tree, the results are collected in cep-scan.npz
+sweep({'phase': np.linspace(0, np.pi, N_phases+1)}, n_proc=N_phases+1, filename='cep-scan.npz')
 
 # Call plotting script
 call = 'python3 cep-plot.py ' + str(N_phases)
@@ -0,0 +1,104 @@
+import os
+import sys
+import hashlib
+import pickle
+import numba
+from numba import cloudpickle
+try:
+    from importlib import metadata
+except ImportError:
+    # Python < 3.8
+    import pkg_resources
+    metadata = None
+
+import params
+
+'''
+Persistent on-disk cache for the symbolic system of systems.py and for the
+numba kernels of SBE.py and efield.py.
+The symbolic system (eigensystem, dipoles, curvature and their lambdified
+functions) is pickled into a file keyed on the source of systems.py, the
+model parameters and the library versions. The numba kernels are cached with
+numba's own cache in a directory that is additionally keyed on the fitted
+pulse, since numba freezes the global variables of efield.py into the
+compiled code and would otherwise load kernels compiled for another pulse.
+'''
+
+enabled   = params.compile_cache
+cache_dir = os.path.expanduser(params.compile_cache_dir)
+
+
+def library_version(name):
+    if metadata is None:
+        try:
+            return pkg_resources.get_distribution(name).version
+        except pkg_resources.DistributionNotFound:
+            return 'unknown'
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def file_hash(filename):
+    if not os.path.isfile(filename):
+        return ''
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def key_hash(key):
+    return hashlib.sha256(repr(key).encode()).hexdigest()[:16]
+
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# Measured pulse of the fitted driving field (params.fitted_pulse), next to this file
+pulse_file = os.path.join(here, 'Transient_25THz.txt')
+
+# Everything the symbolic system depends on, a parametric system does not depend on the model parameters
+if params.parametric_system:
+    model_key = 'parametric'
+else:
+    model_key = (params.C0, params.C2, params.A, params.R, params.k_cut)
+system_key = (file_hash(os.path.join(here, 'systems.py')), model_key,
+              sys.version_info[:2], [library_version(name) for name in ['hfsbe', 'sympy', 'numpy', 'numba']])
+
+# The compiled kernels additionally depend on the fitted pulse frozen into driving_field
+kernel_key = (system_key, params.fitted_pulse, file_hash(pulse_file) if params.fitted_pulse else '')
+
+if enabled:
+    # numba only reads its cache directory when a cached function is compiled first,
+    # this module is therefore imported before any kernel is defined
+    numba.config.CACHE_DIR = os.path.join(cache_dir, 'numba-' + key_hash(kernel_key))
+
+
+def load_or_build(name, build):
+    '''
+    Returns the cached result of build() for the current system_key,
+    calls build() and stores its result if there is none
+    '''
+    if not enabled:
+        return build()
+
+    filename = os.path.join(cache_dir, name + '-' + key_hash(system_key) + '.pkl')
+    if os.path.isfile(filename):
+        try:
+            with open(filename, 'rb') as f:
+                return pickle.load(f)
+        except Exception as error:
+            print("Cache file " + filename + " could not be loaded (" + str(error) + "), rebuilding it.")
+
+    result = build()
+
+    # Write to a temporary file first, parallel runs never see a partial cache file
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        filename_tmp = filename + '.' + str(os.getpid())
+        with open(filename_tmp, 'wb') as f:
+            cloudpickle.dump(result, f)
+        os.replace(filename_tmp, filename)
+    except Exception as error:
+        print("Symbolic system could not be cached (" + str(error) + ").")
+
+    return result
@@ -0,0 +1,127 @@
+import argparse
+import numpy as np
+
+import SBE
+import spectra
+from analysis import Gaussian_envelope
+from sweep import point_params
+
+'''
+Automatic convergence of the emission spectrum in the k-mesh.
+The mesh sizes of params.BZ_type (Nk_in_path, Nk1 and Nk2 or Nk1_vel and
+Nk2_vel) are tripled in each refinement step. The k-points of the meshes
+are cell centers, (j + 1/2)/Nk, so every finer mesh contains the previous one
+(except along b1 of the 'K'-aligned full mesh). In velocity gauge the k-points
+are not coupled: only the new k-points are solved and their signals are added
+to those of the previous mesh. In length gauge dk changes with the mesh and
+every mesh is solved completely.
+The refinement stops when the spectrum in the frequency window (in units of
+the driving frequency) changes by less than the tolerance.
+
+    python3 convergence.py --tolerance 0.01 --window 1 20
+'''
+
+# Mesh sizes refined for each BZ type
+mesh_sizes = {'2line': ['Nk_in_path'], 'full': ['Nk1', 'Nk2'], 'full_for_velocity': ['Nk1_vel', 'Nk2_vel']}
+
+# Time signals summed over the k-points
+kpoint_signals = ['P_E_dir', 'P_ortho', 'J_E_dir', 'J_ortho', 'I_exact_E_dir', 'I_exact_ortho',
+                  'I_exact_diag_E_dir', 'I_exact_diag_ortho', 'I_exact_offd_E_dir', 'I_exact_offd_ortho']
+
+# Run each mesh quietly, only the returned signals are used
+run_defaults = {'print_J_P_I_files': False, 'energy_plots': False, 'dipole_plots': False, 'profile': False}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convergence of the emission spectrum in the k-mesh')
+    parser.add_argument('--tolerance', type=float, default=1e-2, help='relative change of the spectrum at convergence')
+    parser.add_argument('--window', type=float, nargs=2, default=[1, 20], help='harmonic orders of the compared spectrum')
+    parser.add_argument('--max-refinements', type=int, default=4, help='maximum number of refinement steps')
+    parser.add_argument('--out', default='convergence.npz', help='file of the spectra of all meshes')
+    args = parser.parse_args()
+
+    converge_mesh(args.tolerance, args.window, args.max_refinements, args.out)
+
+
+def converge_mesh(tolerance=1e-2, window=(1, 20), max_refinements=4, filename='convergence.npz', fixed={}):
+    '''
+    Refines the mesh of params (with the parameters in fixed changed) until
+    the spectrum changes by less than tolerance. Writes the mesh sizes,
+    spectra and changes of all steps to filename and returns the parameters
+    and time signals (as returned by SBE.main) of the last mesh.
+    '''
+    base = point_params({}, dict(run_defaults, **fixed))
+    size_names = mesh_sizes[base.BZ_type]
+    reuse = base.gauge == 'velocity'
+
+    sizes, intensities, changes = [], [], []
+    result, kpnts = None, None
+    for refinement in range(max_refinements + 1):
+        mesh_params = point_params({name: getattr(base, name)*3**refinement for name in size_names},
+                                   dict(run_defaults, **fixed))
+        E_dir, dk, mesh_kpnts, mesh_paths = SBE.bz_mesh(mesh_params)
+
+        new_paths = None
+        if reuse and kpnts is not None:
+            new_paths = new_kpoints(kpnts, mesh_kpnts, np.shape(mesh_paths)[1]//3)
+        if new_paths is None:
+            result = SBE.main(mesh_params)
+        else:
+            new_result = SBE.main(mesh_params, new_paths)
+            for name in kpoint_signals:
+                new_result[name] = new_result[name] + result[name]
+            result = new_result
+        # The spectra of the result only cover the new k-points, the time signals are kept
+        result = {name: result[name] for name in ['t', 'A_field'] + kpoint_signals}
+        kpnts = mesh_kpnts
+
+        freq, intensity = spectrum(mesh_params, result, np.size(kpnts[:, 0]))
+        in_window = (freq >= window[0]) & (freq <= window[1])
+        sizes.append([getattr(mesh_params, name) for name in size_names])
+        intensities.append(intensity)
+        if refinement > 0:
+            changes.append(np.linalg.norm(intensity[in_window] - intensities[-2][in_window])
+                           /np.linalg.norm(intensity[in_window]))
+            print('{} = {}: relative change of the spectrum {:.3e}'.format(size_names, sizes[-1], changes[-1]))
+            if changes[-1] < tolerance:
+                break
+        else:
+            print('{} = {}'.format(size_names, sizes[-1]))
+
+    converged = len(changes) > 0 and changes[-1] < tolerance
+    if not converged:
+        print('Spectrum not converged to {} after {} refinements'.format(tolerance, max_refinements))
+
+    np.savez(filename, size_names=size_names, sizes=np.array(sizes), freq=freq, intensity=np.array(intensities),
+             change=np.array(changes), converged=converged)
+    return mesh_params, result
+
+
+def new_kpoints(kpnts, mesh_kpnts, Nk_path):
+    '''
+    k-points of mesh_kpnts that are not in kpnts, as paths of Nk_path k-points.
+    None if the mesh does not contain all of kpnts, its signals cannot be reused then.
+    '''
+    # k-points of both meshes agree to rounding errors
+    scale = np.amax(np.abs(mesh_kpnts))
+    old_keys = set(map(tuple, np.round(kpnts/scale, 9)))
+    is_new = np.array([key not in old_keys for key in map(tuple, np.round(mesh_kpnts/scale, 9))])
+    if np.count_nonzero(~is_new) != np.size(kpnts[:, 0]) or np.count_nonzero(is_new) % Nk_path != 0:
+        return None
+    return mesh_kpnts[is_new].reshape(-1, Nk_path, 2)
+
+
+def spectrum(mesh_params, result, Nk):
+    '''
+    Frequencies (in units of w) and emission intensity per k-point of the result of SBE.main
+    '''
+    t = result['t']*mesh_params.fs_conv
+    window = Gaussian_envelope(t, mesh_params.alpha*mesh_params.fs_conv)
+    Iw_E_dir, Iw_ortho = spectra.spectra([result['I_exact_E_dir']/Nk, result['I_exact_ortho']/Nk], window)
+    freq = np.fft.fftshift(np.fft.fftfreq(np.size(t), d=t[1] - t[0]))
+    intensity = np.abs(freq**2*Iw_E_dir**2) + np.abs(freq**2*Iw_ortho**2)
+    return freq/(mesh_params.w*mesh_params.THz_conv), intensity
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,10 @@ from numba import njit
 import numpy as np
 import params 
 import nir
+import compile_cache
 
 # Driving field parameters
-
-w     = params.w*params.THz_conv                         # Driving pulse frequency
-chirp = params.chirp*params.THz_conv                     # Pulse chirp frequency
-alpha = params.alpha*params.fs_conv                      # Gaussian pulse width
-phase = params.phase                              # Carrier-envelope phase
+# (frequency, chirp, width and phase of the Gaussian pulse are arguments of driving_field)
 
 fitted_pulse   = params.fitted_pulse
 
@@ -22,8 +19,8 @@ if fitted_pulse:
     print("Chirp [THz]              =", parameters[4]/params.THz_conv )
     print("Phase                    =", parameters[5] )
 
-@njit
-def driving_field(Amplitude, t):
+@njit(cache=compile_cache.enabled)
+def driving_field(Amplitude, w, t, chirp, alpha, phase):
     '''
     Returns the instantaneous driving pulse field
     '''
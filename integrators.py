@@ -0,0 +1,201 @@
+import numpy as np
+from numba import njit
+
+'''
+Compiled time integrators for the right-hand side fnumba of SBE.py.
+The whole loop from t0 to tf runs inside numba, there are no callbacks
+into the interpreter as with scipy's zvode.
+Both integrators take the right-hand side fun(t, y, *args) and return
+the times and solutions of all steps ti with save[ti] == True, i.e. the
+same output grid as the zvode loop in SBE.path_evolution. dopri5
+additionally returns its proposed next step size and its number of
+right-hand side evaluations.
+dopri5_dense is not bound to the time step dt: it takes the steps its error
+control allows and interpolates the solution at the output times.
+'''
+
+@njit
+def rk4(fun, y0, t0, dt, save, args):
+    '''
+    Classical fourth order Runge-Kutta method with fixed time step dt
+    '''
+    Nt = save.size
+    n_out = np.sum(save)
+    t_out = np.empty(n_out)
+    y_out = np.empty((n_out, y0.size), dtype=np.complex128)
+
+    y = y0.astype(np.complex128)
+    i_out = 0
+    for ti in range(Nt):
+        t = t0 + ti*dt
+        k1 = fun(t, y, *args)
+        k2 = fun(t + 0.5*dt, y + 0.5*dt*k1, *args)
+        k3 = fun(t + 0.5*dt, y + 0.5*dt*k2, *args)
+        k4 = fun(t + dt, y + dt*k3, *args)
+        y = y + dt/6*(k1 + 2*k2 + 2*k3 + k4)
+
+        if save[ti]:
+            t_out[i_out] = t + dt
+            y_out[i_out] = y
+            i_out += 1
+
+    return t_out, y_out
+
+
+@njit
+def dopri5(fun, y0, t0, dt, save, args, rtol, atol, h0):
+    '''
+    Dormand-Prince 5(4) method with adaptive step size control, starting
+    with h0. Every interval dt is covered by as many accepted steps as needed
+    to satisfy rtol and atol, the step size is carried over between intervals.
+    '''
+    # Butcher tableau
+    c2, c3, c4, c5 = 1/5, 3/10, 4/5, 8/9
+    a21 = 1/5
+    a31, a32 = 3/40, 9/40
+    a41, a42, a43 = 44/45, -56/15, 32/9
+    a51, a52, a53, a54 = 19372/6561, -25360/2187, 64448/6561, -212/729
+    a61, a62, a63, a64, a65 = 9017/3168, -355/33, 46732/5247, 49/176, -5103/18656
+    b1, b3, b4, b5, b6 = 35/384, 500/1113, 125/192, -2187/6784, 11/84
+    # Difference between fifth and fourth order weights
+    e1, e3, e4, e5, e6, e7 = 71/57600, -71/16695, 71/1920, -17253/339200, 22/525, -1/40
+
+    Nt = save.size
+    n_out = np.sum(save)
+    t_out = np.empty(n_out)
+    y_out = np.empty((n_out, y0.size), dtype=np.complex128)
+
+    y = y0.astype(np.complex128)
+    t = t0
+    h = h0
+    k1 = fun(t, y, *args)
+    n_fun = 1
+    i_out = 0
+    for ti in range(Nt):
+        t_end = t0 + (ti+1)*dt
+        while t < t_end:
+            last = False
+            if t + h >= t_end:
+                h_step = t_end - t
+                last = True
+            else:
+                h_step = h
+
+            k2 = fun(t + c2*h_step, y + h_step*a21*k1, *args)
+            k3 = fun(t + c3*h_step, y + h_step*(a31*k1 + a32*k2), *args)
+            k4 = fun(t + c4*h_step, y + h_step*(a41*k1 + a42*k2 + a43*k3), *args)
+            k5 = fun(t + c5*h_step, y + h_step*(a51*k1 + a52*k2 + a53*k3 + a54*k4), *args)
+            k6 = fun(t + h_step, y + h_step*(a61*k1 + a62*k2 + a63*k3 + a64*k4 + a65*k5), *args)
+            y_new = y + h_step*(b1*k1 + b3*k3 + b4*k4 + b5*k5 + b6*k6)
+            k7 = fun(t + h_step, y_new, *args)
+            n_fun += 6
+
+            err_vec = h_step*(e1*k1 + e3*k3 + e4*k4 + e5*k5 + e6*k6 + e7*k7)
+            scale = atol + rtol*np.maximum(np.abs(y), np.abs(y_new))
+            err = np.sqrt(np.mean((np.abs(err_vec)/scale)**2))
+
+            if err <= 1.0:
+                # Accept the step, first-same-as-last: k7 is the next k1
+                t = t_end if last else t + h_step
+                y = y_new
+                k1 = k7
+                factor = 10.0 if err == 0.0 else min(10.0, 0.9*err**(-0.2))
+                if not last:
+                    h = h_step*factor
+            else:
+                h = h_step*max(0.2, 0.9*err**(-0.2))
+                if h < 1e-12*dt:
+                    raise RuntimeError('dopri5: step size underflow')
+
+        if save[ti]:
+            t_out[i_out] = t
+            y_out[i_out] = y
+            i_out += 1
+
+    return t_out, y_out, h, n_fun
+
+
+@njit
+def dopri5_dense(fun, y0, t0, t_out, args, rtol, atol, h0, h_max):
+    '''
+    Dormand-Prince 5(4) method with step sizes chosen by rtol and atol only 
+    (at most h_max, starting with h0). The solution at the times t_out is 
+    interpolated with the continuous extension of the method, the last step 
+    ends exactly at t_out[-1]. Returns the solutions at t_out, the proposed
+    next step size and the number of right-hand side evaluations.
+    '''
+    # Butcher tableau
+    c2, c3, c4, c5 = 1/5, 3/10, 4/5, 8/9
+    a21 = 1/5
+    a31, a32 = 3/40, 9/40
+    a41, a42, a43 = 44/45, -56/15, 32/9
+    a51, a52, a53, a54 = 19372/6561, -25360/2187, 64448/6561, -212/729
+    a61, a62, a63, a64, a65 = 9017/3168, -355/33, 46732/5247, 49/176, -5103/18656
+    b1, b3, b4, b5, b6 = 35/384, 500/1113, 125/192, -2187/6784, 11/84
+    # Difference between fifth and fourth order weights
+    e1, e3, e4, e5, e6, e7 = 71/57600, -71/16695, 71/1920, -17253/339200, 22/525, -1/40
+    # Continuous extension (Hairer, Norsett, Wanner: dopri5)
+    d1, d3, d4 = -12715105075/11282082432, 87487479700/32700410799, -10690763975/1880347072
+    d5, d6, d7 = 701980252875/199316789632, -1453857185/822651844, 69997945/29380423
+
+    n_out = t_out.size
+    y_out = np.empty((n_out, y0.size), dtype=np.complex128)
+
+    y = y0.astype(np.complex128)
+    t = t0
+    t_end = t_out[-1]
+    h = min(h0, h_max)
+    k1 = fun(t, y, *args)
+    n_fun = 1
+    i_out = 0
+    # Output times at the start of the integration
+    while i_out < n_out and t_out[i_out] <= t:
+        y_out[i_out] = y
+        i_out += 1
+
+    while i_out < n_out:
+        last = False
+        if t + h >= t_end:
+            h_step = t_end - t
+            last = True
+        else:
+            h_step = h
+
+        k2 = fun(t + c2*h_step, y + h_step*a21*k1, *args)
+        k3 = fun(t + c3*h_step, y + h_step*(a31*k1 + a32*k2), *args)
+        k4 = fun(t + c4*h_step, y + h_step*(a41*k1 + a42*k2 + a43*k3), *args)
+        k5 = fun(t + c5*h_step, y + h_step*(a51*k1 + a52*k2 + a53*k3 + a54*k4), *args)
+        k6 = fun(t + h_step, y + h_step*(a61*k1 + a62*k2 + a63*k3 + a64*k4 + a65*k5), *args)
+        y_new = y + h_step*(b1*k1 + b3*k3 + b4*k4 + b5*k5 + b6*k6)
+        k7 = fun(t + h_step, y_new, *args)
+        n_fun += 6
+
+        err_vec = h_step*(e1*k1 + e3*k3 + e4*k4 + e5*k5 + e6*k6 + e7*k7)
+        scale = atol + rtol*np.maximum(np.abs(y), np.abs(y_new))
+        err = np.sqrt(np.mean((np.abs(err_vec)/scale)**2))
+
+        if err <= 1.0:
+            t_new = t_end if last else t + h_step
+            # Interpolate all output times within the accepted step
+            if i_out < n_out and t_out[i_out] <= t_new:
+                r2 = y_new - y
+                r3 = h_step*k1 - r2
+                r4 = r2 - h_step*k7 - r3
+                r5 = h_step*(d1*k1 + d3*k3 + d4*k4 + d5*k5 + d6*k6 + d7*k7)
+                while i_out < n_out and t_out[i_out] <= t_new:
+                    theta = (t_out[i_out] - t)/h_step
+                    y_out[i_out] = y + theta*(r2 + (1 - theta)*(r3 + theta*(r4 + (1 - theta)*r5)))
+                    i_out += 1
+            # First-same-as-last: k7 is the next k1
+            t = t_new
+            y = y_new
+            k1 = k7
+            factor = 10.0 if err == 0.0 else min(10.0, 0.9*err**(-0.2))
+            if not last:
+                h = min(h_step*factor, h_max)
+        else:
+            h = h_step*max(0.2, 0.9*err**(-0.2))
+            if h < 1e-12*h_max:
+                raise RuntimeError('dopri5_dense: step size underflow')
+
+    return y_out, h, n_fun
@@ -5,6 +5,7 @@ from scipy import optimize, special, interpolate, signal
 from scipy.signal import hilbert, butter, lfilter, sosfilt
 
 import params
+import compile_cache
 
 def main():
     opt_pulses()
@@ -17,7 +18,7 @@ def opt_pulses():
     THz_conv        = params.THz_conv
 
     #Load THz Pulse data
-    thzPulse        = np.loadtxt("Transient_25THz.txt", delimiter=",")
+    thzPulse        = np.loadtxt(compile_cache.pulse_file, delimiter=",")
     thzPulse[:,0]   *= fs_conv                                              #Recalculation of s into a.u.
 
     initThz         = [1, 100*fs_conv, 0, 25*THz_conv, 0, 0]
@@ -0,0 +1,60 @@
+import os
+import json
+import queue
+import zipfile
+import threading
+import numpy as np
+from numpy.lib import format as npy_format
+
+import result_cache
+
+'''
+Single-file output of an SBE run.
+All observables are written as typed, named arrays into one compressed npz
+container together with the full parameter set, instead of the separate
+.npy and text files. The file is written on a background thread: datasets
+are handed over as soon as they are computed and compressed while the main
+thread continues. It is read with np.load(filename), without pickle.
+'''
+
+
+class OutputWriter:
+    '''
+    Writes named arrays into the compressed npz file filename on a background thread
+    '''
+    def __init__(self, filename, params=None):
+        self.filename = filename
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+        if params is not None:
+            self.add('params', json.dumps(dict(result_cache.parameter_values(params)), default=str))
+            self.add('run_key', result_cache.run_key(params))
+
+    def add(self, name, array):
+        '''
+        Queues array as dataset name, the array is copied and may be changed afterwards
+        '''
+        self.queue.put((name, np.array(array)))
+
+    def close(self):
+        '''
+        Waits until all datasets are written
+        '''
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            print("Output file " + self.filename + " could not be written (" + str(self.error) + ").")
+
+    def _write(self):
+        filename_tmp = self.filename + '.' + str(os.getpid())
+        try:
+            with zipfile.ZipFile(filename_tmp, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as npz_file:
+                for name, array in iter(self.queue.get, None):
+                    with npz_file.open(name + '.npy', 'w', force_zip64=True) as f:
+                        npy_format.write_array(f, array, allow_pickle=False)
+            os.replace(filename_tmp, self.filename)
+        except Exception as error:
+            # Reported by close, the queue is unbounded and never blocks the main thread
+            self.error = error
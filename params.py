@@ -17,6 +17,8 @@ C2                  = 0           # k^2 coefficient
 A                   = 0.1974      # Fermi velocity
 R                   = 5.53        # k^3 coefficient
 k_cut               = 0.05       # Model hamiltonian cutoff
+parametric_system   = False      # Keep the model parameters symbolic, they are then runtime arguments 
+                                 # of the compiled system (sweeps over them need only one compilation)
 
 # Brillouin zone parameters
 ##########################################################################
@@ -44,6 +46,8 @@ rel_dist_to_Gamma   = 0.05        # relative distance (in units of 2pi/a) of bot
 length_path_in_BZ   = 5*np.pi/a   # Length of path in BZ
 angle_inc_E_field   = 0           # incoming angle of the E-field in degree
 num_paths           = 2
+symmetry_reduction  = False       # Solve only one of each pair of k-paths mirrored at the line along E_dir
+                                  # (observables unchanged, the model and mesh symmetry is checked)
 
 # Gauge
 #gauge               = 'length'
@@ -59,7 +63,7 @@ B0                  = 0.00       # B-Field strength (T)
 w                   = 25.0         # Pulse frequency (THz)
 chirp               = 0.0          # Pulse chirp ratio (chirp = c/w) (THz)
 alpha               = 25.0         # Gaussian pulse width (femtoseconds)
-phase               = (0/5)*np.pi  # Carrier envelope phase (edited by cep-scan.py)
+phase               = (0/5)*np.pi  # Carrier envelope phase
 
 # Time scales (all units in femtoseconds)
 ##########################################################################
@@ -69,6 +73,21 @@ t0    = -1000 # Start time *pulse centered @ t=0, use t0 << 0
 tf    = 1000  # End time
 dt    = 0.1  # Time step
 
+# Time integration
+##########################################################################
+solver_method = 'zvode'  # 'zvode': scipy's BDF solver (reference), 'rk4': compiled fixed-step 
+                         # Runge-Kutta (stable only for dt*(band gap) < 2.8), 
+                         # 'dopri5': compiled adaptive Dormand-Prince 5(4)
+rtol          = 1e-6     # Relative tolerance of the adaptive integrators (zvode, dopri5)
+atol          = 1e-12    # Absolute tolerance of the adaptive integrators (zvode, dopri5)
+analytic_jacobian = False  # zvode: use the analytic banded Jacobian instead of full finite differences
+adaptive_steps = False   # zvode, dopri5: time steps chosen by rtol/atol instead of dt, the solution at the 
+                         # output steps is interpolated (dense output), dt then only sets the output grid
+max_step      = 1.0      # Largest time step with adaptive_steps (fs), keeps the solver from stepping over the pulse
+velocity_tables     = False  # Velocity gauge: interpolate band energies, dipoles and emission matrix 
+                             # elements from tables along E_dir instead of evaluating them at k + A(t)*E_dir
+velocity_tables_tol = 1e-8   # Relative accuracy of the interpolation tables
+
 # Unit conversion factors
 ##########################################################################
 fs_conv = 41.34137335                  #(1fs    = 41.341473335 a.u.)
@@ -82,14 +101,40 @@ eV_conv = 0.03674932176                #(1eV    = 0.036749322176 a.u.)
 ##########################################################################
 user_out            = True   # Set to True to get user plotting and progress output
 print_J_P_I_files   = True   # Set to True to get plotting of interband (P), intraband (J) contribution and emission
+output_format       = 'text' # 'text': separate .npy/text files per observable, 'npz': one compressed file 
+                             # with all observables and parameters, written in the background 
+                             # (needed to reanalyse the run with analysis.py)
 energy_plots        = False  # Set to True to plot 3d energy bands and contours
 dipole_plots        = False  # Set tp True to plot dipoles (currently not working?)
 test                = False  # Set to True to output travis testing parameters
 matrix_method       = False  # Set to True to use old matrix method for solving
 emission_wavep      = False  # additionally compute emission quasiclassically using wavepacket dynamics (
+profile             = False  # Time the phases of the run, count the solver steps and write a JSON profile report
 Bcurv_in_B_dynamics = False  # decide when appying B-field whether Berry curvature is used for dynamics
-store_all_timesteps = False
+store_all_timesteps = False  # Store the density matrix of every time step in solution_dir/<run key>/rho_path-<n>.npy
+solution_dir        = 'solution'  # (one subdirectory per parameter set, memory-mapped, solution[i_k, 0, i_time, :], load with np.load(..., mmap_mode='r'))
+stream_observables  = False  # Evaluate the observables at each output step instead of storing the solution
 fitted_pulse        = False
 KK_emission         = True
 normalize_emission  = False         
 normalize_f_valence = False
+
+# Parallelization
+##########################################################################
+n_proc              = 1      # Number of processes to distribute the k-paths on (1: serial)
+batch_paths         = False  # Integrate all paths (of each process) as one vectorized ODE system
+
+# Checkpoint and restart
+##########################################################################
+checkpoint          = False  # Save finished paths and the state of running paths during the time evolution
+checkpoint_dir      = 'checkpoints'  # Directory of the checkpoints (one subdirectory per parameter set)
+checkpoint_interval = 600    # Wall-clock seconds between two checkpoints of a running path
+restart             = False  # Resume an interrupted run with identical parameters from its checkpoints
+
+# Compilation and result caches
+##########################################################################
+compile_cache       = False  # Keep the symbolic system and the compiled kernels on disk for later runs
+compile_cache_dir   = '~/.cache/sbe-solver'  # Directory of the compilation cache
+result_cache        = False  # Reuse the time signals of earlier runs with identical parameters and code
+result_cache_dir    = '~/.cache/sbe-solver/results'  # Directory of the result cache
+result_cache_size   = 2.0    # Maximum size of the result cache in GB (least recently used runs are removed)
@@ -0,0 +1,104 @@
+import time
+import json
+import datetime
+import resource
+from contextlib import contextmanager
+from numba.core import event
+
+'''
+Profile of an SBE run (params.profile = True).
+SBE.main times its phases, every path reports its setup, integration and
+emission time, the numba compilation time, the number of integration steps
+and right-hand side evaluations and the peak memory of its process. The
+report is written as JSON next to the output files. Nested phases are named
+'outer/inner', their time is included in the outer phase.
+'''
+
+# Wall time of the phases of the current run in the main process, in seconds
+phase_times = {}
+
+# Statistics of each path of the current run, in path order
+path_statistics = []
+
+
+def reset():
+    phase_times.clear()
+    path_statistics.clear()
+
+
+@contextmanager
+def phase(name, times=phase_times):
+    '''
+    Adds the wall time of the with-block to times[name]
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        times[name] = times.get(name, 0.0) + time.perf_counter() - start
+
+
+@contextmanager
+def compilation():
+    '''
+    Records the numba compilations of the with-block, see compile_time
+    '''
+    with event.install_recorder('numba:compile') as recorder:
+        yield recorder
+
+
+def compile_time(recorder):
+    '''
+    Wall time of the outermost numba compilations recorded by recorder
+    (callees compiled by a compilation are part of it)
+    '''
+    total, depth = 0.0, 0
+    for timestamp, compile_event in recorder.buffer:
+        if compile_event.is_start:
+            if depth == 0:
+                start = timestamp
+            depth += 1
+        elif compile_event.is_end:
+            depth -= 1
+            if depth == 0:
+                total += timestamp - start
+    return total
+
+
+def peak_memory(who=resource.RUSAGE_SELF):
+    '''
+    Peak resident memory in MB of this process (or of its terminated child processes)
+    '''
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(who).ru_maxrss/1024
+
+
+def progress(ti, Nt, ti_start, start_time):
+    '''
+    Progress of an integration at step ti of Nt, which started at step ti_start
+    at time.time() start_time, with the estimated remaining time
+    '''
+    elapsed = time.time() - start_time
+    line = '{:5.2f}%  elapsed {}'.format(ti/Nt*100, datetime.timedelta(seconds=round(elapsed)))
+    if ti > ti_start:
+        remaining = elapsed*(Nt - ti)/(ti - ti_start)
+        line += '  remaining {}'.format(datetime.timedelta(seconds=round(remaining)))
+    return line
+
+
+def write_report(filename, run_key, total_time, system_time):
+    '''
+    Writes the phases and path statistics of the current run to filename (JSON)
+    '''
+    report = {'run_key': run_key,
+              'total_time': total_time,
+              'symbolic_system_time': system_time,
+              'phases': phase_times,
+              'compile_time': sum(statistics['compile_time'] for statistics in path_statistics),
+              'steps': sum(statistics['steps'] for statistics in path_statistics),
+              'rhs_evaluations': sum(statistics['rhs_evaluations'] for statistics in path_statistics),
+              'peak_memory': peak_memory(),
+              'peak_memory_workers': peak_memory(resource.RUSAGE_CHILDREN),
+              'paths': path_statistics}
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=1)
@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import multiprocessing as mp
+import numpy as np
+from sys import exit
+
+import SBE
+from sweep import point_params
+from benchmark import metadata
+
+'''
+Performance regression tracker for complete runs of SBE.main.
+A fixed matrix of configurations (BZ type x gauge x B-field, on top of the
+defaults of params.py as in tests/) is run, each in a fresh process and in a
+temporary directory. Wall time, integration steps, right-hand side
+evaluations and peak memory are compared with the baselines stored for this
+machine; configurations slower (or larger) than the tolerance are flagged.
+
+    python3 regression.py               # compare, record missing baselines
+    python3 regression.py --update      # record the current results as baselines
+'''
+
+# Settings of all configurations: serial, no caches of results or checkpoints, no output files
+run_defaults = {'n_proc': 1, 'batch_paths': False, 'result_cache': False, 'checkpoint': False,
+                'print_J_P_I_files': False, 'energy_plots': False, 'dipole_plots': False,
+                'store_all_timesteps': False}
+
+# BZ types with their mesh sizes, the full_for_velocity mesh is only used with the velocity gauge
+meshes = {'2line':             {'BZ_type': '2line', 'Nk_in_path': 40, 'num_paths': 2},
+          'full':              {'BZ_type': 'full', 'Nk1': 20, 'Nk2': 4, 'align': 'K'},
+          'full_for_velocity': {'BZ_type': 'full_for_velocity', 'Nk1_vel': 10, 'Nk2_vel': 10}}
+
+
+def configurations():
+    '''
+    Name and parameters of each configuration of the matrix
+    '''
+    configs = {}
+    for mesh_name, mesh_params in meshes.items():
+        for gauge in ['length', 'velocity']:
+            if mesh_name == 'full_for_velocity' and gauge == 'length':
+                continue
+            for B0 in [0.0, 5.0]:
+                name = '{}-{}-B{:g}'.format(mesh_name, gauge, B0)
+                configs[name] = dict(mesh_params, gauge=gauge, B0=B0)
+    return configs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Performance regression tracker of the SBE solver')
+    parser.add_argument('--only', nargs='*', default=[], help='run the configurations whose names contain one of these')
+    parser.add_argument('--repeat', type=int, default=1, help='timed runs per configuration (median)')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed runs per configuration (compilation)')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative slowdown flagged as regression')
+    parser.add_argument('--store', default='regression-baselines.json', help='file of the stored baselines')
+    parser.add_argument('--update', default=False, action='store_true', help='replace the baselines by this run')
+    args = parser.parse_args()
+
+    baselines = load_baselines(args.store)
+    machine_baselines = baselines.setdefault(platform.node(), {})
+
+    regressions = []
+    print('{:<30} {:>12} {:>12} {:>10} {:>14} {:>12}  {}'.format(
+          'Configuration', 'Time (s)', 'Baseline', 'Change', 'RHS calls', 'Memory (MB)', 'Status'))
+    for name, config in configurations().items():
+        if args.only and not any(pattern in name for pattern in args.only):
+            continue
+        result = run_configuration(config, args.repeat, args.warmup)
+        baseline = machine_baselines.get(name)
+        flags = compare(result, baseline, args.tolerance)
+        if flags:
+            regressions.append(name)
+        if baseline is None or args.update:
+            machine_baselines[name] = dict(result, params=config, **metadata())
+
+        change = '' if baseline is None else '{:+.1%}'.format(result['wall_time']/baseline['wall_time'] - 1)
+        status = 'new baseline' if baseline is None else ', '.join(flags) or 'ok'
+        print('{:<30} {:>12.3f} {:>12} {:>10} {:>14d} {:>12.1f}  {}'.format(
+              name, result['wall_time'], '' if baseline is None else '{:.3f}'.format(baseline['wall_time']),
+              change, result['rhs_evaluations'], result['peak_memory'], status))
+
+    save_baselines(args.store, baselines)
+
+    if regressions:
+        exit("Performance regressions in: " + ', '.join(regressions))
+
+
+def compare(result, baseline, tolerance):
+    '''
+    Regressions of result with respect to baseline (empty if there is none)
+    '''
+    if baseline is None:
+        return []
+    flags = []
+    if result['wall_time'] > (1 + tolerance)*baseline['wall_time']:
+        flags.append('SLOWER')
+    if result['peak_memory'] > (1 + tolerance)*baseline['peak_memory']:
+        flags.append('MORE MEMORY')
+    # The number of right-hand side evaluations only changes with the solver or the model
+    if result['rhs_evaluations'] > (1 + tolerance)*baseline['rhs_evaluations']:
+        flags.append('MORE RHS CALLS')
+    return flags
+
+
+def run_configuration(config, repeat=1, warmup=1):
+    '''
+    Wall time (median over repeat runs), solver statistics and peak memory of
+    SBE.main with config, measured in a fresh process
+    '''
+    with mp.get_context('spawn').Pool(1) as pool:
+        return pool.apply(_run_configuration, (config, repeat, warmup))
+
+
+def _run_configuration(config, repeat, warmup):
+    run_dir = tempfile.mkdtemp(prefix='sbe-regression-')
+    os.chdir(run_dir)
+    try:
+        params = point_params(config, run_defaults)
+        for _ in range(warmup):
+            SBE.main(params)
+
+        wall_times = []
+        for _ in range(repeat):
+            SBE.solver_statistics.update(steps=0, rhs_evaluations=0)
+            start = time.perf_counter()
+            SBE.main(params)
+            wall_times.append(time.perf_counter() - start)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    return {'wall_time': float(np.median(wall_times)),
+            'wall_times': wall_times,
+            'steps': SBE.solver_statistics['steps'],
+            'rhs_evaluations': SBE.solver_statistics['rhs_evaluations'],
+            # ru_maxrss is in kB on Linux
+            'peak_memory': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024}
+
+
+def load_baselines(filename):
+    '''
+    Stored baselines as {machine: {configuration: result}}
+    '''
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)
+
+
+def save_baselines(filename, baselines):
+    filename_tmp = filename + '.' + str(os.getpid())
+    with open(filename_tmp, 'w') as f:
+        json.dump(baselines, f, indent=1)
+    os.replace(filename_tmp, filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import os
+import numpy as np
+
+import compile_cache
+
+'''
+Content-addressed cache of the time signals of SBE runs.
+A run is keyed on the hash of every physical and numerical parameter, the
+source of the solver modules and the library versions. Parameters that only
+control output, parallelization or caching are not part of the key, they do
+not change the result. The cache directory is kept below a maximum size by
+removing the least recently used entries.
+'''
+
+# Parameters that do not change the time signals
+execution_params = ['user_out', 'print_J_P_I_files', 'energy_plots', 'dipole_plots', 'test',
+                    'n_proc', 'batch_paths', 'stream_observables',
+                    'compile_cache', 'compile_cache_dir', 'result_cache', 'result_cache_dir', 'result_cache_size',
+                    'checkpoint', 'checkpoint_dir', 'checkpoint_interval', 'restart', 'solution_dir', 'output_format',
+                    'profile']
+
+# Time signals returned by time_evolution, in this order
+signal_names = ['t', 'A_field', 'P_E_dir', 'P_ortho', 'J_E_dir', 'J_ortho',
+                'I_exact_E_dir', 'I_exact_ortho', 'I_exact_diag_E_dir', 'I_exact_diag_ortho',
+                'I_exact_offd_E_dir', 'I_exact_offd_ortho']
+
+here = os.path.dirname(os.path.abspath(__file__))
+code_key = [compile_cache.file_hash(os.path.join(here, name))
+            for name in ['SBE.py', 'systems.py', 'efield.py', 'integrators.py', 'nir.py']]
+
+
+def parameter_values(params, exclude=()):
+    '''
+    Sorted (name, value) pairs of all parameters of params (module or namespace),
+    arrays as lists
+    '''
+    values = []
+    for name in sorted(dir(params)):
+        value = getattr(params, name)
+        if name.startswith('_') or name in exclude or callable(value) or type(value) == type(os):
+            continue
+        if isinstance(value, np.ndarray):
+            value = value.tolist()
+        values.append((name, value))
+    return values
+
+
+def run_key(params):
+    '''
+    Hash of all parameters of params that determine the time signals
+    '''
+    values = parameter_values(params, execution_params)
+    pulse_key = compile_cache.file_hash(compile_cache.pulse_file) if params.fitted_pulse else ''
+    return compile_cache.key_hash((values, pulse_key, code_key, compile_cache.system_key[2:]))
+
+
+def entry_filename(params):
+    return os.path.join(os.path.expanduser(params.result_cache_dir), run_key(params) + '.npz')
+
+
+def load(params):
+    '''
+    Returns the cached time signals (in the order of signal_names) of the run
+    with params, None if the run is not cached
+    '''
+    filename = entry_filename(params)
+    if not os.path.isfile(filename):
+        return None
+    try:
+        with np.load(filename) as entry:
+            signals = [entry[name] for name in signal_names]
+    except Exception as error:
+        print("Result cache entry " + filename + " could not be loaded (" + str(error) + "), recomputing it.")
+        return None
+
+    # Mark the entry as recently used
+    os.utime(filename)
+    return signals
+
+
+def store(params, signals):
+    '''
+    Stores the time signals (in the order of signal_names) of the run with params
+    and evicts the least recently used entries beyond the size limit
+    '''
+    filename = entry_filename(params)
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        filename_tmp = filename + '.' + str(os.getpid())
+        with open(filename_tmp, 'wb') as f:
+            np.savez(f, **dict(zip(signal_names, signals)))
+        os.replace(filename_tmp, filename)
+    except Exception as error:
+        print("Results could not be cached (" + str(error) + ").")
+        return
+
+    evict(os.path.dirname(filename), params.result_cache_size)
+
+
+def evict(cache_dir, max_size):
+    '''
+    Removes the least recently used entries until the cache is at most max_size GB
+    '''
+    entries = []
+    for name in os.listdir(cache_dir):
+        filename = os.path.join(cache_dir, name)
+        if name.endswith('.npz') and os.path.isfile(filename):
+            stat = os.stat(filename)
+            entries.append((stat.st_mtime, stat.st_size, filename))
+
+    size = sum(entry[1] for entry in entries)
+    # Newest entry (the one just stored) is kept in any case
+    for mtime, entry_size, filename in sorted(entries)[:-1]:
+        if size <= max_size*1e9:
+            break
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+        size -= entry_size
@@ -0,0 +1,54 @@
+import numpy as np
+from scipy import fft
+
+'''
+Spectral post-processing of the time signals of SBE.main.
+All signals of a run are Fourier transformed as one stacked array with a
+batched real FFT on worker threads, the window is applied once to the whole
+stack. Angle-resolved spectra follow from the two base spectra by linearity.
+'''
+
+
+def spectra(signals, window=None, workers=-1):
+    '''
+    fftshift(fft(signal*window, norm='ortho')) of each real signal in signals[i_signal, i_time],
+    on the full (negative and positive) frequency axis of fftshift(fftfreq(n_time))
+    '''
+    signals = np.real(np.asarray(signals))
+    if window is not None:
+        signals = signals*window
+    n = signals.shape[-1]
+    half = fft.rfft(signals, axis=-1, norm='ortho', workers=workers)
+    # Negative frequencies of a real signal are the complex conjugates of the positive ones
+    return np.concatenate((np.conj(half[..., n//2:0:-1]), half[..., :n - n//2]), axis=-1)
+
+
+def angle_resolved(spectrum_E_dir, spectrum_ortho, angles):
+    '''
+    Spectra [i_angle, i_freq] of the emission projected on the direction at
+    angles to E_dir, cos(angle)*spectrum_E_dir - sin(angle)*spectrum_ortho
+    '''
+    return np.cos(angles)[:, np.newaxis]*spectrum_E_dir - np.sin(angles)[:, np.newaxis]*spectrum_ortho
+
+
+def harmonic_indices(freq_ratio, orders, width=0.1):
+    '''
+    Index of the middle of the frequencies with order-width < freq_ratio < order+width
+    for each order, freq_ratio = freq/w in increasing order. Raises an IndexError
+    if there is no frequency within the window of an order.
+    '''
+    orders = np.asarray(orders)
+    lower = np.searchsorted(freq_ratio, orders - width, side='right')
+    upper = np.searchsorted(freq_ratio, orders + width, side='left')
+    if np.any(upper <= lower):
+        raise IndexError('No frequency within ' + str(width) + ' of the harmonic order ' 
+                         + str(orders[upper <= lower][0]))
+    return lower + (upper - lower)//2
+
+
+def local_maxima(spectrum):
+    '''
+    Indices of the local maxima of spectrum, the first point is compared to the last one
+    '''
+    is_maximum = (spectrum[:-1] > np.roll(spectrum, 1)[:-1]) & (spectrum[:-1] > spectrum[1:])
+    return np.flatnonzero(is_maximum)
@@ -0,0 +1,89 @@
+import numpy as np
+import itertools
+import multiprocessing as mp
+from types import SimpleNamespace
+
+import params
+import SBE
+
+'''
+Parameter sweeps of SBE.main in a single process tree.
+The grid is given as data, e.g. {'phase': np.linspace(0, np.pi, 6), 'E0': [2.5, 5.0]}
+with the names and units of params.py, params.py itself is never edited.
+All points share the symbolic system and the compiled kernels: the worker
+processes are forked from this process and compile (or load from the
+compilation cache) each kernel once for all of their points. The model
+parameters (C0, C2, A, R, k_cut) can only be swept with parametric_system = True.
+'''
+
+# Run each point quietly and in a single process, the points are the parallel tasks
+point_defaults = {'user_out': False, 'print_J_P_I_files': False, 'test': False, 'n_proc': 1}
+
+
+def point_params(point, fixed={}):
+    '''
+    Copy of the params module with the values of fixed and of the sweep point
+    '''
+    values = {name: getattr(params, name) for name in dir(params) if not name.startswith('_')}
+    values.update(point_defaults)
+    values.update(fixed)
+    values.update(point)
+    return SimpleNamespace(**values)
+
+
+def _run_point(task):
+    point, fixed = task
+    return SBE.main(point_params(point, fixed))
+
+
+def sweep(grid, n_proc=1, filename='sweep.npz', fixed={}):
+    '''
+    Runs SBE.main for all combinations of the values in grid (name -> values)
+    on n_proc processes. fixed are parameters changed for all points.
+    Writes and returns one result set: the grid values under their names and
+    every result of SBE.main stacked as [i_1, ..., i_n, ...] over the grid axes.
+    '''
+    tasks = [(point, fixed) for point in grid_points(grid)]
+
+    if n_proc > 1 and len(tasks) > 1:
+        with mp.get_context('fork').Pool(min(n_proc, len(tasks))) as pool:
+            point_results = pool.map(_run_point, tasks)
+    else:
+        point_results = [_run_point(task) for task in tasks]
+
+    results = stack_results(grid, point_results)
+    np.savez(filename, **results)
+    return results
+
+
+def grid_points(grid):
+    '''
+    All combinations of the values in grid as {name: value}, in the order of itertools.product
+    '''
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def stack_results(grid, point_results):
+    '''
+    The grid values under their names and every result of the points 
+    (in the order of grid_points) stacked as [i_1, ..., i_n, ...]
+    '''
+    names = list(grid)
+    shape = tuple(np.size(grid[name]) for name in names)
+    results = {name: np.array(grid[name]) for name in names}
+    for key in point_results[0]:
+        values = [point_result[key] for point_result in point_results]
+        shapes = [np.shape(value) for value in values]
+        if len(set(shapes)) == 1:
+            results[key] = np.array(values).reshape(shape + shapes[0])
+        else:
+            # e.g. time grids of different length: padded with NaN to the largest shape,
+            # the shape of each point is stored as <key>_shape (no pickled object arrays)
+            padded_shape = tuple(np.max(shapes, axis=0))
+            padded = np.full((len(values),) + padded_shape, np.nan, dtype=np.result_type(*values, float))
+            for padded_value, value in zip(padded, values):
+                padded_value[tuple(slice(0, n) for n in np.shape(value))] = value
+            results[key] = padded.reshape(shape + padded_shape)
+            results[key + '_shape'] = np.array(shapes).reshape(shape + (len(padded_shape),))
+    return results
@@ -1,9 +1,16 @@
 import params
+import time
+import inspect
+import numpy as np
+import sympy as sp
 from copy import deepcopy
+from numba import njit
 
 import hfsbe.dipole
 import hfsbe.example
 
+import compile_cache
+
 # Set BZ type independent parameters
 # Hamiltonian parameters
 C0 = params.C0                             # Dirac point position
@@ -12,56 +19,106 @@ A = params.A                               # Fermi velocity
 R = params.R                               # k^3 coefficient
 k_cut = params.k_cut                       # Model hamiltonian cutoff parameter
 
-# Initialize sympy bandstructure, energies/derivatives, dipoles
-# ## Bismuth Teluride calls
-system = hfsbe.example.BiTe(C0=C0, C2=C2, A=A, R=R, kcut=k_cut)
-# ## Trivial Bismuth Teluride call
-# system = hfsbe.example.BiTeTrivial(C0=C0,C2=C2,R=R,vf=A,kcut=k_cut)
-# ## Periodic Bismuth Teluride call
-# system = hfsbe.example.BiTePeriodic(C0=C0,C2=C2,A=A,R=R)
-# system = hfsbe.example.BiTePeriodic(default_params=True)
-# ## Haldane calls
-# system = hfsbe.example.Haldane(t1=1,t2=1,m=1,phi=np.pi/6,b1=b1,b2=b2)
-# ## Graphene calls
-# system = hfsbe.example.Graphene(t=1)
-# ## Dirac calls
-# system = hfsbe.example.Dirac(m=0.1)
-
-# Get symbolic hamiltonian, energies, wavefunctions, energy derivatives
-# h, ef, wf, ediff = system.eigensystem(gidx=1)
-h_sym, ef_sym, wf_sym, ediff_sym = system.eigensystem(gidx=1)
+# With a parametric system the model parameters stay sympy symbols and are 
+# arguments of all generated functions, one compiled system serves all values
+parametric = params.parametric_system
+model_symbols = ['C0', 'C2', 'A', 'R', 'kcut']
+model_values  = np.array([C0, C2, A, R, k_cut], dtype=float)
+
+def build_system():
+    if parametric:
+        C0, C2, A, R, k_cut = [sp.Symbol(name, real=True) for name in model_symbols]
+    else:
+        C0, C2, A, R, k_cut = params.C0, params.C2, params.A, params.R, params.k_cut
+
+    # Initialize sympy bandstructure, energies/derivatives, dipoles
+    # ## Bismuth Teluride calls
+    system = hfsbe.example.BiTe(C0=C0, C2=C2, A=A, R=R, kcut=k_cut)
+    # ## Trivial Bismuth Teluride call
+    # system = hfsbe.example.BiTeTrivial(C0=C0,C2=C2,R=R,vf=A,kcut=k_cut)
+    # ## Periodic Bismuth Teluride call
+    # system = hfsbe.example.BiTePeriodic(C0=C0,C2=C2,A=A,R=R)
+    # system = hfsbe.example.BiTePeriodic(default_params=True)
+    # ## Haldane calls
+    # system = hfsbe.example.Haldane(t1=1,t2=1,m=1,phi=np.pi/6,b1=b1,b2=b2)
+    # ## Graphene calls
+    # system = hfsbe.example.Graphene(t=1)
+    # ## Dirac calls
+    # system = hfsbe.example.Dirac(m=0.1)
+
+    # Get symbolic hamiltonian, energies, wavefunctions, energy derivatives
+    # h, ef, wf, ediff = system.eigensystem(gidx=1)
+    h_sym, ef_sym, wf_sym, ediff_sym = system.eigensystem(gidx=1)
+
+    # Get symbolic dipoles
+    dipole = hfsbe.dipole.SymbolicDipole(h_sym, ef_sym, wf_sym, offdiagonal_k=True)
+
+    curv = hfsbe.dipole.SymbolicCurvature(h_sym, dipole.Ax, dipole.Ay)
+
+    return system, h_sym, ef_sym, wf_sym, ediff_sym, dipole, curv
+
+# The symbolic work is done once per model and parameter set,
+# later runs load it from the compilation cache
+build_start = time.perf_counter()
+system, h_sym, ef_sym, wf_sym, ediff_sym, dipole, curv = compile_cache.load_or_build('system', build_system)
+
+
+def model_kwargs(model):
+    '''
+    Keyword arguments of the model parameter values for the generated functions
+    '''
+    if not parametric:
+        return {}
+    return dict(zip(model_symbols, model))
+
+
+def bind_model(fjit, k_args=('kx', 'ky')):
+    '''
+    Wraps the generated njit function fjit(kx=, ky=, [model symbols=]) as 
+    f(kx, ky, model) with the model parameter values as array model, 
+    which is ignored if the system is not parametric
+    '''
+    accepted = inspect.signature(fjit.py_func).parameters
+    call_args = [k + '=' + k for k in k_args]
+    if parametric:
+        call_args += [name + '=model[' + str(i) + ']' for i, name in enumerate(model_symbols) if name in accepted]
+    namespace = {'fjit': fjit}
+    exec('def f(' + ', '.join(k_args) + ', model):\n'
+         '    return fjit(' + ', '.join(call_args) + ')\n', namespace)
+    return njit(namespace['f'])
+
 
 # Assign all energy band functions
-evjit, ecjit = system.efjit[0], system.efjit[1]
+evjit, ecjit = bind_model(system.efjit[0]), bind_model(system.efjit[1])
 
 # for improved emission formula, we need derivative of the Hamiltonian 
+# (evaluated with ev_mat(h_deriv[i], kx=, ky=, **model_kwargs(model)))
 h_deriv = system.hderivfjit
 
 # for B-field dynamics, we need fast bandstructure derivative
-ev_dx = system.ederivfjit[0]
-ev_dy = system.ederivfjit[1]
-ec_dx = system.ederivfjit[2]
-ec_dy = system.ederivfjit[3]
+ev_dx = bind_model(system.ederivfjit[0])
+ev_dy = bind_model(system.ederivfjit[1])
+ec_dx = bind_model(system.ederivfjit[2])
+ec_dy = bind_model(system.ederivfjit[3])
 
-# 
+# (evaluated with wf(kx=, ky=, **model_kwargs(model)))
 wf = system.Uf
 wf_h = system.Uf_h
 
-# Get symbolic dipoles
-dipole = hfsbe.dipole.SymbolicDipole(h_sym, ef_sym, wf_sym, offdiagonal_k=True)
-
 # Assign all dipole moment functions
-di_00xjit      = dipole.Axfjit[0][0]
-di_01xjit      = dipole.Axfjit[0][1]
-di_01xjit_offk = dipole.Axfjit_offk[0][1]
-di_11xjit      = dipole.Axfjit[1][1]
-
-di_00yjit      = dipole.Ayfjit[0][0]
-di_01yjit      = dipole.Ayfjit[0][1]
-di_01yjit_offk = dipole.Ayfjit_offk[0][1]
-di_11yjit      = dipole.Ayfjit[1][1]
-
-curv = hfsbe.dipole.SymbolicCurvature(h_sym, dipole.Ax, dipole.Ay)
-cu_00jit = curv.Bfjit[0][0]
-cu_01jit = curv.Bfjit[0][1]
-cu_11jit = curv.Bfjit[1][1]
+di_00xjit      = bind_model(dipole.Axfjit[0][0])
+di_01xjit      = bind_model(dipole.Axfjit[0][1])
+di_01xjit_offk = bind_model(dipole.Axfjit_offk[0][1], ('kx', 'ky', 'kxp', 'kyp'))
+di_11xjit      = bind_model(dipole.Axfjit[1][1])
+
+di_00yjit      = bind_model(dipole.Ayfjit[0][0])
+di_01yjit      = bind_model(dipole.Ayfjit[0][1])
+di_01yjit_offk = bind_model(dipole.Ayfjit_offk[0][1], ('kx', 'ky', 'kxp', 'kyp'))
+di_11yjit      = bind_model(dipole.Ayfjit[1][1])
+
+cu_00jit = bind_model(curv.Bfjit[0][0])
+cu_01jit = bind_model(curv.Bfjit[0][1])
+cu_11jit = bind_model(curv.Bfjit[1][1])
+
+# Wall time of the symbolic system (build or cache load) and of its jit functions
+build_time = time.perf_counter() - build_start
@@ -0,0 +1,509 @@
+import os
+import sys
+import subprocess
+import numpy as np
+import pytest
+from types import SimpleNamespace
+
+repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, repo_dir)
+import params
+import SBE
+
+# Equivalent ways of solving a run are compared on its time signals, for a
+# short pulse on a small 2line mesh (band gaps small enough for rk4 with dt)
+small_run = {'Nk_in_path': 6, 'length_path_in_BZ': 0.5, 't0': -100, 'tf': 100, 'dt': 0.01}
+
+signal_names = ['t', 'A_field', 'P_E_dir', 'P_ortho', 'J_E_dir', 'J_ortho', 'I_exact_E_dir', 'I_exact_ortho',
+                'I_exact_diag_E_dir', 'I_exact_diag_ortho', 'I_exact_offd_E_dir', 'I_exact_offd_ortho']
+
+
+def run_params(**changes):
+    values = {name: getattr(params, name) for name in dir(params) if not name.startswith('_')}
+    values.update(small_run)
+    values.update(changes)
+    return SimpleNamespace(**values)
+
+
+class Interrupted(Exception):
+    pass
+
+
+def run(p, paths=None, **options):
+    '''
+    Time signals of the 2line run p, solved by time_evolution with the given options
+    '''
+    E_dir = np.array([np.cos(np.radians(p.angle_inc_E_field)), np.sin(np.radians(p.angle_inc_E_field))])
+    dk, kpnts, mesh_paths = SBE.mesh(p, E_dir)
+    if paths is None:
+        paths = mesh_paths
+    # P and J (KK_emission) are only implemented in length gauge
+    signals = SBE.time_evolution(int(p.t0*p.fs_conv), int(p.tf*p.fs_conv), p.dt*p.fs_conv, paths, False, E_dir,
+                                 p.e_fermi*p.eV_conv, p.temperature*p.eV_conv, dk, 1/(p.T1*p.fs_conv), 1/(p.T2*p.fs_conv),
+                                 p.E0*p.E_conv, 0.0, p.w*p.THz_conv, p.chirp*p.THz_conv, p.alpha*p.fs_conv, p.phase, False,
+                                 p.gauge, p.normalize_f_valence, 1/(2*p.dt), '2line', p.Nk_in_path, p.Nk_in_path,
+                                 p.Bcurv_in_B_dynamics, 'density_matrix_dynamics',
+                                 [], [], [], [], [], [], [], [], [], [], p.gauge == 'length', **options)
+    return dict(zip(signal_names, signals))
+
+
+def assert_signals_close(result, reference, rtol):
+    for name in signal_names:
+        scale = np.amax(np.abs(reference[name]))
+        assert np.amax(np.abs(result[name] - reference[name])) <= rtol*scale, name
+
+
+@pytest.mark.parametrize('gauge', ['length', 'velocity'])
+def test_batched_paths_match_single_paths(gauge):
+    p = run_params(gauge=gauge, num_paths=4)
+    reference = run(p)
+    result = run(p, n_proc=2, batch_paths=True)
+    assert_signals_close(result, reference, 1e-4)
+
+
+@pytest.mark.parametrize('gauge', ['length', 'velocity'])
+def test_compiled_integrators_match_zvode(gauge):
+    p = run_params(gauge=gauge)
+    reference = run(p, solver_method='zvode', rtol=1e-10)
+    for options in [{'solver_method': 'rk4'}, {'solver_method': 'dopri5', 'rtol': 1e-10},
+                    {'solver_method': 'dopri5', 'rtol': 1e-10, 'adaptive_steps': True, 'max_step': p.max_step*p.fs_conv}]:
+        assert_signals_close(run(p, **options), reference, 1e-5)
+
+
+@pytest.mark.parametrize('gauge', ['length', 'velocity'])
+def test_adaptive_steps_match_fixed_steps(gauge):
+    p = run_params(gauge=gauge)
+    reference = run(p, solver_method='zvode', rtol=1e-10)
+    result = run(p, solver_method='zvode', rtol=1e-10, adaptive_steps=True, max_step=p.max_step*p.fs_conv)
+    assert_signals_close(result, reference, 1e-5)
+
+
+@pytest.mark.parametrize('gauge', ['length', 'velocity'])
+def test_analytic_jacobian_matches_finite_differences(gauge, monkeypatch):
+    # Initial values and right-hand side arguments of the first path, as passed to the integrator
+    arguments = []
+    def rk4(fun, y0, t0, dt, save, args):
+        arguments.append((y0, args))
+        raise Interrupted()
+    monkeypatch.setattr(SBE.integrators, 'rk4', rk4)
+    p = run_params(gauge=gauge)
+    with pytest.raises(Interrupted):
+        run(p, solver_method='rk4')
+    y0, f_params = arguments[0]
+    path = f_params[0]
+
+    # The Jacobian is the one of the holomorphic form of fnumba on rho = rho^dagger,
+    # it is compared along directions that keep the density matrix hermitian
+    rng = np.random.RandomState(1)
+    def hermitian(scale):
+        rho = np.zeros((len(path), 8), dtype=complex)
+        rho[:, [0, 3]] = rng.uniform(-scale, scale, (len(path), 2))
+        rho[:, 1] = rng.uniform(-scale, scale, len(path)) + 1j*rng.uniform(-scale, scale, len(path))
+        rho[:, 2] = rho[:, 1].conjugate()
+        return rho
+    y = np.append(y0[:-1] + hermitian(0.1).ravel(), 0.05)
+    # Left out of the Jacobian: the periodic wrap-around at the ends of the path 
+    # and the dependence on the vector potential y[-1]
+    direction = hermitian(1.0)
+    direction[[0, -1]] = 0
+    direction = np.append(direction.ravel(), 0)
+
+    t = 0.3*p.alpha*p.fs_conv
+    eps = 1e-6
+    finite_difference = (SBE.fnumba(t, y + eps*direction, *f_params) - SBE.fnumba(t, y - eps*direction, *f_params))/(2*eps)
+
+    # jac_packed[i-j+band, j] = d x[i]/d y[j]
+    jac_packed = SBE.jacnumba(t, y, *f_params)
+    band = SBE.jacobian_bandwidth(gauge)
+    jacobian_product = np.zeros(y.size, dtype=complex)
+    for diagonal in range(-band, band + 1):
+        j = np.arange(max(0, -diagonal), min(y.size, y.size - diagonal))
+        jacobian_product[j + diagonal] += jac_packed[diagonal + band, j]*direction[j]
+
+    assert np.allclose(jacobian_product, finite_difference, rtol=1e-6, atol=1e-6*np.amax(np.abs(finite_difference)))
+
+
+@pytest.mark.parametrize('gauge', ['length', 'velocity'])
+def test_streamed_observables_match_stored_solution(gauge):
+    p = run_params(gauge=gauge)
+    reference = run(p, solver_method='rk4')
+    result = run(p, solver_method='rk4', stream_observables=True)
+    assert_signals_close(result, reference, 1e-10)
+
+
+def random_path_solution(Nk_in_path=5, n_time_steps=7):
+    '''
+    A path of the 2line mesh with a random solution[i_k, 0, i_time, :] and vector potential
+    '''
+    p = run_params(Nk_in_path=Nk_in_path)
+    E_dir = np.array([np.cos(np.radians(p.angle_inc_E_field)), np.sin(np.radians(p.angle_inc_E_field))])
+    dk, kpnts, paths = SBE.mesh(p, E_dir)
+    rng = np.random.RandomState(2)
+    solution = 0.1*(rng.uniform(-1, 1, (Nk_in_path, 1, n_time_steps, 8)) + 1j*rng.uniform(-1, 1, (Nk_in_path, 1, n_time_steps, 8)))
+    A_field = 0.1*rng.uniform(-1, 1, n_time_steps)
+    return paths[0], solution, E_dir, A_field
+
+
+def loop_emission_exact(path, solution, E_dir, A_field, gauge, normalize_f_valence, KK_emission):
+    '''
+    emission_exact as a loop over time steps and k-points, as it was before its vectorization
+    '''
+    n_time_steps = np.size(solution[0,0,:,0])
+    I_E_dir, I_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho, P_E_dir, P_ortho, J_E_dir, J_ortho = \
+        [np.zeros(n_time_steps) for i in range(10)]
+
+    E_ort = np.array([E_dir[1], -E_dir[0]])
+    subtract_from_f_v = 1 if normalize_f_valence else 0
+
+    kx_in_path = path[:, 0]
+    ky_in_path = path[:, 1]
+    for i_time in range(n_time_steps):
+
+        if gauge == 'length':
+            kx_in_path_backshift = kx_in_path
+            ky_in_path_backshift = ky_in_path
+        elif gauge == 'velocity':
+            kx_in_path_backshift = kx_in_path + A_field[i_time]*E_dir[0]
+            ky_in_path_backshift = ky_in_path + A_field[i_time]*E_dir[1]
+
+        h_deriv_x = SBE.ev_mat(SBE.sys.h_deriv[0], kx=kx_in_path_backshift, ky=ky_in_path_backshift)
+        h_deriv_y = SBE.ev_mat(SBE.sys.h_deriv[1], kx=kx_in_path_backshift, ky=ky_in_path_backshift)
+
+        h_deriv_E_dir = h_deriv_x*E_dir[0] + h_deriv_y*E_dir[1]
+        h_deriv_ortho = h_deriv_x*E_ort[0] + h_deriv_y*E_ort[1]
+
+        U   = SBE.sys.wf  (kx=kx_in_path_backshift, ky=ky_in_path_backshift)
+        U_h = SBE.sys.wf_h(kx=kx_in_path_backshift, ky=ky_in_path_backshift)
+
+        for i_k in range(np.size(kx_in_path)):
+
+            U_h_H_U_E_dir = np.matmul(U_h[:,:,i_k], np.matmul(h_deriv_E_dir[:,:,i_k], U[:,:,i_k]))
+            U_h_H_U_ortho = np.matmul(U_h[:,:,i_k], np.matmul(h_deriv_ortho[:,:,i_k], U[:,:,i_k]))
+
+            I_E_dir[i_time] += np.real(U_h_H_U_E_dir[0,0])*(np.real(solution[i_k, 0, i_time, 0]) - subtract_from_f_v)
+            I_E_dir[i_time] += np.real(U_h_H_U_E_dir[1,1])*np.real(solution[i_k, 0, i_time, 3])
+            I_E_dir[i_time] += 2*np.real(U_h_H_U_E_dir[0,1]*solution[i_k, 0, i_time, 2])
+            I_exact_diag_E_dir[i_time] += np.real(U_h_H_U_E_dir[0,0])*(np.real(solution[i_k, 0, i_time, 0]) - subtract_from_f_v)
+            I_exact_diag_E_dir[i_time] += np.real(U_h_H_U_E_dir[1,1])*np.real(solution[i_k, 0, i_time, 3])
+            I_exact_offd_E_dir[i_time] += 2*np.real(U_h_H_U_E_dir[0,1]*solution[i_k, 0, i_time, 2])
+
+            I_ortho[i_time] += np.real(U_h_H_U_ortho[0,0])*(np.real(solution[i_k, 0, i_time, 0]) - subtract_from_f_v)
+            I_ortho[i_time] += np.real(U_h_H_U_ortho[1,1])*np.real(solution[i_k, 0, i_time, 3])
+            I_ortho[i_time] += 2*np.real(U_h_H_U_ortho[0,1]*solution[i_k, 0, i_time, 2])
+            I_exact_diag_ortho[i_time] += np.real(U_h_H_U_ortho[0,0])*(np.real(solution[i_k, 0, i_time, 0]) - subtract_from_f_v)
+            I_exact_diag_ortho[i_time] += np.real(U_h_H_U_ortho[1,1])*np.real(solution[i_k, 0, i_time, 3])
+            I_exact_offd_ortho[i_time] += 2*np.real(U_h_H_U_ortho[0,1]*solution[i_k, 0, i_time, 2])
+
+        if KK_emission:
+
+            # Interband polarization
+            di_x, di_y = SBE.sys.dipole.evaluate(kx_in_path, ky_in_path)
+            d_E_dir = di_x[0, 1, :]*E_dir[0] + di_y[0, 1, :]*E_dir[1]
+            d_ortho = di_x[0, 1, :]*E_ort[0] + di_y[0, 1, :]*E_ort[1]
+
+            for i_k in range(np.size(kx_in_path)):
+                P_E_dir[i_time] += 2*np.real(d_E_dir[i_k]*solution[i_k, 0, i_time, 1])
+                P_ortho[i_time] += 2*np.real(d_ortho[i_k]*solution[i_k, 0, i_time, 1])
+
+            # Intraband current
+            evdx = SBE.sys.system.ederivfjit[0](kx=kx_in_path, ky=ky_in_path)
+            evdy = SBE.sys.system.ederivfjit[1](kx=kx_in_path, ky=ky_in_path)
+            ecdx = SBE.sys.system.ederivfjit[2](kx=kx_in_path, ky=ky_in_path)
+            ecdy = SBE.sys.system.ederivfjit[3](kx=kx_in_path, ky=ky_in_path)
+
+            jc_E_dir = ecdx*E_dir[0] + ecdy*E_dir[1]
+            jc_ortho = ecdx*E_ort[0] + ecdy*E_ort[1]
+            jv_E_dir = evdx*E_dir[0] + evdy*E_dir[1]
+            jv_ortho = evdx*E_ort[0] + evdy*E_ort[1]
+
+            for i_k in range(np.size(kx_in_path)):
+                J_E_dir[i_time] += np.real(jc_E_dir[i_k]*solution[i_k, 0, i_time, 3] + jv_E_dir[i_k]*(solution[i_k, 0, i_time, 0] - subtract_from_f_v))
+                J_ortho[i_time] += np.real(jc_ortho[i_k]*solution[i_k, 0, i_time, 3] + jv_ortho[i_k]*(solution[i_k, 0, i_time, 0] - subtract_from_f_v))
+
+    return I_E_dir, I_ortho, I_exact_diag_E_dir, I_exact_diag_ortho, I_exact_offd_E_dir, I_exact_offd_ortho, P_E_dir, P_ortho, J_E_dir, J_ortho
+
+
+# KK emission (P and J) is only implemented in length gauge
+@pytest.mark.parametrize('gauge, KK_emission', [('length', True), ('velocity', False)])
+def test_emission_exact_matches_loop_over_k_points(gauge, KK_emission):
+    path, solution, E_dir, A_field = random_path_solution()
+    reference = loop_emission_exact(path, solution, E_dir, A_field, gauge, True, KK_emission)
+    observables = [np.zeros(np.size(A_field)) for i in range(10)]
+    result = SBE.emission_exact(path, solution, E_dir, A_field, gauge, True, 1, *observables, KK_emission, SBE.sys.model_values)
+    for observable, reference_observable in zip(result, reference):
+        assert np.allclose(observable, reference_observable, rtol=1e-10, atol=1e-14)
+
+
+def loop_emission_semicl_B_field(path, solution, E_dir, normalize_f_valence):
+    '''
+    emission_semicl_B_field as a loop over time steps and k-points, as it was before its batching
+    '''
+    n_time_steps = np.size(solution[0,0,:,0])
+    I_exact_E_dir = np.zeros(n_time_steps)
+    I_exact_ortho = np.zeros(n_time_steps)
+
+    E_ort = np.array([E_dir[1], -E_dir[0]])
+    subtract_from_f_v = 1 if normalize_f_valence else 0
+
+    kx_in_path = path[:, 0]
+    ky_in_path = path[:, 1]
+    for i_time in range(n_time_steps):
+        for i_k in range(np.size(kx_in_path)):
+
+            # Single k-points, evaluated as arrays of length one
+            kx_in_path_shifted_v = kx_in_path[i_k:i_k+1] + np.real(solution[i_k, 0, i_time, 4])
+            ky_in_path_shifted_v = ky_in_path[i_k:i_k+1] + np.real(solution[i_k, 0, i_time, 5])
+            kx_in_path_shifted_c = kx_in_path[i_k:i_k+1] + np.real(solution[i_k, 0, i_time, 6])
+            ky_in_path_shifted_c = ky_in_path[i_k:i_k+1] + np.real(solution[i_k, 0, i_time, 7])
+
+            U_shift_v   = SBE.sys.wf  (kx=kx_in_path_shifted_v, ky=ky_in_path_shifted_v)
+            U_shift_v_h = SBE.sys.wf_h(kx=kx_in_path_shifted_v, ky=ky_in_path_shifted_v)
+            U_shift_c   = SBE.sys.wf  (kx=kx_in_path_shifted_c, ky=ky_in_path_shifted_c)
+            U_shift_c_h = SBE.sys.wf_h(kx=kx_in_path_shifted_c, ky=ky_in_path_shifted_c)
+
+            h_deriv_x_v = SBE.ev_mat(SBE.sys.h_deriv[0], kx=kx_in_path_shifted_v, ky=ky_in_path_shifted_v)
+            h_deriv_y_v = SBE.ev_mat(SBE.sys.h_deriv[1], kx=kx_in_path_shifted_v, ky=ky_in_path_shifted_v)
+            h_deriv_E_dir_v = h_deriv_x_v*E_dir[0] + h_deriv_y_v*E_dir[1]
+            h_deriv_ortho_v = h_deriv_x_v*E_ort[0] + h_deriv_y_v*E_ort[1]
+
+            h_deriv_x_c = SBE.ev_mat(SBE.sys.h_deriv[0], kx=kx_in_path_shifted_c, ky=ky_in_path_shifted_c)
+            h_deriv_y_c = SBE.ev_mat(SBE.sys.h_deriv[1], kx=kx_in_path_shifted_c, ky=ky_in_path_shifted_c)
+            h_deriv_E_dir_c = h_deriv_x_c*E_dir[0] + h_deriv_y_c*E_dir[1]
+            h_deriv_ortho_c = h_deriv_x_c*E_ort[0] + h_deriv_y_c*E_ort[1]
+
+            U_h_H_U_E_dir_v = np.matmul(U_shift_v_h[:,:,0], np.matmul(h_deriv_E_dir_v[:,:,0], U_shift_v[:,:,0]))
+            U_h_H_U_ortho_v = np.matmul(U_shift_v_h[:,:,0], np.matmul(h_deriv_ortho_v[:,:,0], U_shift_v[:,:,0]))
+            U_h_H_U_E_dir_c = np.matmul(U_shift_c_h[:,:,0], np.matmul(h_deriv_E_dir_c[:,:,0], U_shift_c[:,:,0]))
+            U_h_H_U_ortho_c = np.matmul(U_shift_c_h[:,:,0], np.matmul(h_deriv_ortho_c[:,:,0], U_shift_c[:,:,0]))
+
+            I_exact_E_dir[i_time] += np.real(U_h_H_U_E_dir_v[0,0])*(np.real(solution[i_k, 0, i_time, 0]) - subtract_from_f_v)
+            I_exact_E_dir[i_time] += np.real(U_h_H_U_E_dir_c[1,1])*np.real(solution[i_k, 0, i_time, 3])
+            I_exact_ortho[i_time] += np.real(U_h_H_U_ortho_v[0,0])*(np.real(solution[i_k, 0, i_time, 0]) - subtract_from_f_v)
+            I_exact_ortho[i_time] += np.real(U_h_H_U_ortho_c[1,1])*np.real(solution[i_k, 0, i_time, 3])
+
+    return I_exact_E_dir, I_exact_ortho
+
+
+def test_emission_semicl_B_field_matches_loop_over_k_points():
+    path, solution, E_dir, A_field = random_path_solution()
+    reference = loop_emission_semicl_B_field(path, solution, E_dir, True)
+    observables = [np.zeros(np.size(A_field)) for i in range(2)]
+    result = SBE.emission_semicl_B_field(path, solution, E_dir, *observables, 1, True, SBE.sys.model_values)
+    for observable, reference_observable in zip(result, reference):
+        assert np.allclose(observable, reference_observable, rtol=1e-10, atol=1e-14)
+
+
+def test_velocity_tables_match_direct_evaluation():
+    path, solution, E_dir, A_field = random_path_solution()
+    kx_in_path, ky_in_path = path[:, 0], path[:, 1]
+    model = SBE.sys.model_values
+    tol = params.velocity_tables_tol
+    vg_tables, emission_tables = SBE.velocity_gauge_tables(kx_in_path, ky_in_path, E_dir, np.amin(A_field), np.amax(A_field),
+                                                           tol, False, model)
+
+    # Band energies and dipoles of fnumba along the path shifted by A(t)
+    for k_shift in A_field:
+        direct = SBE.velocity_gauge_path(k_shift, kx_in_path, ky_in_path, E_dir, model)
+        interpolated = SBE.interpolate_velocity_gauge_path(k_shift, vg_tables)
+        for table_value, value in zip(interpolated, direct):
+            assert np.amax(np.abs(table_value - value)) <= 10*tol*np.amax(np.abs(value))
+
+    # Emission matrix elements of emission_exact
+    reference = SBE.emission_exact(path, solution, E_dir, A_field, 'velocity', True, 1,
+                                   *[np.zeros(np.size(A_field)) for i in range(10)], False, model)
+    result = SBE.emission_exact(path, solution, E_dir, A_field, 'velocity', True, 1,
+                                *[np.zeros(np.size(A_field)) for i in range(10)], False, model, emission_tables)
+    for observable, reference_observable in zip(result, reference):
+        assert np.amax(np.abs(observable - reference_observable)) <= 10*tol*np.amax(np.abs(reference_observable))
+
+
+def test_parametric_system_matches_fixed_model(tmp_path):
+    # The system is built on import, the parametric one in a separate process
+    filename = os.path.join(str(tmp_path), 'parametric.npz')
+    code = ("import sys\n"
+            "sys.path.insert(0, 'tests')\n"
+            "import params\n"
+            "params.parametric_system = True\n"
+            "import numpy as np, test_equivalence as t\n"
+            "signals = {gauge + name: value for gauge in ['length', 'velocity']\n"
+            "           for name, value in t.run(t.run_params(gauge=gauge), solver_method='rk4').items()}\n"
+            "np.savez(%r, **signals)\n" % filename)
+    subprocess.check_call([sys.executable, '-c', code], cwd=repo_dir)
+
+    with np.load(filename) as parametric:
+        for gauge in ['length', 'velocity']:
+            reference = run(run_params(gauge=gauge), solver_method='rk4')
+            assert_signals_close({name: parametric[gauge + name] for name in signal_names}, reference, 1e-10)
+
+
+def test_restart_from_checkpoints_gives_identical_signals(tmp_path, monkeypatch):
+    p = run_params(num_paths=2)
+    checkpoint_dir = os.path.join(str(tmp_path), 'run')
+    reference = run(p, solver_method='rk4')
+
+    # The run is interrupted within the second path, after the first one has finished
+    output_steps = SBE.output_steps
+    calls = []
+    def interrupted_output_steps(*args, **kwargs):
+        calls.append(args)
+        for i_step, step in enumerate(output_steps(*args, **kwargs)):
+            if len(calls) == 2 and i_step == 100:
+                raise Interrupted()
+            yield step
+    monkeypatch.setattr(SBE, 'output_steps', interrupted_output_steps)
+    with pytest.raises(Interrupted):
+        run(p, solver_method='rk4', checkpoint_dir=checkpoint_dir, checkpoint_interval=0)
+    monkeypatch.undo()
+
+    # The finished first path and the last state of the second one
+    checkpoints = os.listdir(checkpoint_dir)
+    assert len(checkpoints) == 2
+    assert len([name for name in checkpoints if name.endswith('-done.npz')]) == 1
+
+    result = run(p, solver_method='rk4', checkpoint_dir=checkpoint_dir, checkpoint_interval=0, restart=True)
+    assert_signals_close(result, reference, 1e-10)
+    # The checkpoints of a finished run are removed
+    assert not os.path.exists(checkpoint_dir)
+
+
+
+def mirror_mesh(num_paths):
+    # E_dir along the mirror line kx -> -kx of BiTe
+    p = run_params(angle_inc_E_field=90, num_paths=num_paths)
+    E_dir = np.array([np.cos(np.radians(p.angle_inc_E_field)), np.sin(np.radians(p.angle_inc_E_field))])
+    dk, kpnts, paths = SBE.mesh(p, E_dir)
+    return E_dir, paths
+
+
+def test_symmetry_reduction_keeps_the_mesh_of_a_gauge_without_the_mirror():
+    # The mirror paths of BiTe give different time signals, their wavefunction gauges differ
+    E_dir, paths = mirror_mesh(4)
+    reduced, weights = SBE.irreducible_paths(paths, E_dir, SBE.sys.model_values)
+    assert np.array_equal(reduced, paths)
+    assert np.all(weights == 1)
+
+
+@pytest.mark.parametrize('num_paths, irreducible, reduced_weights', [(4, [0, 1], [[2, 0], [2, 0]]),
+                                                                    (3, [0, 1], [[2, 0], [1, 1]])])
+def test_symmetry_reduction_pairs_mirror_paths(num_paths, irreducible, reduced_weights, monkeypatch):
+    monkeypatch.setattr(SBE, 'is_mirror_symmetry', lambda *args: True)
+    E_dir, paths = mirror_mesh(num_paths)
+    reduced, weights = SBE.irreducible_paths(paths, E_dir, SBE.sys.model_values)
+    assert np.array_equal(reduced, paths[irreducible])
+    assert np.array_equal(weights, reduced_weights)
+
+    # A mirror path that is not part of the mesh
+    reduced, weights = SBE.irreducible_paths(paths[:-1], E_dir, SBE.sys.model_values)
+    assert len(reduced) == num_paths - 1
+    assert np.all(weights == 1)
+
+
+def loop_mesh(p, E_dir):
+    '''
+    2line mesh as built k-point by k-point before SBE.mesh was vectorized
+    '''
+    alpha_array = np.linspace(-0.5 + (1/(2*p.Nk_in_path)), 0.5 - (1/(2*p.Nk_in_path)), num=p.Nk_in_path)
+    vec_k_path = E_dir*p.length_path_in_BZ
+    vec_k_ortho = 2.0*np.pi/p.a*p.rel_dist_to_Gamma*np.array([E_dir[1], -E_dir[0]])
+    mesh, paths = [], []
+    for path_index in np.linspace(-p.num_paths+1, p.num_paths-1, num=p.num_paths):
+        path = []
+        for alpha in alpha_array:
+            kpoint = path_index*vec_k_ortho + alpha*vec_k_path
+            mesh.append(kpoint)
+            path.append(kpoint)
+        paths.append(path)
+    return 1.0/p.Nk_in_path*p.length_path_in_BZ, np.array(mesh), np.array(paths)
+
+
+def loop_hex_mesh(Nk1, Nk2, a, b1, b2, align):
+    '''
+    hex_mesh as built k-point by k-point before it was vectorized
+    '''
+    def is_in_hex(p, a):
+        x = np.abs(p[0])
+        y = np.abs(p[1])
+        return ((y <= 2.0*np.pi/(np.sqrt(3)*a)) and (np.sqrt(3.0)*x + y <= 4*np.pi/(np.sqrt(3)*a)))
+
+    def reflect_point(p, a, b1, b2):
+        x = p[0]
+        y = p[1]
+        if (y > 2*np.pi/(np.sqrt(3)*a)):
+            p -= b2
+        elif (y < -2*np.pi/(np.sqrt(3)*a)):
+            p += b2
+        elif (np.sqrt(3)*x + y > 4*np.pi/(np.sqrt(3)*a)):
+            p -= b1 + b2
+        elif (-np.sqrt(3)*x + y < -4*np.pi/(np.sqrt(3)*a)):
+            p -= b1
+        elif (np.sqrt(3)*x + y < -4*np.pi/(np.sqrt(3)*a)):
+            p += b1 + b2
+        elif (-np.sqrt(3)*x + y > 4*np.pi/(np.sqrt(3)*a)):
+            p += b1
+        return p
+
+    mesh, paths = [], []
+    if align == 'M':
+        alpha1 = np.linspace(-0.5 + (1/(2*Nk1)), 0.5 - (1/(2*Nk1)), num=Nk1)
+        alpha2 = np.linspace(-0.5 + (1/(2*Nk2)), 0.5 - (1/(2*Nk2)), num=Nk2)
+        for a2 in alpha2:
+            path_M = []
+            for a1 in alpha1:
+                kpoint = a1*b1 + a2*b2
+                while not is_in_hex(kpoint, a):
+                    kpoint = reflect_point(kpoint, a, b1, b2)
+                mesh.append(kpoint)
+                path_M.append(kpoint)
+            paths.append(path_M)
+    elif align == 'K':
+        b_a1 = 8*np.pi/(a*3)*np.array([1, 0])
+        b_a2 = 4*np.pi/(a*3)*np.array([1, np.sqrt(3)])
+        alpha1 = np.linspace(-0.5 + (1/(2*Nk1)), 1.0 - (1/(2*Nk1)), num=Nk1)
+        alpha2 = np.linspace(0, 0.5 - (1/(2*Nk2)), num=Nk2)
+        for a2 in alpha2:
+            path_K = []
+            for a1 in alpha1:
+                kpoint = a1*b_a1 + a2*b_a2
+                if not is_in_hex(kpoint, a):
+                    kpoint -= 2*np.pi/(a)*np.array([1, 1/np.sqrt(3)])
+                mesh.append(kpoint)
+                path_K.append(kpoint)
+            paths.append(path_K)
+    return np.array(mesh), np.array(paths)
+
+
+def loop_path_neighbours(Nk, Nk_path):
+    '''
+    Periodic next and previous k-point within each path, as derived in fnumba for every k
+    '''
+    neighbours = []
+    for k in range(Nk):
+        k_first = k - k % Nk_path
+        if k == k_first:
+            neighbours.append((k + 1, k_first + Nk_path - 1))
+        elif k == k_first + Nk_path - 1:
+            neighbours.append((k_first, k - 1))
+        else:
+            neighbours.append((k + 1, k - 1))
+    return np.array(neighbours)
+
+
+@pytest.mark.parametrize('angle, num_paths', [(0, 2), (30, 3), (90, 4)])
+def test_mesh_matches_loop_over_k_points(angle, num_paths):
+    p = run_params(angle_inc_E_field=angle, num_paths=num_paths, Nk_in_path=7)
+    E_dir = np.array([np.cos(np.radians(angle)), np.sin(np.radians(angle))])
+    for result, reference in zip(SBE.mesh(p, E_dir), loop_mesh(p, E_dir)):
+        assert np.array_equal(result, reference)
+
+
+@pytest.mark.parametrize('Nk1, Nk2', [(12, 10), (15, 9)])
+@pytest.mark.parametrize('align', ['M', 'K'])
+def test_hex_mesh_matches_loop_over_k_points(Nk1, Nk2, align):
+    for result, reference in zip(SBE.hex_mesh(Nk1, Nk2, params.a, params.b1, params.b2, align),
+                                 loop_hex_mesh(Nk1, Nk2, params.a, params.b1, params.b2, align)):
+        assert np.array_equal(result, reference)
+
+
+@pytest.mark.parametrize('Nk, Nk_path', [(6, 6), (24, 6), (15, 5)])
+def test_path_neighbours_match_loop_over_k_points(Nk, Nk_path):
+    assert np.array_equal(SBE.path_neighbours(Nk, Nk_path), loop_path_neighbours(Nk, Nk_path))
@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import subprocess
+import numpy as np
+from types import SimpleNamespace
+
+repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, repo_dir)
+import params
+import result_cache
+
+
+def cache_params(cache_dir, **changes):
+    values = {name: getattr(params, name) for name in dir(params) if not name.startswith('_')}
+    values['result_cache_dir'] = str(cache_dir)
+    values.update(changes)
+    return SimpleNamespace(**values)
+
+
+def test_run_key_only_depends_on_the_time_signals(tmp_path):
+    key = result_cache.run_key(cache_params(tmp_path))
+    assert result_cache.run_key(params) == key
+    assert result_cache.run_key(cache_params(tmp_path, user_out=False, n_proc=4, batch_paths=True)) == key
+    assert result_cache.run_key(cache_params(tmp_path, E0=params.E0 + 1)) != key
+    assert result_cache.run_key(cache_params(tmp_path, b1=2*params.b1)) != key
+
+
+def test_run_key_is_stable_across_processes():
+    # The key does not depend on the hash seed of the interpreter
+    environment = dict(os.environ, PYTHONHASHSEED='1')
+    key = subprocess.check_output([sys.executable, '-c', 'import params, result_cache; print(result_cache.run_key(params))'],
+                                  cwd=repo_dir, env=environment, universal_newlines=True).strip()
+    assert key == result_cache.run_key(params)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    runs = [cache_params(tmp_path, E0=E0) for E0 in [1.0, 2.0, 3.0]]
+    signals = [[np.full(1000, E0*(i + 1)) for i in range(len(result_cache.signal_names))] for E0 in [1.0, 2.0, 3.0]]
+
+    result_cache.store(runs[0], signals[0])
+    entry_size = os.path.getsize(result_cache.entry_filename(runs[0]))
+    # Room for two entries
+    for run in runs:
+        run.result_cache_size = 2.5*entry_size/1e9
+    result_cache.store(runs[1], signals[1])
+    now = time.time()
+    os.utime(result_cache.entry_filename(runs[0]), (now - 20, now - 20))
+    os.utime(result_cache.entry_filename(runs[1]), (now - 10, now - 10))
+
+    # Loading the older entry makes the other one the least recently used
+    assert np.array_equal(result_cache.load(runs[0])[2], signals[0][2])
+    result_cache.store(runs[2], signals[2])
+
+    assert result_cache.load(runs[1]) is None
+    for run, run_signals in [(runs[0], signals[0]), (runs[2], signals[2])]:
+        for cached, signal in zip(result_cache.load(run), run_signals):
+            assert np.array_equal(cached, signal)
@@ -0,0 +1,51 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import spectra
+
+
+@pytest.mark.parametrize('n_time', [200, 201])
+def test_spectra_match_complex_fft(n_time):
+    rng = np.random.RandomState(3)
+    signals = rng.uniform(-1, 1, (3, n_time))
+    window = np.exp(-np.linspace(-3, 3, n_time)**2)
+    for spectrum, signal in zip(spectra.spectra(signals, window), signals):
+        assert np.allclose(spectrum, np.fft.fftshift(np.fft.fft(signal*window, norm='ortho')), rtol=1e-12, atol=1e-12)
+
+
+def test_angle_resolved_matches_fft_per_angle():
+    rng = np.random.RandomState(4)
+    I_E_dir, I_ortho = rng.uniform(-1, 1, (2, 200))
+    window = np.exp(-np.linspace(-3, 3, 200)**2)
+    angles = np.linspace(0, 2.0*np.pi, 361)
+    Iw_E_dir, Iw_ortho = spectra.spectra([I_E_dir, I_ortho], window)
+    Iw_r = np.sqrt(200)*spectra.angle_resolved(Iw_E_dir, Iw_ortho, angles)
+    for angle, Iw in zip(angles, Iw_r):
+        assert np.allclose(Iw, np.fft.fftshift(np.fft.fft(window*(I_E_dir*np.cos(angle) + I_ortho*np.sin(-angle)))), 
+                           rtol=1e-12, atol=1e-11)
+
+
+def test_harmonic_indices_match_middle_of_window():
+    freq = np.fft.fftshift(np.fft.fftfreq(2000, d=2.0))
+    w = 0.004
+    orders = np.arange(1, 31)
+    for order, index in zip(orders, spectra.harmonic_indices(freq/w, orders)):
+        freq_indices = np.argwhere(np.logical_and(freq/w > float(order)-0.1, freq/w < float(order)+0.1))
+        assert index == freq_indices[int(np.size(freq_indices)/2)]
+
+    # No frequency within the window of the 3rd order
+    with pytest.raises(IndexError):
+        spectra.harmonic_indices(np.array([0.5, 1.0, 2.0, 4.0]), orders[:4])
+
+
+def test_local_maxima_match_loop():
+    rng = np.random.RandomState(5)
+    spectrum = rng.uniform(0, 1, 300)
+    maxima = []
+    for i_freq in range(np.size(spectrum)-1):
+        if spectrum[i_freq] > spectrum[i_freq-1] and spectrum[i_freq] > spectrum[i_freq+1]:
+            maxima.append(i_freq)
+    assert np.array_equal(spectra.local_maxima(spectrum), maxima)
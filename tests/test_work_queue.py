@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import numpy as np
+import multiprocessing as mp
+import pytest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import work_queue
+from convergence import kpoint_signals
+
+# The queue is tested with a cheap stand-in for the solver: the signals of each
+# path only depend on its k-points, so sums over any split of the paths agree
+
+
+def fake_bz_mesh(params):
+    paths = np.arange(params.num_paths*4*2, dtype=float).reshape(params.num_paths, 4, 2) + params.E0
+    return np.array([1.0, 0.0]), 1.0, paths.reshape(-1, 2), paths
+
+
+def fake_main(params, paths=None, signals=None):
+    if signals is None:
+        if paths is None:
+            paths = fake_bz_mesh(params)[3]
+        if params.E0 < 0:
+            raise ValueError('negative field amplitude')
+        t = np.linspace(0, 1, 5)*params.fs_conv
+        signals = [t, np.zeros(5)] + [np.ones(5)*np.sum(paths)*(i + 1) for i in range(len(kpoint_signals))]
+    result = {'t': signals[0]/params.fs_conv, 'A_field': signals[1]}
+    result.update(zip(kpoint_signals, signals[2:]))
+    return result
+
+
+@pytest.fixture
+def fake_solver(monkeypatch):
+    monkeypatch.setattr(work_queue, 'SBE', SimpleNamespace(bz_mesh=fake_bz_mesh, main=fake_main))
+
+
+def run_workers(queue_dir, n_workers):
+    workers = [mp.get_context('fork').Process(target=work_queue.work, args=(queue_dir, 0.05))
+               for _ in range(n_workers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def test_workers_resubmit_crashed_unit(fake_solver, tmp_path):
+    queue_dir = str(tmp_path/'queue')
+    fixed = {'num_paths': 5}
+    n_units = work_queue.submit(queue_dir, {'E0': [1.0, 2.0]}, fixed, paths_per_unit=2, timeout=2)
+    assert n_units == 6
+
+    # A worker claimed unit 0 and died
+    claim = work_queue.claim(queue_dir, 0, 0)
+    os.utime(claim, (time.time() - 10, time.time() - 10))
+
+    run_workers(queue_dir, 3)
+    queue = work_queue.load_queue(queue_dir)
+    states = work_queue.unit_states(queue_dir, queue)
+    assert [state for state, attempts in states] == ['done']*n_units
+    assert states[0][1] == 2
+
+    results = work_queue.reduce(queue_dir, str(tmp_path/'merged.npz'))
+    for i_point, E0 in enumerate([1.0, 2.0]):
+        reference = fake_main(work_queue.point_params({'E0': E0}, fixed))
+        for name in kpoint_signals:
+            assert np.allclose(results[name][i_point], reference[name])
+
+
+def test_failing_unit_is_retried_and_given_up(fake_solver, tmp_path):
+    queue_dir = str(tmp_path/'queue')
+    work_queue.submit(queue_dir, {'E0': [1.0, -1.0]}, {'num_paths': 2}, timeout=60, max_attempts=2)
+
+    run_workers(queue_dir, 2)
+    queue = work_queue.load_queue(queue_dir)
+    states = work_queue.unit_states(queue_dir, queue)
+    assert states == [('done', 1), ('failed', 2)]
+    with open(work_queue.error_file(queue_dir, 1, 1)) as f:
+        assert 'negative field amplitude' in f.read()
+
+    with pytest.raises(SystemExit):
+        work_queue.reduce(queue_dir, str(tmp_path/'merged.npz'))
@@ -0,0 +1,338 @@
+import os
+import ast
+import json
+import time
+import socket
+import argparse
+import threading
+import traceback
+import multiprocessing as mp
+import numpy as np
+from contextlib import contextmanager
+from sys import exit
+
+import params
+import SBE
+from sweep import point_params, grid_points, stack_results
+from convergence import kpoint_signals
+
+'''
+Distributed runs of SBE.main on a shared directory, without MPI.
+submit breaks one run (the defaults of params.py, changed by --set) or a
+sweep over a grid into work units: the k-paths of the mesh of each point in
+chunks of --paths-per-unit, or whole points. Workers on any node that sees
+the directory claim units by creating lock files atomically (O_CREAT|O_EXCL,
+also on NFS), solve them and write their partial time signals. A worker
+refreshes the lock file of its unit while solving it. A unit that raised an
+error (traceback in claims/unit-<unit>.<attempt>.error) or whose lock file
+is older than the timeout (crashed worker or node) is claimed again, after
+max_attempts claims it is given up. reduce sums the time signals of
+the path units of each point, runs the analysis of SBE.main on them and
+writes the time signals and spectra of all points as sweep.py does.
+The output files of each point (print_J_P_I_files of params.py or --set)
+are written to the working directory of reduce, those of whole-point units
+to the working directory of their worker.
+
+    python3 work_queue.py submit queue --paths-per-unit 2 [--grid E0=2.5,5.0] [--set gauge=length]
+    python3 work_queue.py work queue --workers 4        # on each node
+    python3 work_queue.py status queue
+    python3 work_queue.py reduce queue --out run.npz
+
+The clocks of the nodes have to agree to well below the timeout. The path
+units do not use symmetry_reduction, checkpoints or the result cache.
+'''
+
+# Whole points (solved by a worker or analysed by reduce) write their output files as a single run
+output_defaults = {'print_J_P_I_files': params.print_J_P_I_files}
+
+# Path units only return the time signals of their paths
+path_unit_defaults = {'print_J_P_I_files': False, 'energy_plots': False, 'dipole_plots': False, 'profile': False,
+                      'checkpoint': False, 'result_cache': False, 'store_all_timesteps': False}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distributed SBE runs on a shared directory')
+    parser.add_argument('mode', choices=['submit', 'work', 'status', 'reduce'])
+    parser.add_argument('queue', help='queue directory shared by all nodes')
+    parser.add_argument('--grid', action='append', default=[], metavar='NAME=VALUE,VALUE,...',
+                        help='swept parameter of params.py (repeatable)')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='change a parameter of params.py for all points (repeatable)')
+    parser.add_argument('--paths-per-unit', type=int, default=0, help='k-paths per work unit (0: whole points)')
+    parser.add_argument('--timeout', type=float, default=3600, help='seconds after which a silent unit is claimed again')
+    parser.add_argument('--max-attempts', type=int, default=3, help='claims of a unit before it is given up')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes on this node')
+    parser.add_argument('--poll', type=float, default=10, help='seconds between two looks for claimable units')
+    parser.add_argument('--out', default='work_queue.npz', help='file of the merged results')
+    args = parser.parse_args()
+
+    if args.mode == 'submit':
+        grid = {}
+        for setting in args.grid:
+            name, values = setting.split('=', 1)
+            grid[name] = [literal(value) for value in values.split(',')]
+        fixed = {}
+        for setting in args.set:
+            name, value = setting.split('=', 1)
+            fixed[name] = literal(value)
+        n_units = submit(args.queue, grid, fixed, args.paths_per_unit, args.timeout, args.max_attempts)
+        print("Submitted " + str(n_units) + " work units to " + args.queue)
+    elif args.mode == 'work':
+        if args.workers > 1:
+            workers = [mp.get_context('fork').Process(target=work, args=(args.queue, args.poll))
+                       for _ in range(args.workers)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        else:
+            work(args.queue, args.poll)
+        status(args.queue)
+    elif args.mode == 'status':
+        status(args.queue)
+    elif args.mode == 'reduce':
+        reduce(args.queue, args.out)
+
+
+def literal(value):
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+
+def submit(queue_dir, grid={}, fixed={}, paths_per_unit=0, timeout=3600, max_attempts=3):
+    '''
+    Writes the work units of all points of grid (a single point without grid)
+    with the parameters in fixed changed to queue_dir and returns their number
+    '''
+    queue_file = os.path.join(queue_dir, 'queue.json')
+    if os.path.exists(queue_file):
+        exit(queue_dir + " already holds a queue")
+
+    grid = {name: np.asarray(values).tolist() for name, values in grid.items()}
+    units = []
+    for i_point, point in enumerate(grid_points(grid)):
+        if paths_per_unit > 0:
+            E_dir, dk, kpnts, paths = SBE.bz_mesh(point_params(point, fixed))
+            n_units = -(-len(paths)//paths_per_unit)
+            units += [{'point': i_point, 'paths': chunk.tolist()}
+                      for chunk in np.array_split(np.arange(len(paths)), n_units)]
+        else:
+            units.append({'point': i_point, 'paths': None})
+
+    os.makedirs(os.path.join(queue_dir, 'claims'), exist_ok=True)
+    os.makedirs(os.path.join(queue_dir, 'results'), exist_ok=True)
+    queue = {'grid': grid, 'fixed': fixed, 'units': units, 'timeout': timeout, 'max_attempts': max_attempts}
+    queue_file_tmp = queue_file + '.' + str(os.getpid())
+    with open(queue_file_tmp, 'w') as f:
+        json.dump(queue, f, indent=1, default=lambda value: np.asarray(value).tolist())
+    os.replace(queue_file_tmp, queue_file)
+    return len(units)
+
+
+def load_queue(queue_dir):
+    with open(os.path.join(queue_dir, 'queue.json')) as f:
+        return json.load(f)
+
+
+def claim_file(queue_dir, unit, attempt):
+    return os.path.join(queue_dir, 'claims', 'unit-{}.{}'.format(unit, attempt))
+
+
+def result_file(queue_dir, unit):
+    return os.path.join(queue_dir, 'results', 'unit-{}.npz'.format(unit))
+
+
+def error_file(queue_dir, unit, attempt):
+    return claim_file(queue_dir, unit, attempt) + '.error'
+
+
+def unit_states(queue_dir, queue):
+    '''
+    State ('done', 'running', 'pending' or 'failed') and number of claims of each unit
+    '''
+    results = set(os.listdir(os.path.join(queue_dir, 'results')))
+    claims = {}
+    errors = set()
+    for name in os.listdir(os.path.join(queue_dir, 'claims')):
+        if name.endswith('.error'):
+            errors.add(name[:-len('.error')])
+            continue
+        unit, attempt = map(int, name[len('unit-'):].split('.'))
+        claims[unit] = max(claims.get(unit, 0), attempt + 1)
+
+    states = []
+    for unit in range(len(queue['units'])):
+        attempts = claims.get(unit, 0)
+        if os.path.basename(result_file(queue_dir, unit)) in results:
+            state = 'done'
+        elif attempts == 0:
+            state = 'pending'
+        elif os.path.basename(claim_file(queue_dir, unit, attempts - 1)) not in errors and \
+             time.time() - os.path.getmtime(claim_file(queue_dir, unit, attempts - 1)) < queue['timeout']:
+            state = 'running'
+        elif attempts < queue['max_attempts']:
+            # The last claim raised an error or its worker is gone, the unit is resubmitted
+            state = 'pending'
+        else:
+            state = 'failed'
+        states.append((state, attempts))
+    return states
+
+
+def claim(queue_dir, unit, attempt):
+    '''
+    Lock file of the attempt-th claim of unit, None if another worker was first
+    '''
+    filename = claim_file(queue_dir, unit, attempt)
+    try:
+        fd = os.open(filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return None
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'host': socket.gethostname(), 'pid': os.getpid(), 'time': time.time()}, f)
+    return filename
+
+
+@contextmanager
+def heartbeat(filename, interval):
+    '''
+    Refreshes the modification time of filename every interval seconds during the with-block
+    '''
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval):
+            os.utime(filename)
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def work(queue_dir, poll=10):
+    '''
+    Claims and solves units of the queue in queue_dir until every unit is
+    done or failed, returns the number of units solved by this worker
+    '''
+    queue = load_queue(queue_dir)
+    points = grid_points(queue['grid'])
+    solved = 0
+    while True:
+        states = unit_states(queue_dir, queue)
+        if all(state in ['done', 'failed'] for state, attempts in states):
+            return solved
+
+        claimed = None
+        for unit, (state, attempts) in enumerate(states):
+            if state == 'pending':
+                filename = claim(queue_dir, unit, attempts)
+                if filename is not None:
+                    claimed = unit
+                    break
+        if claimed is None:
+            # All remaining units are running on other workers
+            time.sleep(poll)
+            continue
+
+        print("Solving work unit " + str(claimed) + " of " + str(len(states)))
+        try:
+            with heartbeat(filename, queue['timeout']/4):
+                result = solve_unit(queue['units'][claimed], points, queue['fixed'])
+        except (Exception, SystemExit):
+            # SBE.main exits on invalid parameters
+            with open(error_file(queue_dir, claimed, attempts), 'w') as f:
+                f.write(traceback.format_exc())
+            print("Work unit " + str(claimed) + " failed, see " + error_file(queue_dir, claimed, attempts))
+            continue
+        write_result(queue_dir, claimed, result)
+        solved += 1
+
+
+def solve_unit(unit, points, fixed):
+    '''
+    Result of SBE.main for a whole point, or the time signals summed over the paths of a path unit
+    '''
+    point = points[unit['point']]
+    if unit['paths'] is None:
+        return SBE.main(point_params(point, dict(output_defaults, **fixed)))
+
+    run_params = point_params(point, dict(fixed, **path_unit_defaults))
+    E_dir, dk, kpnts, paths = SBE.bz_mesh(run_params)
+    result = SBE.main(run_params, paths[unit['paths']])
+    return {name: result[name] for name in ['t', 'A_field'] + kpoint_signals}
+
+
+def write_result(queue_dir, unit, result):
+    # Written under a temporary name and renamed: a result file is always complete
+    filename = result_file(queue_dir, unit)
+    filename_tmp = filename + '.' + socket.gethostname() + '-' + str(os.getpid())
+    with open(filename_tmp, 'wb') as f:
+        np.savez(f, **result)
+    os.replace(filename_tmp, filename)
+
+
+def load_result(queue_dir, unit):
+    with np.load(result_file(queue_dir, unit)) as result:
+        return {name: result[name] for name in result.files}
+
+
+def status(queue_dir):
+    queue = load_queue(queue_dir)
+    states = unit_states(queue_dir, queue)
+    counts = {name: sum(state == name for state, attempts in states) for name in ['done', 'running', 'pending', 'failed']}
+    print(', '.join('{} {}'.format(count, name) for name, count in counts.items()) + ' of ' + str(len(states)) + ' work units')
+    failed = [unit for unit, (state, attempts) in enumerate(states) if state == 'failed']
+    if failed:
+        print("Failed work units: " + ', '.join(map(str, failed)))
+    for unit, (state, attempts) in enumerate(states):
+        if state != 'done' and os.path.isfile(error_file(queue_dir, unit, attempts - 1)):
+            print("Last error of work unit " + str(unit) + ":")
+            with open(error_file(queue_dir, unit, attempts - 1)) as f:
+                print(f.read())
+    return counts
+
+
+def reduce(queue_dir, filename='work_queue.npz'):
+    '''
+    Merges the units of all points of the queue in queue_dir, writes the
+    results to filename and returns them (stacked over the grid as in sweep.py)
+    '''
+    queue = load_queue(queue_dir)
+    states = unit_states(queue_dir, queue)
+    missing = [unit for unit, (state, attempts) in enumerate(states) if state != 'done']
+    if missing:
+        exit("Work units not done: " + ', '.join(map(str, missing)))
+
+    point_results = []
+    for i_point, point in enumerate(grid_points(queue['grid'])):
+        units = [unit for unit, unit_def in enumerate(queue['units']) if unit_def['point'] == i_point]
+        if queue['units'][units[0]]['paths'] is None:
+            point_results.append(load_result(queue_dir, units[0]))
+            continue
+
+        # Time signals summed over the path units in path order
+        run_params = point_params(point, dict(output_defaults, **queue['fixed']))
+        signals = None
+        for unit in units:
+            result = load_result(queue_dir, unit)
+            if signals is None:
+                # t of the results is in fs
+                signals = [result['t']*run_params.fs_conv, result['A_field']] + \
+                          [np.zeros(np.shape(result[name])) for name in kpoint_signals]
+            for i_signal, name in enumerate(kpoint_signals, start=2):
+                signals[i_signal] = signals[i_signal] + result[name]
+        point_results.append(SBE.main(run_params, signals=signals))
+
+    results = stack_results(queue['grid'], point_results)
+    np.savez(filename, **results)
+    return results
+
+
+if __name__ == "__main__":
+    main()